@@ -5,6 +5,12 @@ info. Output resulting JSON"""
 import pandas as pd
 import numpy as np
 import argparse
+import multiprocessing
+from hgnc_symbols import load_hgnc_symbol_resolver
+from ensembl_tables import read_table, BIOMART_TRANSCRIPTS_SCHEMA, PFAM_SCHEMA
+from json_lines import write_json_lines
+import pipeline_profile
+from pipeline_profile import phase
 
 def main_transcript_id(enst_or_versioned: str) -> str:
     return enst_or_versioned.split(".", 1)[0] if isinstance(enst_or_versioned, str) else enst_or_versioned
@@ -16,34 +22,30 @@ def normalize_cols(df: pd.DataFrame) -> pd.DataFrame:
         df.rename(columns={"transcript_id": "transcript_stable_id"}, inplace=True)
     return df
 
-def add_nested_hgnc(transcripts, hgnc_df):
-    """ Make nested object HGNC symbols per transcript"""
-
-    def get_hgnc_symbol(transcript_id, hgnc_dict):
-        hgnc_symbols = transcripts.loc[transcript_id]
-        if hgnc_symbols.ndim == 1:
-            if pd.isnull(hgnc_symbols.hgnc_symbol):
-                return hgnc_symbols.hgnc_symbol
-            else:
-                if (hgnc_symbols.hgnc_symbol in hgnc_dict):
-                    return [hgnc_dict[hgnc_symbols.hgnc_symbol]]
-                else:
-                    return [hgnc_symbols.hgnc_symbol]
-        else:
-            symbol_list = []
-            for symbol in hgnc_symbols.hgnc_symbol.values:
-                if (symbol in hgnc_dict):
-                    symbol_list.append(hgnc_dict[symbol])
-                else:
-                    symbol_list.append(symbol)
-            return symbol_list
-
-    hgnc_dict = dict()
-    for index, row in hgnc_df.iterrows():
-        for symbol in row['prev_symbol'].split('|'):
-            hgnc_dict[symbol] = index
-
-    hgnc_symbol_list = transcripts.index.drop_duplicates().map(lambda transcript_id: get_hgnc_symbol(transcript_id, hgnc_dict))
+def add_nested_hgnc(transcripts, symbol_resolver):
+    """ Make nested object HGNC symbols per transcript. Approved and previous
+    symbols are matched case-insensitively and replaced by the approved symbol
+    as HGNC spells it, so gene718 becomes GENE718. A symbol approved for one
+    gene is kept even if it is a previous symbol of another. A previous symbol
+    of several genes becomes the first of them in the HGNC file, as in the
+    canonical transcript selection; it used to become the last one"""
+
+    def get_approved_symbol(symbol):
+        return symbol_resolver.resolve(symbol, use_aliases=False) or symbol
+
+    # symbols of all rows of a transcript, in one pass instead of a slow .loc
+    # per transcript
+    symbols_by_transcript = {}
+    for transcript_id, symbol in zip(transcripts.index, transcripts['hgnc_symbol'].tolist()):
+        symbols_by_transcript.setdefault(transcript_id, []).append(symbol)
+
+    def get_hgnc_symbol(transcript_id):
+        hgnc_symbols = symbols_by_transcript[transcript_id]
+        if len(hgnc_symbols) == 1 and pd.isnull(hgnc_symbols[0]):
+            return hgnc_symbols[0]
+        return [get_approved_symbol(symbol) for symbol in hgnc_symbols]
+
+    hgnc_symbol_list = transcripts.index.drop_duplicates().map(get_hgnc_symbol)
     # make one row per transcript_stable_id by removing hgnc_symbol
     unique_transcripts = transcripts.copy().reset_index()
     del unique_transcripts['hgnc_symbol']
@@ -58,78 +60,145 @@ def add_nested_hgnc(transcripts, hgnc_df):
     return unique_transcripts.set_index("transcript_stable_id")
 
 
-def add_nested_transcript_info(transcripts, transcript_info):
-    """ Make nested object with exons and UTR per transcript. """
+EXON_TYPES = ['exon']
+UTR_TYPES = ['five_prime_utr', 'three_prime_utr']
+# rows of exons and UTRs nested per chunk of ensembl_transcript_info.txt
+TRANSCRIPT_INFO_CHUNK_SIZE = 200000
+# transcripts whose exons and UTRs are nested, joined and written at a time
+TRANSCRIPT_BATCH_SIZE = 20000
+
+
+def get_info_keys(columns, feature_type):
+    """Keys of the nested dict of an exon or UTR row of this type"""
+    dropped = ['transcript_stable_id']
+    # For UTRs, remove rank fields present only in Ensembl payload
+    if feature_type in UTR_TYPES:
+        dropped += ['id', 'rank', 'version']
+    if feature_type in EXON_TYPES:
+        dropped += ['type']
+    return [(i, column) for i, column in enumerate(columns) if column not in dropped]
+
+
+def iter_nested_transcript_info(transcript_info_chunks):
+    """Nest exon and UTR rows in a single pass. Yields transcript_stable_id,
+    list of exon dicts and list of UTR dicts for every run of rows of one
+    transcript, so rows sorted by transcript give one item per transcript.
+    Chunks are DataFrames with the columns of ensembl_transcript_info.txt"""
+    keys_by_type = {}
+    transcript_id, exons, utrs = None, [], []
+    for chunk in transcript_info_chunks:
+        chunk = normalize_cols(chunk)
+        columns = list(chunk.columns)
+        transcript_column = columns.index('transcript_stable_id')
+        type_column = columns.index('type')
+        for row in zip(*(chunk[column].tolist() for column in columns)):
+            if row[transcript_column] != transcript_id:
+                if exons or utrs:
+                    yield transcript_id, exons, utrs
+                transcript_id, exons, utrs = row[transcript_column], [], []
+            feature_type = row[type_column]
+            if feature_type not in keys_by_type:
+                keys_by_type[feature_type] = get_info_keys(columns, feature_type)
+            # types are matched case insensitive, but only lowercase types
+            # lose their keys, as before
+            if not isinstance(feature_type, str):
+                continue
+            elif feature_type.lower() in EXON_TYPES:
+                exons.append({column: row[i] for i, column in keys_by_type[feature_type]})
+            elif feature_type.lower() in UTR_TYPES:
+                utrs.append({column: row[i] for i, column in keys_by_type[feature_type]})
+    if exons or utrs:
+        yield transcript_id, exons, utrs
+
+
+def iter_transcript_batches(transcripts, transcript_info_chunks, batch_size=TRANSCRIPT_BATCH_SIZE):
+    """ Make nested object with exons and UTR per transcript, a batch of
+    transcripts at a time. transcripts is indexed by transcript_stable_id and
+    has empty exons and utrs columns. Yields copies of its rows with their
+    exons and UTRs, in the order of the exon and UTR rows, then the rows of
+    transcripts without any. Only the exons and UTRs of one batch are kept as
+    dicts, so the rows of a transcript must be together, as in the GFF3 """
+    exons_by_transcript = {}
+    utrs_by_transcript = {}
+    done = set()
+
+    def get_batch():
+        batch = transcripts.loc[list(exons_by_transcript)].copy()
+        batch['exons'] = [exons or np.nan for exons in exons_by_transcript.values()]
+        batch['utrs'] = [utrs_by_transcript[transcript_id] or np.nan for transcript_id in exons_by_transcript]
+        done.update(exons_by_transcript)
+        exons_by_transcript.clear()
+        utrs_by_transcript.clear()
+        return batch
+
+    for transcript_id, exons, utrs in iter_nested_transcript_info(transcript_info_chunks):
+        if transcript_id not in transcripts.index:
+            continue
+        if transcript_id in done:
+            raise ValueError('Rows of transcript {} are not together in the exon and UTR rows'.format(transcript_id))
+        if transcript_id not in exons_by_transcript and len(exons_by_transcript) == batch_size:
+            yield get_batch()
+        # rows of a transcript that are apart within a batch are merged
+        exons_by_transcript.setdefault(transcript_id, []).extend(exons)
+        utrs_by_transcript.setdefault(transcript_id, []).extend(utrs)
+    if exons_by_transcript:
+        yield get_batch()
+    remaining = transcripts[~transcripts.index.isin(done)]
+    # an empty frame would be written as an empty line
+    if len(remaining) or not done:
+        yield remaining
 
-    def get_list_of_info_dicts(transcript_group):
-        list_of_info_dicts = transcript_group.to_dict(orient='records')
-        for info_dict in list_of_info_dicts:
-            info_dict.pop('transcript_stable_id', None)
 
-            # For UTRs, remove rank fields present only in Ensembl payload
-            if info_dict.get('type') in ['five_prime_utr', 'three_prime_utr']:
-                info_dict.pop('id', None)
-                info_dict.pop('rank', None)
-                info_dict.pop('version', None)
-
-            if info_dict.get('type') == 'exon':
-                info_dict.pop('type', None)
+def add_nested_pfam_domains(transcripts, pfam_domains):
+    """ Add nested PFAM domains, a list of dicts with integer coordinates per
+    transcript"""
+    domains_by_transcript = {}
+    for transcript_id, domain_id, start, end in zip(
+            pfam_domains['versioned_transcript_id'].tolist(),
+            pfam_domains['pfam_domain_id'].tolist(),
+            pfam_domains['pfam_domain_start'].to_numpy(dtype=object, na_value=None).tolist(),
+            pfam_domains['pfam_domain_end'].to_numpy(dtype=object, na_value=None).tolist()):
+        domains_by_transcript.setdefault(transcript_id, []).append(
+            {'pfam_domain_id': domain_id, 'pfam_domain_start': start, 'pfam_domain_end': end})
+
+    transcripts["domains"] = transcripts.index.map(lambda x: domains_by_transcript.get(x, np.nan))
+    return transcripts
 
-        return list_of_info_dicts
 
-    # Split in exons and UTRs
-    exon_info = transcript_info.loc[transcript_info.type.str.lower() == 'exon']
-    utr_info = transcript_info.loc[transcript_info.type.str.lower().isin(['five_prime_utr', 'three_prime_utr'])]
+def get_override_ids(isoform_overrides, column):
+    """Ids without version from column of an isoform override table, by bare
+    ENST id. Empty ids are left out, and so are transcripts with several
+    overrides, for which no single id can be picked"""
+    if column not in isoform_overrides.columns:
+        return pd.Series(dtype=object)
+    ids = isoform_overrides[column].astype(object)
+    ids = ids[~ids.index.duplicated(keep=False)]
+    ids = ids[ids.map(lambda x: isinstance(x, str) and x != '')]
+    return ids.str.split('.').str[0]
 
-    # Group by main transcript id
-    series_of_lists_of_exon_dicts = exon_info.groupby('transcript_stable_id', dropna=False).apply(get_list_of_info_dicts)
-    series_of_lists_of_utr_dicts  = utr_info.groupby('transcript_stable_id', dropna=False).apply(get_list_of_info_dicts)
 
-    transcripts['exons'] = transcripts.index.map(series_of_lists_of_exon_dicts)
-    transcripts['utrs']  = transcripts.index.map(series_of_lists_of_utr_dicts)
-    return transcripts
-
-
-def add_nested_pfam_domains(transcripts, pfam_domains):
-    """ Add nested PFAM domains"""
-    domain_grouped = pfam_domains.groupby("versioned_transcript_id", dropna=False)
-
-    def get_domain_for_transcript(x):
-        try:
-            # Fix for: https://github.com/pandas-dev/pandas/issues/9466
-            # use groupby to get indices, loc is slow for non-unique
-            return pfam_domains.iloc[domain_grouped.groups[x]][
-                'pfam_domain_id pfam_domain_start pfam_domain_end'.split()]
-        except KeyError:
-            return np.nan
-
-    transcripts["domains"] = transcripts.index.map(get_domain_for_transcript)
-    return transcripts
+def resolve_ids(transcript_ids, biomart_ids, column, isoform_overrides_uniprot, isoform_overrides_mskcc):
+    """Pick an id for each versioned transcript id: the mskcc override, else
+    the uniprot override, else the BioMart id by versioned transcript id"""
+    transcript_ids = pd.Series(transcript_ids)
+    bare_ids = transcript_ids.str.split('.', n=1).str[0]
+    # Maybe retire uniprot?
+    resolved = bare_ids.map(get_override_ids(isoform_overrides_mskcc, column))
+    for candidates in (bare_ids.map(get_override_ids(isoform_overrides_uniprot, column)),
+                       transcript_ids.map(biomart_ids)):
+        resolved = resolved.where(resolved.notna(), candidates)
+    return resolved.values
 
 
 def add_refseq(transcripts, refseq, isoform_overrides_uniprot, isoform_overrides_mskcc):
     """Add one refseq id for each transcript. There can be multiple. Pick
     highest number transcript id in that case."""
     refseq = normalize_cols(refseq)
-    refseq_grouped = refseq.groupby("versioned_transcript_id", dropna=False)
-
-    def get_refseq_for_transcript(enst_versioned):
-        bare = main_transcript_id(enst_versioned)
-        # Maybe retire uniprot?
-        for ov in (isoform_overrides_mskcc, isoform_overrides_uniprot):
-            try:
-                override_refseq_id = ov.loc[bare, 'refseq_id']
-                if isinstance(override_refseq_id, str) and override_refseq_id:
-                    return override_refseq_id.split('.')[0]
-            except KeyError:
-                pass
-        # from biomart table (by ENST.X)
-        try:
-            return refseq.iloc[refseq_grouped.groups[enst_versioned]]['refseq_mrna_id'].sort_values(ascending=False).values[0]
-        except KeyError:
-            return np.nan
-
-    transcripts['refseq_mrna_id'] = transcripts.index.map(get_refseq_for_transcript)
+    # from biomart table (by ENST.X)
+    refseq = refseq[~pd.isnull(refseq["refseq_mrna_id"])]
+    biomart_refseq = refseq.groupby("versioned_transcript_id")['refseq_mrna_id'].max()
+    transcripts['refseq_mrna_id'] = resolve_ids(transcripts.index, biomart_refseq, 'refseq_id',
+                                                isoform_overrides_uniprot, isoform_overrides_mskcc)
     return transcripts
 
 
@@ -139,24 +208,9 @@ def add_ccds(transcripts, ccds, isoform_overrides_uniprot, isoform_overrides_msk
     ccds = ccds[~pd.isnull(ccds["ccds_id"])]
     # assume each transcript ENST.X has only one CCDS
     assert not any(ccds["versioned_transcript_id"].duplicated())
-    ccds = ccds.set_index("versioned_transcript_id")
-
-    def get_ccds_for_transcript(enst_versioned):
-        bare = main_transcript_id(enst_versioned)
-        # Maybe retire uniprot?
-        for ov in (isoform_overrides_mskcc, isoform_overrides_uniprot):
-            try:
-                override_ccdsid = ov.loc[bare, 'ccds_id']
-                if isinstance(override_ccdsid, str) and override_ccdsid:
-                    return override_ccdsid.split('.')[0]
-            except KeyError:
-                pass
-        try:
-            return ccds.loc[enst_versioned, 'ccds_id']
-        except KeyError:
-            return np.nan
-
-    transcripts["ccds_id"] = transcripts.index.map(get_ccds_for_transcript)
+    biomart_ccds = ccds.set_index("versioned_transcript_id")['ccds_id']
+    transcripts["ccds_id"] = resolve_ids(transcripts.index, biomart_ccds, 'ccds_id',
+                                         isoform_overrides_uniprot, isoform_overrides_mskcc)
     return transcripts
 
 
@@ -190,6 +244,79 @@ def add_uniprot(transcripts, uniprot):
 
     return transcripts
 
+def read_transcript_info_chunks(ensembl_transcript_info):
+    """Exon and UTR rows of ensembl_transcript_info.txt in chunks, in the
+    text of the file"""
+    for chunk in pd.read_csv(ensembl_transcript_info, sep='\t', dtype=str, chunksize=TRANSCRIPT_INFO_CHUNK_SIZE):
+        yield normalize_cols(chunk)
+
+
+def enrich_transcripts(transcripts, pfam_domains, refseq, ccds, enst_to_uniprot_map,
+                       isoform_overrides_uniprot, isoform_overrides_mskcc, symbol_resolver):
+    """Add RefSeq, CCDS, PFAM domains, HGNC symbols and Uniprot id to the
+    transcripts, indexed by versioned transcript id, and empty exons and utrs
+    columns for iter_transcript_batches. Returns one row per transcript,
+    indexed by transcript_stable_id"""
+    with phase('join') as profiled:
+        transcripts = add_refseq(transcripts, refseq, isoform_overrides_uniprot, isoform_overrides_mskcc)
+        transcripts = add_ccds(transcripts, ccds, isoform_overrides_uniprot, isoform_overrides_mskcc)
+        profiled.rows = len(transcripts)
+
+    with phase('nest') as profiled:
+        # Add nested PFAM domains
+        transcripts = add_nested_pfam_domains(transcripts, pfam_domains)
+
+        # Add nested HGNC, exons and 
+        transcripts = add_nested_hgnc(transcripts, symbol_resolver)
+
+        # transcripts.index is main id from now. Exons and UTRs are streamed
+        # from the file when writing
+        transcripts['exons'] = np.nan
+        transcripts['utrs'] = np.nan
+        profiled.rows = len(transcripts)
+
+    with phase('join uniprot') as profiled:
+        # Add Uniprot id
+        transcripts = add_uniprot(transcripts, enst_to_uniprot_map)
+        profiled.rows = len(transcripts)
+    return transcripts
+
+
+def split_in_shards(transcripts, shards):
+    """Split transcripts, indexed by versioned transcript id, in shards of
+    whole genes. All rows of a transcript go to the shard of the gene of its
+    first row"""
+    gene_codes, genes = pd.factorize(transcripts['gene_stable_id'], use_na_sentinel=False)
+    shard_by_row = pd.Series(gene_codes * shards // max(len(genes), 1), index=transcripts.index)
+    shard_by_row = shard_by_row.groupby(level=0, sort=False, dropna=False).transform('first').values
+    return [transcripts[shard_by_row == shard].copy() for shard in range(shards) if (shard_by_row == shard).any()]
+
+
+# inputs of enrich_transcripts shared with the forked workers
+_shared_inputs = None
+
+def _enrich_shard(transcripts):
+    # phases of the workers are part of the phase of the parent
+    pipeline_profile.stop()
+    return enrich_transcripts(transcripts, **_shared_inputs)
+
+def enrich_transcripts_in_shards(workers, transcripts, **inputs):
+    """Split the transcripts in shards of whole genes and enrich them in a
+    pool of forked workers. Nothing but the HGNC symbol resolver crosses
+    transcripts, and the read-only inputs are inherited by the workers instead
+    of being pickled. Results keep the order of enrich_transcripts"""
+    global _shared_inputs
+    _shared_inputs = inputs
+    try:
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            enriched = pd.concat(pool.map(_enrich_shard, split_in_shards(transcripts, workers)))
+    finally:
+        _shared_inputs = None
+    # one row per transcript, in order of first appearance
+    order = transcripts.index.drop_duplicates().get_indexer(enriched['versioned_transcript_id'])
+    return enriched.iloc[np.argsort(order, kind='stable')]
+
+
 def main(ensembl_biomart_transcripts,
          ensembl_transcript_info,
          ensembl_biomart_pfam,
@@ -199,61 +326,61 @@ def main(ensembl_biomart_transcripts,
          isoform_overrides_uniprot,
          isoform_overrides_mskcc,
          hgnc_symbol_set,
-         ensembl_biomart_transcripts_json
+         ensembl_biomart_transcripts_json,
+         workers=1
          ):
 
-    # Read & normalize
-    transcripts = normalize_cols(pd.read_csv(ensembl_biomart_transcripts, sep="\t", dtype=str))
-    transcript_info = normalize_cols(pd.read_csv(ensembl_transcript_info, sep="\t", dtype=str))
-    pfam_domains = normalize_cols(pd.read_csv(ensembl_biomart_pfam, sep="\t", dtype=str))
+    with phase('load') as profiled:
+        # Read & normalize
+        transcripts = normalize_cols(read_table(ensembl_biomart_transcripts, BIOMART_TRANSCRIPTS_SCHEMA))
+        pfam_domains = normalize_cols(read_table(ensembl_biomart_pfam, PFAM_SCHEMA))
 
-    # Make sure we have full version and bare id in transcripts
-    # Expect transcripts to already include transcript_id_version (ENST.X) and transcript_stable_id (bare)
-    if "versioned_transcript_id" not in transcripts.columns:
-        raise RuntimeError("transcripts file missing versioned_transcript_id")
+        # Make sure we have full version and bare id in transcripts
+        # Expect transcripts to already include transcript_id_version (ENST.X) and transcript_stable_id (bare)
+        if "versioned_transcript_id" not in transcripts.columns:
+            raise RuntimeError("transcripts file missing versioned_transcript_id")
 
-    # Use versioned id as the index for all downstream joins that support versions
-    transcripts.set_index("versioned_transcript_id", inplace=True, drop=True)
+        # Use versioned id as the index for all downstream joins that support versions
+        transcripts.set_index("versioned_transcript_id", inplace=True, drop=True)
 
-    # import refseq
-    refseq = pd.read_csv(ensembl_biomart_refseq, sep="\t")
-    isoform_overrides_uniprot = pd.read_csv(isoform_overrides_uniprot, sep="\t").set_index('enst_id')
+        # import refseq, ccds and uniprot
+        refseq = pd.read_csv(ensembl_biomart_refseq, sep="\t")
+        ccds = pd.read_csv(ensembl_biomart_ccds, sep="\t")
+        enst_to_uniprot_map = pd.read_csv(enst_to_uniprot, sep='\t')
+        isoform_overrides_uniprot = pd.read_csv(isoform_overrides_uniprot, sep="\t").set_index('enst_id')
     
-    isoform_overrides_mskcc = pd.read_csv(isoform_overrides_mskcc, sep="\t")
-    if 'enst_id' in isoform_overrides_mskcc.columns:
-        isoform_overrides_mskcc['enst_id'] = isoform_overrides_mskcc['enst_id'].apply(lambda x: str(x).split('.')[0] if pd.notna(x) else x)
-        isoform_overrides_mskcc = isoform_overrides_mskcc.set_index('enst_id')
-        
-    transcripts = add_refseq(transcripts, refseq, isoform_overrides_uniprot, isoform_overrides_mskcc)
-
-    # import ccds
-    ccds = pd.read_csv(ensembl_biomart_ccds, sep="\t")
-    transcripts = add_ccds(transcripts, ccds, isoform_overrides_uniprot, isoform_overrides_mskcc)
-
-    # Add nested PFAM domains
-    transcripts = add_nested_pfam_domains(transcripts, pfam_domains)
-
-    # Add nested HGNC, exons and 
-    hgnc_df = pd.read_csv(hgnc_symbol_set, sep='\t', usecols = ['symbol', 'prev_symbol'], index_col=0).dropna()
-    transcripts = add_nested_hgnc(transcripts, hgnc_df)
-
-    # transcripts.index is main id from now
-    transcripts = add_nested_transcript_info(transcripts, transcript_info)
-
-    # Add Uniprot id
-    enst_to_uniprot_map = pd.read_csv(enst_to_uniprot, sep='\t')
-    transcripts = add_uniprot(transcripts, enst_to_uniprot_map)
+        isoform_overrides_mskcc = pd.read_csv(isoform_overrides_mskcc, sep="\t")
+        if 'enst_id' in isoform_overrides_mskcc.columns:
+            isoform_overrides_mskcc['enst_id'] = isoform_overrides_mskcc['enst_id'].apply(lambda x: str(x).split('.')[0] if pd.notna(x) else x)
+            isoform_overrides_mskcc = isoform_overrides_mskcc.set_index('enst_id')
+        symbol_resolver = load_hgnc_symbol_resolver(hgnc_symbol_set)
+        profiled.rows = len(transcripts) + len(pfam_domains)
+
+    inputs = dict(pfam_domains=pfam_domains,
+                  refseq=refseq,
+                  ccds=ccds,
+                  enst_to_uniprot_map=enst_to_uniprot_map,
+                  isoform_overrides_uniprot=isoform_overrides_uniprot,
+                  isoform_overrides_mskcc=isoform_overrides_mskcc,
+                  symbol_resolver=symbol_resolver)
+    if workers > 1:
+        with phase('enrich in shards') as profiled:
+            transcripts = enrich_transcripts_in_shards(workers, transcripts, **inputs)
+            profiled.rows = len(transcripts)
+    else:
+        transcripts = enrich_transcripts(transcripts, **inputs)
 
-    transcripts = transcripts.copy()
-    # print records as json
-    transcripts.drop(columns=['versioned_transcript_id'], inplace=True)
+    with phase('nest and write') as profiled:
+        # print records as json
+        transcripts = transcripts.drop(columns=['versioned_transcript_id'])
 
-    # show 1 instead of 1.0
-    transcripts["transcript_id_version"] = pd.to_numeric(transcripts["transcript_id_version"], errors='coerce').astype('Int64').astype(str)
-    # ensure protein_length is integer (or NaN)
-    transcripts["protein_length"] = pd.to_numeric(transcripts["protein_length"], errors='coerce').astype('Int64')
-    transcripts.reset_index().to_json(ensembl_biomart_transcripts_json,
-                                      orient='records', lines=True, compression='gzip')
+        # show 1 instead of 1.0
+        transcripts["transcript_id_version"] = pd.to_numeric(transcripts["transcript_id_version"], errors='coerce').astype('Int64').astype(str)
+        # ensure protein_length is integer (or NaN)
+        transcripts["protein_length"] = pd.to_numeric(transcripts["protein_length"], errors='coerce').astype('Int64')
+        # nest the exons and UTRs of a batch of transcripts and write it before reading the next
+        batches = iter_transcript_batches(transcripts, read_transcript_info_chunks(ensembl_transcript_info))
+        profiled.rows = write_json_lines((batch.reset_index() for batch in batches), ensembl_biomart_transcripts_json)
 
 
 if __name__ == '__main__':
@@ -278,8 +405,14 @@ if __name__ == '__main__':
     parser.add_argument("hgnc_symbol_set", help="common_input/hgnc_complete_set_oct_07_2025.txt")
     parser.add_argument("ensembl_biomart_transcripts_json",
                         help="tmp/ensembl_biomart_transcripts.json.gz")
+    parser.add_argument("-w", "--workers",
+                        help="Number of processes to split the transcripts over, in shards of whole genes",
+                        default=1,
+                        type=int)
+    pipeline_profile.add_profile_argument(parser)
 
     args = parser.parse_args()
+    pipeline_profile.configure(args.ensembl_biomart_transcripts_json, args.profile)
     main(args.ensembl_biomart_transcripts,
          args.ensembl_transcript_info,
          args.ensembl_biomart_pfam,
@@ -289,5 +422,6 @@ if __name__ == '__main__':
          args.vcf2maf_isoform_overrides_uniprot,
          args.vcf2maf_isoform_overrides_mskcc,
          args.hgnc_symbol_set,
-         args.ensembl_biomart_transcripts_json
+         args.ensembl_biomart_transcripts_json,
+         workers=args.workers
          )
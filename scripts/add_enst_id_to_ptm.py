@@ -2,6 +2,9 @@ import pandas as pd
 import os
 import argparse
 import sys
+import pipeline_profile
+from pipeline_profile import phase
+from json_lines import write_json_lines
 
 
 def index_ccds_ids_by_uniprot(ccds_to_uniprot_df):
@@ -63,32 +66,39 @@ def parse_pubmed_ids(pubmed_ids):
 def add_enst_column_to_ptm_files(ccds_to_uniprot_dict, ccds_to_enst_dict, ptm_input_dir):
     frames = []
 
-    # read and process all files under the directory
-    for ptm_file in os.listdir(ptm_input_dir):
-        ptm_df = pd.read_csv(f'{ptm_input_dir}/{ptm_file}',
-                             sep='\t',
-                             names=["uniprot_entry", "uniprot_accession", "position", "type", "pubmed_ids", "sequence"])
-        # parse PubMed ids
-        ptm_df['pubmed_ids'] = ptm_df.apply(lambda row: parse_pubmed_ids(row["pubmed_ids"]), axis=1)
-        # add EnsemblTrascript info
-        ptm_df['ensembl_transcript_ids'] = ptm_df.apply(
-            lambda row: find_enst_by_uniprot(row["uniprot_accession"], ccds_to_uniprot_dict, ccds_to_enst_dict),
-            axis=1)
-        frames.append(ptm_df)
-
-    # combine all frames and output a single PTM file
-    pd.concat(frames).to_json(sys.stdout, orient='records', lines=True)
+    with phase('join') as profiled:
+        # read and process all files under the directory
+        for ptm_file in os.listdir(ptm_input_dir):
+            ptm_df = pd.read_csv(f'{ptm_input_dir}/{ptm_file}',
+                                 sep='\t',
+                                 names=["uniprot_entry", "uniprot_accession", "position", "type", "pubmed_ids", "sequence"])
+            # parse PubMed ids
+            ptm_df['pubmed_ids'] = ptm_df.apply(lambda row: parse_pubmed_ids(row["pubmed_ids"]), axis=1)
+            # add EnsemblTrascript info
+            ptm_df['ensembl_transcript_ids'] = ptm_df.apply(
+                lambda row: find_enst_by_uniprot(row["uniprot_accession"], ccds_to_uniprot_dict, ccds_to_enst_dict),
+                axis=1)
+            frames.append(ptm_df)
+        profiled.rows = sum(len(ptm_df) for ptm_df in frames)
+
+    with phase('write') as profiled:
+        # combine all frames and output a single PTM file
+        profiled.rows = write_json_lines(pd.concat(frames), sys.stdout)
 
 
 def main(ccds_to_uniprot, ccds_to_sequence, ccds_to_sequence_override, ptm_input_dir):
-    # parse ccds mapping files
-    ccds_to_uniprot_df = pd.read_csv(ccds_to_uniprot, sep='\t')
-    ccds_to_sequence_df = pd.read_csv(ccds_to_sequence, sep='\t')
-    ccds_to_sequence_override_df = pd.read_csv(ccds_to_sequence_override, sep='\t')
-
-    # create dictionaries
-    ccds_to_uniprot_dict = index_ccds_ids_by_uniprot(ccds_to_uniprot_df)
-    ccds_to_enst_dict = index_enst_by_ccds_ids(pd.concat([ccds_to_sequence_df, ccds_to_sequence_override_df]))
+    with phase('load') as profiled:
+        # parse ccds mapping files
+        ccds_to_uniprot_df = pd.read_csv(ccds_to_uniprot, sep='\t')
+        ccds_to_sequence_df = pd.read_csv(ccds_to_sequence, sep='\t')
+        ccds_to_sequence_override_df = pd.read_csv(ccds_to_sequence_override, sep='\t')
+        profiled.rows = len(ccds_to_uniprot_df) + len(ccds_to_sequence_df) + len(ccds_to_sequence_override_df)
+
+    with phase('normalize') as profiled:
+        # create dictionaries
+        ccds_to_uniprot_dict = index_ccds_ids_by_uniprot(ccds_to_uniprot_df)
+        ccds_to_enst_dict = index_enst_by_ccds_ids(pd.concat([ccds_to_sequence_df, ccds_to_sequence_override_df]))
+        profiled.rows = len(ccds_to_uniprot_dict) + len(ccds_to_enst_dict)
 
     # add ENST to PTM files
     add_enst_column_to_ptm_files(ccds_to_uniprot_dict, ccds_to_enst_dict, ptm_input_dir)
@@ -104,6 +114,8 @@ if __name__ == "__main__":
                         help="common_input/CCDS2Sequence.override.txt")
     parser.add_argument("ptm_input_dir",
                         help="ptm/input")
+    pipeline_profile.add_profile_argument(parser)
     args = parser.parse_args()
+    pipeline_profile.configure(None, args.profile)
 
     main(args.ccds_to_uniprot, args.ccds_to_sequence, args.ccds_to_sequence_override, args.ptm_input_dir)
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""Generate a deterministic, synthetic set of pipeline inputs for benchmarks.
+
+At scale 1 the data resembles one human Ensembl release in size: ~42k HGNC
+genes, ~55k Ensembl genes, ~250k transcripts, ~1.6M exons and UTRs, plus the
+BioMart pfam/refseq/ccds tables, isoform overrides, UniProt and CCDS mappings,
+dbPTM files and SignalDB mutation files. All row counts scale linearly, so
+scale 5 and 20 give 5x and 20x human size. The output directory mirrors the
+data directory of the Makefile:
+
+    common_input/   HGNC complete set, isoform overrides, ignored genes,
+                    OncoKB cancer genes, CCDS mappings
+    input/          ensembl_biomart_{pfam,refseq,ccds}.txt
+    tmp/            ensembl_canonical_data.txt, ensembl_biomart_transcripts.txt,
+                    annotations.gff3.gz, ensembl_transcript_info.txt
+    uniprot/        enst_to_uniprot_mapping_id.txt
+    ptm/input/      dbPTM files
+    signal/input/   SignalDB mutation files
+"""
+
+import argparse
+import contextlib
+import gzip
+import itertools
+import json
+import os
+import random
+
+# sizes at scale 1
+HUMAN_HGNC_GENES = 42000
+HUMAN_UNNAMED_GENES = 13000
+HUMAN_SIGNAL_VARIANTS = 20000
+HUMAN_PTM_SITES = 80000
+
+CHROMOSOMES = [str(c) for c in range(1, 23)] + ['X', 'Y', 'MT']
+TUMOR_TYPES = ['Breast', 'Colorectal', 'Lung', 'Prostate', 'Pancreas', 'Ovarian', 'Melanoma', 'Glioma']
+POPULATIONS = ['afr', 'amr', 'asj', 'eas', 'fin', 'nfe', 'oth', 'sas']
+SIGNATURES = ['1', '3', '5', '8', 'APOBEC', 'MMR', 'SMOKING', 'UV']
+PTM_TYPES = ['Acetylation', 'Methylation', 'Phosphorylation', 'Sumoylation', 'Ubiquitination',
+             'N-linkedGlycosylation', 'O-linkedGlycosylation', 'S-nitrosylation']
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+BASES = 'ACGT'
+
+COMPLETE_MARKER = '.complete.json'
+
+CCDS_SEQUENCE_HEADER = ['#ccds', 'original_member', 'current_member', 'source', 'nucleotide_ID', 'protein_ID',
+                        'status_in_CCDS', 'sequence_status']
+GENE_TABLES = {
+    'tmp/ensembl_canonical_data.txt': ['gene_stable_id', 'transcript_stable_id', 'versioned_transcript_id', 'hgnc_symbol',
+                                       'hgnc_id', 'is_canonical', 'transcript_id_version', 'protein_stable_id',
+                                       'protein_length'],
+    'tmp/ensembl_biomart_transcripts.txt': ['transcript_stable_id', 'versioned_transcript_id', 'transcript_id_version',
+                                            'gene_stable_id', 'hgnc_symbol', 'protein_stable_id', 'protein_length'],
+    'tmp/annotations.gff3.gz': None,
+    'tmp/ensembl_transcript_info.txt': ['transcript_id', 'type', 'id', 'start', 'end', 'rank', 'strand', 'version'],
+    'input/ensembl_biomart_pfam.txt': ['Gene stable ID', 'Transcript stable ID', 'Versioned transcript ID', 'Gene name',
+                                       'Pfam domain ID', 'Pfam domain start', 'Pfam domain end'],
+    'input/ensembl_biomart_refseq.txt': ['Transcript stable ID', 'Versioned transcript ID', 'RefSeq mRNA ID'],
+    'input/ensembl_biomart_ccds.txt': ['Transcript stable ID', 'Versioned transcript ID', 'CCDS ID'],
+    'uniprot/enst_to_uniprot_mapping_id.txt': ['enst_id', 'final_uniprot_id'],
+    'common_input/hgnc_complete_set.txt': ['hgnc_id', 'symbol', 'name', 'locus_group', 'locus_type', 'status',
+                                           'location', 'location_sortable', 'alias_symbol', 'alias_name', 'prev_symbol',
+                                           'prev_name', 'gene_group', 'gene_group_id', 'date_approved_reserved',
+                                           'date_modified', 'entrez_id', 'ensembl_gene_id', 'vega_id', 'ucsc_id', 'ena',
+                                           'refseq_accession', 'ccds_id', 'uniprot_ids', 'pubmed_id', 'mgd_id', 'omim_id'],
+    'common_input/isoform_overrides_uniprot.txt': ['enst_id', 'gene_name', 'refseq_id', 'ccds_id'],
+    'common_input/isoform_overrides_at_mskcc.txt': ['gene_name', 'refseq_id', 'enst_id', 'note'],
+    'common_input/isoform_overrides_genome_nexus.txt': ['enst_id', 'gene_name', 'protein_stable_id', 'gene_stable_id',
+                                                        'comment'],
+    'common_input/oncokb_cancer_genes_list.txt': ['Hugo Symbol', 'Entrez Gene ID'],
+    'common_input/ignored_genes.txt': None,
+    'common_input/CCDS2UniProtKB.current.txt': ['#ccds', 'RefSeq', 'UniProtKB'],
+    'common_input/CCDS2Sequence.current.txt': CCDS_SEQUENCE_HEADER,
+    'common_input/CCDS2Sequence.override.txt': CCDS_SEQUENCE_HEADER,
+}
+
+
+def is_generated(out_dir, scale, seed):
+    """True if out_dir holds a complete data set generated with these parameters"""
+    try:
+        with open(os.path.join(out_dir, COMPLETE_MARKER)) as marker:
+            return json.load(marker) == {'scale': scale, 'seed': seed}
+    except (OSError, ValueError):
+        return False
+
+
+def write_row(f, values):
+    f.write('\t'.join('' if value is None else str(value) for value in values) + '\n')
+
+
+def open_tables(stack, out_dir, headers):
+    """Open a TSV file for each relative path in headers and write the header"""
+    tables = {}
+    for path, header in headers.items():
+        file_name = os.path.join(out_dir, path)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        if file_name.endswith('.gz'):
+            f = stack.enter_context(gzip.open(file_name, 'wt', compresslevel=1))
+        else:
+            f = stack.enter_context(open(file_name, 'w'))
+        if header is not None:
+            write_row(f, header)
+        tables[path] = f
+    return tables
+
+
+def make_exons(rnd, start, strand, exon_ids):
+    """Exons as (exon id, start, end, version), ranked in transcription direction"""
+    exons, position = [], start + rnd.randint(0, 2000)
+    for _ in range(rnd.choice([1, 2, 2, 3, 3, 4, 5, 6, 7, 9, 11, 15])):
+        length = rnd.randint(50, 400)
+        exons.append(('ENSE{:011d}'.format(next(exon_ids)), position, position + length - 1, rnd.choice([1, 1, 2])))
+        position += length + rnd.randint(100, 8000)
+    return exons if strand == '+' else exons[::-1]
+
+
+def make_utrs(exons, strand):
+    """Five prime UTR in the first exon and three prime UTR in the last exon"""
+    utrs = []
+    for utr_type, (_, start, end, _) in [('five_prime_UTR', exons[0]), ('three_prime_UTR', exons[-1])]:
+        length = (end - start) // 3
+        at_exon_start = (utr_type == 'five_prime_UTR') == (strand == '+')
+        utrs.append((utr_type, start, start + length) if at_exon_start else (utr_type, end - length, end))
+    return utrs
+
+
+def write_gene(tables, rnd, gene, chromosome, start, ids):
+    """Write all rows of one Ensembl gene. Returns the gene end position"""
+    gff = tables['tmp/annotations.gff3.gz']
+    transcript_info = tables['tmp/ensembl_transcript_info.txt']
+    symbol = gene['ensembl_symbol']
+    strand = rnd.choice('+-')
+    numeric_strand = '1' if strand == '+' else '-1'
+    n_transcripts = rnd.choice([1, 1, 2, 2, 3, 4, 4, 5, 6, 8, 10, 14])
+    canonical = rnd.randrange(n_transcripts) if rnd.random() < 0.97 else None
+    gene['transcripts'] = []
+    gff_lines = []
+
+    for t in range(n_transcripts):
+        number = next(ids['transcript'])
+        transcript_stable_id = 'ENST{:011d}'.format(number)
+        version = rnd.choice([1, 1, 1, 2, 2, 3, 4, 5, 7, 11])
+        versioned_transcript_id = '{}.{}'.format(transcript_stable_id, version)
+        coding = gene['protein_coding'] and rnd.random() < 0.8
+        protein_stable_id = 'ENSP{:011d}.{}'.format(number, version) if coding else None
+        protein_length = rnd.randint(40, 3000) if coding else None
+        exons = make_exons(rnd, start, strand, ids['exon'])
+        gene['transcripts'].append({'transcript_stable_id': transcript_stable_id,
+                                    'versioned_transcript_id': versioned_transcript_id,
+                                    'protein_stable_id': protein_stable_id,
+                                    'protein_length': protein_length})
+
+        # Ensembl lists a few transcripts again under a previous symbol
+        row_symbols = [symbol]
+        if gene['previous_symbols'] and rnd.random() < 0.02:
+            row_symbols.append(gene['previous_symbols'][0])
+        for row_symbol in row_symbols:
+            write_row(tables['tmp/ensembl_canonical_data.txt'],
+                      [gene['gene_stable_id'], transcript_stable_id, versioned_transcript_id, row_symbol,
+                       gene['hgnc_id'], '1' if t == canonical else '0', version, protein_stable_id, protein_length])
+            write_row(tables['tmp/ensembl_biomart_transcripts.txt'],
+                      [transcript_stable_id, versioned_transcript_id, version, gene['gene_stable_id'], row_symbol,
+                       protein_stable_id, protein_length])
+
+        attributes = 'ID=transcript:{0};Parent=gene:{1};Name={2}-{3};biotype={4};transcript_id={0};version={5}'.format(
+            transcript_stable_id, gene['gene_stable_id'], symbol or gene['gene_stable_id'], 201 + t,
+            'protein_coding' if coding else 'retained_intron', version)
+        if t == canonical:
+            attributes += ';tag=Ensembl_canonical'
+        gff_lines.append([chromosome, 'havana', 'mRNA' if coding else 'lnc_RNA',
+                          min(exon[1] for exon in exons), max(exon[2] for exon in exons), '.', strand, '.', attributes])
+        for rank, (exon_id, exon_start, exon_end, exon_version) in enumerate(exons, 1):
+            gff_lines.append([chromosome, 'havana', 'exon', exon_start, exon_end, '.', strand, '.',
+                              'Parent=transcript:{0};Name={1};constitutive=0;ensembl_end_phase=-1;ensembl_phase=-1;'
+                              'exon_id={1};rank={2};version={3}'.format(transcript_stable_id, exon_id, rank, exon_version)])
+            write_row(transcript_info, [transcript_stable_id, 'exon', exon_id, exon_start, exon_end, rank,
+                                        numeric_strand, exon_version])
+        if coding:
+            for utr_type, utr_start, utr_end in make_utrs(exons, strand):
+                gff_lines.append([chromosome, 'havana', utr_type, utr_start, utr_end, '.', strand, '.',
+                                  'Parent=transcript:{}'.format(transcript_stable_id)])
+                write_row(transcript_info, [transcript_stable_id, utr_type, None, utr_start, utr_end, None,
+                                            numeric_strand, None])
+            for _, exon_start, exon_end, _ in exons:
+                gff_lines.append([chromosome, 'havana', 'CDS', exon_start, exon_end, '.', strand, '0',
+                                  'ID=CDS:{0};Parent=transcript:{1};protein_id={0}'.format(
+                                      protein_stable_id.split('.')[0], transcript_stable_id)])
+        if t == canonical:
+            gene['canonical'] = gene['transcripts'][-1]
+
+    end = max(line[4] for line in gff_lines)
+    write_row(gff, [chromosome, 'ensembl_havana', 'gene', start, end, '.', strand, '.',
+                    'ID=gene:{0};Name={1};biotype={2};gene_id={0};logic_name=ensembl_havana_gene;version={3}'.format(
+                        gene['gene_stable_id'], symbol or gene['gene_stable_id'],
+                        'protein_coding' if gene['protein_coding'] else 'lncRNA', rnd.randint(1, 20))])
+    for line in gff_lines:
+        write_row(gff, line)
+    gff.write('###\n')
+    return end
+
+
+def write_transcript_annotations(tables, rnd, gene, ids):
+    """BioMart pfam, refseq and ccds rows, UniProt and CCDS mappings"""
+    for transcript in gene['transcripts']:
+        transcript_stable_id = transcript['transcript_stable_id']
+        versioned_transcript_id = transcript['versioned_transcript_id']
+        coding = transcript['protein_length'] is not None
+        if coding and rnd.random() < 0.7:
+            for _ in range(rnd.randint(1, 4)):
+                domain_start = rnd.randint(1, max(1, transcript['protein_length'] - 30))
+                write_row(tables['input/ensembl_biomart_pfam.txt'],
+                          [gene['gene_stable_id'], transcript_stable_id, versioned_transcript_id, gene['ensembl_symbol'],
+                           'PF{:05d}'.format(rnd.randint(1, 19000)), domain_start, domain_start + rnd.randint(20, 300)])
+        refseqs = ['NM_{:06d}'.format(rnd.randint(1, 999999)) for _ in range(rnd.choice([1, 1, 2]))] \
+            if coding and rnd.random() < 0.4 else [None]
+        for refseq in refseqs:
+            write_row(tables['input/ensembl_biomart_refseq.txt'], [transcript_stable_id, versioned_transcript_id, refseq])
+        ccds = None
+        if coding and rnd.random() < 0.25:
+            ccds = 'CCDS{}.{}'.format(next(ids['ccds']), rnd.randint(1, 3))
+            write_row(tables['common_input/CCDS2UniProtKB.current.txt'],
+                      [ccds, 'NP_{:06d}.1'.format(rnd.randint(1, 999999)), gene['accession'] +
+                       ('-{}'.format(rnd.randint(2, 4)) if rnd.random() < 0.2 else '')])
+            for member, protein in [('NM_{:06d}.1'.format(rnd.randint(1, 999999)), 'NP_{:06d}.1'.format(rnd.randint(1, 999999))),
+                                    (versioned_transcript_id, transcript['protein_stable_id'])]:
+                write_row(tables['common_input/CCDS2Sequence.current.txt'],
+                          [ccds, 1, 1, 'NCBI' if member.startswith('NM') else 'EBI,WTSI', member, protein, 'Public', 1])
+        write_row(tables['input/ensembl_biomart_ccds.txt'], [transcript_stable_id, versioned_transcript_id, ccds])
+        if coding and rnd.random() < 0.6:
+            write_row(tables['uniprot/enst_to_uniprot_mapping_id.txt'], [transcript_stable_id, gene['accession']])
+
+
+def write_hgnc_gene(tables, rnd, gene, chromosome):
+    symbol = gene['symbol']
+    withdrawn = gene['withdrawn']
+    band = '{}{}{}.{}'.format(chromosome, rnd.choice('pq'), rnd.randint(11, 36), rnd.randint(1, 3))
+    write_row(tables['common_input/hgnc_complete_set.txt'],
+              [gene['hgnc_id'], symbol, 'entry withdrawn' if withdrawn else '{} protein'.format(symbol.lower()),
+               'protein-coding gene' if gene['protein_coding'] else 'non-coding RNA',
+               'gene with protein product' if gene['protein_coding'] else 'RNA, long non-coding',
+               'Entry Withdrawn' if withdrawn else 'Approved', band, band.zfill(10),
+               '"{}"'.format('|'.join(gene['aliases'])) if len(gene['aliases']) > 1 else ''.join(gene['aliases']),
+               None,
+               '"{}"'.format('|'.join(gene['previous_symbols'])) if len(gene['previous_symbols']) > 1 else ''.join(gene['previous_symbols']),
+               None, 'Gene group {}'.format(rnd.randint(1, 2000)), rnd.randint(1, 2000), '1998-01-01', '2025-10-07',
+               gene['number'] + 1000, None if withdrawn else gene['gene_stable_id'], None, 'uc{:06d}'.format(gene['number']),
+               'AB{:06d}'.format(gene['number']), '|'.join(gene['refseqs']), None,
+               gene['accession'] if gene['protein_coding'] else None, rnd.randint(1000000, 39999999),
+               'MGI:{}'.format(gene['number']), rnd.randint(100000, 699999)])
+
+
+def write_isoform_overrides(tables, rnd, gene):
+    canonical = gene.get('canonical')
+    coding = [transcript for transcript in gene['transcripts'] if transcript['protein_length'] is not None]
+    if not coding:
+        return
+    override = rnd.choice(coding) if canonical is None or rnd.random() < 0.1 else canonical
+    if rnd.random() < 0.45:
+        write_row(tables['common_input/isoform_overrides_uniprot.txt'],
+                  [override['transcript_stable_id'], gene['symbol'], gene['refseqs'][0] + '.1',
+                   'CCDS{}.1'.format(gene['number'] + 1)])
+    if rnd.random() < 0.02:
+        write_row(tables['common_input/isoform_overrides_at_mskcc.txt'],
+                  [gene['symbol'], gene['refseqs'][0] + '.2', override['versioned_transcript_id'],
+                   rnd.choice([None, None, 'clinical'])])
+    if rnd.random() < 0.002:
+        write_row(tables['common_input/isoform_overrides_genome_nexus.txt'],
+                  [override['versioned_transcript_id'], gene['symbol'], override['protein_stable_id'],
+                   gene['gene_stable_id'], None])
+
+
+def generate_genes(out_dir, scale, rnd):
+    """Write all gene and transcript level tables. Returns the HGNC genes"""
+    n_hgnc_genes = max(1, int(HUMAN_HGNC_GENES * scale))
+    n_genes = n_hgnc_genes + int(HUMAN_UNNAMED_GENES * scale)
+    n_cancer_genes = max(1, n_hgnc_genes // 40)
+    ids = {'transcript': itertools.count(1), 'exon': itertools.count(1), 'ccds': itertools.count(1)}
+    hgnc_genes = []
+
+    with contextlib.ExitStack() as stack:
+        tables = open_tables(stack, out_dir, GENE_TABLES)
+        gff = tables['tmp/annotations.gff3.gz']
+        gff.write('##gff-version 3\n')
+        for chromosome in CHROMOSOMES:
+            gff.write('##sequence-region   {} 1 250000000\n'.format(chromosome))
+
+        # genes are laid out along the chromosomes in random order
+        gene_numbers = list(range(n_genes))
+        rnd.shuffle(gene_numbers)
+        position = 0
+        for i, number in enumerate(gene_numbers):
+            chromosome = CHROMOSOMES[i * len(CHROMOSOMES) // n_genes]
+            if i == 0 or chromosome != CHROMOSOMES[(i - 1) * len(CHROMOSOMES) // n_genes]:
+                position = 10000
+            named = number < n_hgnc_genes
+            gene = {'number': number,
+                    'symbol': 'GENE{}'.format(number) if named else None,
+                    'hgnc_id': 'HGNC:{}'.format(number + 1) if named else None,
+                    'gene_stable_id': 'ENSG{:011d}'.format(number * 2 + 1),
+                    'accession': 'P{:06d}'.format(number),
+                    'protein_coding': rnd.random() < 0.55,
+                    'refseqs': ['NM_{:06d}'.format(number)],
+                    'previous_symbols': [],
+                    'aliases': []}
+            # withdrawn HGNC entries are no longer annotated in Ensembl
+            gene['withdrawn'] = named and number >= n_cancer_genes and rnd.random() < 0.01
+            gene['ensembl_symbol'] = None if gene['withdrawn'] else gene['symbol']
+            if named and not gene['withdrawn']:
+                if rnd.random() < 0.15:
+                    gene['previous_symbols'] = ['OLDGENE{}'.format(number), 'FORMER{}'.format(number)][:rnd.choice([1, 1, 2])]
+                if rnd.random() < 0.3:
+                    gene['aliases'] = ['ALIAS{}'.format(number), 'ALT{}'.format(number)][:rnd.choice([1, 2])]
+                if rnd.random() < 0.2:
+                    gene['refseqs'].append('NM_{:06d}'.format(number + 500000))
+            elif rnd.random() < 0.3:
+                # RNA genes and ignored genes have a symbol that is not in HGNC
+                gene['ensembl_symbol'] = rnd.choice(['MIR{}', 'LINC{:05d}', 'RNU{}', 'IGNORED{}']).format(number)
+                if gene['ensembl_symbol'].startswith('IGNORED'):
+                    tables['common_input/ignored_genes.txt'].write(gene['ensembl_symbol'].lower() + '\n')
+
+            position = write_gene(tables, rnd, gene, chromosome, position, ids) + rnd.randint(1000, 50000)
+            write_transcript_annotations(tables, rnd, gene, ids)
+            if named:
+                write_hgnc_gene(tables, rnd, gene, chromosome)
+                write_isoform_overrides(tables, rnd, gene)
+                if number < n_cancer_genes:
+                    write_row(tables['common_input/oncokb_cancer_genes_list.txt'], [gene['symbol'], number + 1000])
+                del gene['transcripts']
+                hgnc_genes.append(gene)
+
+        transcript_number = next(ids['transcript'])
+        write_row(tables['common_input/CCDS2Sequence.override.txt'],
+                  ['CCDS{}.1'.format(next(ids['ccds'])), 1, 1, 'EBI,WTSI', 'ENST{:011d}.1'.format(transcript_number),
+                   'ENSP{:011d}.1'.format(transcript_number), 'Accepted', 1])
+    return hgnc_genes
+
+
+def generate_signal(out_dir, scale, rnd, hgnc_genes):
+    """Write the seven SignalDB files, sharing variants like the real export"""
+    n_variants = max(1, int(HUMAN_SIGNAL_VARIANTS * scale))
+
+    def variant():
+        gene = rnd.choice(hgnc_genes)
+        start = rnd.randint(10000, 200000000)
+        kind = rnd.random()
+        if kind < 0.8:
+            return [gene['symbol'], rnd.choice(CHROMOSOMES[:24]), start, start, rnd.choice(BASES), rnd.choice(BASES)]
+        if kind < 0.9:
+            return [gene['symbol'], rnd.choice(CHROMOSOMES[:24]), start, start + 1, '-', rnd.choice(BASES) * 3]
+        return [gene['symbol'], rnd.choice(CHROMOSOMES[:24]), start, start + 2, rnd.choice(BASES) * 3, '-']
+
+    common_header = ['Hugo_Symbol', 'Chromosome', 'Start_Position', 'End_Position', 'Reference_Allele', 'Alternate_Allele']
+    count_header = common_header + ['classifier_pathogenic_final', 'penetrance'] + \
+        [tumor_type + suffix for tumor_type in TUMOR_TYPES for suffix in ['_tumortype_count', '_variant_count']]
+
+    def counts():
+        return [rnd.choice(['Pathogenic', 'Benign', 'VUS']), rnd.choice(['High', 'Moderate', 'Low', 'Uncertain'])] + \
+            [value for _ in TUMOR_TYPES for value in (rnd.randint(100, 5000), rnd.randint(0, 50))]
+
+    somatic = [variant() for _ in range(n_variants)]
+    germline = [variant() for _ in range(n_variants)]
+    signal_dir = os.path.join(out_dir, 'signal', 'input')
+    os.makedirs(signal_dir, exist_ok=True)
+
+    def write_table(file_name, header, rows):
+        with open(os.path.join(signal_dir, file_name), 'w') as f:
+            write_row(f, header)
+            for row in rows:
+                write_row(f, row)
+
+    write_table('somatic_mutations_by_tumortype_merge.txt', count_header, (v + counts() for v in somatic))
+    write_table('mutations_cnv_by_tumortype_merge.txt', count_header, (v + counts() for v in germline))
+    write_table('biallelic_by_tumortype_merge.txt', count_header,
+                (v + counts() for v in germline if rnd.random() < 0.5))
+    write_table('mutations_QCpass_by_tumortype_merge.txt', count_header,
+                (v + counts() for v in germline if rnd.random() < 0.8))
+    write_table('signaldb_all_variants_frequencies.txt',
+                common_header + ['n_' + p for p in POPULATIONS] + ['f_' + p for p in POPULATIONS] + ['n_germline_homozygous'],
+                (v + [rnd.randint(0, 20000) for _ in POPULATIONS] + [round(rnd.random() / 100, 6) for _ in POPULATIONS] +
+                 [rnd.randint(0, 10)] for v in germline if rnd.random() < 0.9))
+    write_table('signaldb_msk_expert_review_variants.txt',
+                common_header[:4] + ['Variant_Classification', 'Variant_Type', 'Strand'] + common_header[4:],
+                (v[:4] + ['Missense_Mutation', 'SNP', '+'] + v[4:] for v in germline if rnd.random() < 0.05))
+    write_table('signaldb_variants_by_cancertype_summary_statistics.txt',
+                common_header + ['Proposed_level', 'n_cancer_type_count', 'f_cancer_type_count', 'f_biallelic', 'age_at_dx',
+                                 'tmb', 'msi_score', 'n_with_sig'] + ['Sig.' + s for s in SIGNATURES] +
+                ['lst', 'ntelomeric_ai', 'fraction_loh', 'n_germline_homozygous'],
+                (v + [tumor_type, rnd.randint(1, 500), round(rnd.random(), 4), round(rnd.random(), 4), rnd.randint(20, 90),
+                      round(rnd.uniform(0, 40), 2), round(rnd.uniform(0, 10), 2), rnd.randint(0, 50)] +
+                 [rnd.randint(0, 20) for _ in SIGNATURES] +
+                 [round(rnd.uniform(0, 30), 1), round(rnd.uniform(0, 30), 1), round(rnd.random(), 3), rnd.randint(0, 5)]
+                 for v in germline if rnd.random() < 0.5
+                 for tumor_type in rnd.sample(TUMOR_TYPES, rnd.randint(1, 4))))
+
+
+def generate_ptm(out_dir, scale, rnd, hgnc_genes):
+    """Write dbPTM files: entry, accession, position, type, PubMed ids, window"""
+    accessions = [gene['accession'] for gene in hgnc_genes if gene['protein_coding']] or ['P000000']
+    ptm_dir = os.path.join(out_dir, 'ptm', 'input')
+    os.makedirs(ptm_dir, exist_ok=True)
+    with contextlib.ExitStack() as stack:
+        ptm_files = {ptm_type: stack.enter_context(open(os.path.join(ptm_dir, ptm_type + '.txt'), 'w'))
+                     for ptm_type in PTM_TYPES}
+        for _ in range(max(1, int(HUMAN_PTM_SITES * scale))):
+            ptm_type = rnd.choice(PTM_TYPES)
+            accession = rnd.choice(accessions)
+            pubmed_ids = ';'.join(str(rnd.randint(1000000, 39999999)) for _ in range(rnd.randint(1, 3)))
+            write_row(ptm_files[ptm_type],
+                      ['{}_HUMAN'.format(accession), accession, rnd.randint(1, 3000), ptm_type, pubmed_ids,
+                       ''.join(rnd.choice(AMINO_ACIDS) for _ in range(21))])
+
+
+def main(out_dir, scale, seed=1):
+    rnd = random.Random(seed)
+    hgnc_genes = generate_genes(out_dir, scale, rnd)
+    generate_signal(out_dir, scale, rnd, hgnc_genes)
+    generate_ptm(out_dir, scale, rnd, hgnc_genes)
+    with open(os.path.join(out_dir, COMPLETE_MARKER), 'w') as marker:
+        json.dump({'scale': scale, 'seed': seed}, marker)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir",
+                        help="directory to write the synthetic data set to")
+    parser.add_argument("-s", "--scale",
+                        help="size relative to one human Ensembl release, e.g. 1, 5 or 20",
+                        default=1.0,
+                        type=float)
+    parser.add_argument("--seed",
+                        help="random seed, the same seed and scale always give the same data",
+                        default=1,
+                        type=int)
+    args = parser.parse_args()
+
+    main(args.out_dir, args.scale, args.seed)
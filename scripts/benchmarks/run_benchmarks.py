@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Time the pipeline scripts on synthetic data and compare with baselines.
+
+Generates (or reuses) a synthetic data set per scale with
+generate_synthetic_data.py, runs each benchmarked script on it the same way
+the Makefile does, and compares the wall time with baseline.json. A benchmark
+that is more than --tolerance slower than its baseline fails the run. Use
+--update-baseline to record new baseline numbers for the scales that ran.
+
+Baselines depend on the machine, so record them on the machine that runs the
+comparison. Example:
+
+    python scripts/benchmarks/run_benchmarks.py --scale 1 --scale 5 --update-baseline
+    python scripts/benchmarks/run_benchmarks.py --scale 1 --scale 5
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from benchmarks import generate_synthetic_data  # noqa: E402
+from hgnc_symbols import DEFAULT_CACHE_DIR  # noqa: E402
+from pipeline_profile import PROFILE_ENV  # noqa: E402
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DEFAULT_TOLERANCE = 0.25
+# differences below this are noise, whatever the relative slowdown
+MIN_SLOWDOWN_SECONDS = 0.5
+
+SIGNAL_FILES = ['signal/input/somatic_mutations_by_tumortype_merge.txt',
+                'signal/input/mutations_cnv_by_tumortype_merge.txt',
+                'signal/input/biallelic_by_tumortype_merge.txt',
+                'signal/input/mutations_QCpass_by_tumortype_merge.txt',
+                'signal/input/signaldb_all_variants_frequencies.txt',
+                'signal/input/signaldb_msk_expert_review_variants.txt',
+                'signal/input/signaldb_variants_by_cancertype_summary_statistics.txt']
+
+# name -> script, input files relative to the data set, output file or None
+# for scripts that write to stdout
+BENCHMARKS = {
+    'canonical_selector': ('make_one_canonical_transcript_per_gene.py',
+                           ['tmp/ensembl_canonical_data.txt',
+                            'common_input/hgnc_complete_set.txt',
+                            'common_input/isoform_overrides_uniprot.txt',
+                            'common_input/isoform_overrides_at_mskcc.txt',
+                            'common_input/isoform_overrides_genome_nexus.txt',
+                            'common_input/ignored_genes.txt'],
+                           'ensembl_biomart_canonical_transcripts_per_hgnc.txt'),
+    'transcript_json': ('add_domains_hugo_ccds_refseq_exon_info_uniprot_to_ensembl_transcript.py',
+                        ['tmp/ensembl_biomart_transcripts.txt',
+                         'tmp/ensembl_transcript_info.txt',
+                         'input/ensembl_biomart_pfam.txt',
+                         'input/ensembl_biomart_refseq.txt',
+                         'input/ensembl_biomart_ccds.txt',
+                         'uniprot/enst_to_uniprot_mapping_id.txt',
+                         'common_input/isoform_overrides_uniprot.txt',
+                         'common_input/isoform_overrides_at_mskcc.txt',
+                         'common_input/hgnc_complete_set.txt'],
+                        'ensembl_biomart_transcripts.json.gz'),
+    'gff_transform': ('transform_gff_to_tsv_for_exon_info_from_ensembl.py',
+                      ['tmp/annotations.gff3.gz'],
+                      'ensembl_transcript_info.txt'),
+    'gff3_index': ('index_gff3.py',
+                   ['tmp/annotations.gff3.gz'],
+                   'gff3_index.json'),
+    'signal_transform': ('transform_signal_db_mutations.py', SIGNAL_FILES, None),
+    'ptm_mapper': ('add_enst_id_to_ptm.py',
+                   ['common_input/CCDS2UniProtKB.current.txt',
+                    'common_input/CCDS2Sequence.current.txt',
+                    'common_input/CCDS2Sequence.override.txt',
+                    'ptm/input'],
+                   None),
+}
+
+
+def scale_key(scale):
+    return '{:g}'.format(scale)
+
+
+def prepare_data(data_root, scale, seed):
+    """Return the data set directory for scale, generating it if needed"""
+    data_dir = os.path.join(data_root, 'scale-{}-seed-{}'.format(scale_key(scale), seed))
+    if not generate_synthetic_data.is_generated(data_dir, scale, seed):
+        shutil.rmtree(data_dir, ignore_errors=True)
+        print('Generating synthetic data at scale {} in {}'.format(scale_key(scale), data_dir), file=sys.stderr)
+        generate_synthetic_data.main(data_dir, scale, seed)
+    return data_dir
+
+
+def run_benchmark(name, data_dir, output_dir):
+    """Run one benchmark on a cold HGNC symbol cache. Returns its wall time,
+    peak RSS and the wall time per phase"""
+    script, inputs, output = BENCHMARKS[name]
+    output_file_name = os.path.join(output_dir, output or name + '.json')
+    # scripts writing to stdout write their profile to the working directory
+    profile_file_name = output_file_name + '.profile.json' if output else \
+        os.path.join(data_dir, os.path.splitext(script)[0] + '.profile.json')
+    args = [sys.executable, os.path.join(SCRIPTS_DIR, script)] + inputs + ([output_file_name] if output else [])
+
+    with tempfile.TemporaryDirectory() as cache_dir, open(os.devnull if output else output_file_name, 'w') as stdout:
+        env = dict(os.environ, **{PROFILE_ENV: 'phases', 'GENOME_NEXUS_IMPORTER_CACHE_DIR': cache_dir})
+        start = time.perf_counter()
+        # the canonical selector reads common_input/ relative to the working directory
+        completed = subprocess.run(args, cwd=data_dir, env=env, stdout=stdout, stderr=subprocess.PIPE, text=True)
+        wall_seconds = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError('{} failed:\n{}'.format(name, completed.stderr))
+
+    with open(profile_file_name) as profile_file:
+        profile = json.load(profile_file)
+    os.remove(profile_file_name)
+    return {'wall_seconds': round(wall_seconds, 3),
+            'peak_rss_mb': profile['total']['peak_rss_mb'],
+            'phases': {phase['name']: phase['wall_seconds'] for phase in profile['phases']}}
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Return a message for every benchmark slower than its baseline by more
+    than tolerance (a fraction) and MIN_SLOWDOWN_SECONDS"""
+    regressions = []
+    for scale, benchmarks in sorted(results.items()):
+        for name, result in sorted(benchmarks.items()):
+            expected = baseline.get(scale, {}).get(name)
+            if expected is None:
+                continue
+            limit = max(expected['wall_seconds'] * (1 + tolerance), expected['wall_seconds'] + MIN_SLOWDOWN_SECONDS)
+            if result['wall_seconds'] > limit:
+                regressions.append('{} at scale {}: {:.2f}s, baseline {:.2f}s (+{:.0%})'.format(
+                    name, scale, result['wall_seconds'], expected['wall_seconds'],
+                    result['wall_seconds'] / expected['wall_seconds'] - 1))
+    return regressions
+
+
+def load_baseline(baseline_file_name):
+    if not os.path.exists(baseline_file_name):
+        return {}
+    with open(baseline_file_name) as baseline_file:
+        return json.load(baseline_file)
+
+
+def main(scales, benchmarks, baseline_file_name, tolerance, update_baseline, repeat, data_root, seed):
+    results = {}
+    for scale in scales:
+        data_dir = prepare_data(data_root, scale, seed)
+        results[scale_key(scale)] = {}
+        with tempfile.TemporaryDirectory() as output_dir:
+            for name in benchmarks:
+                # the fastest of several runs is the least noisy
+                result = min((run_benchmark(name, data_dir, output_dir) for _ in range(repeat)),
+                             key=lambda result: result['wall_seconds'])
+                results[scale_key(scale)][name] = result
+                print('{:<20} scale {:<6} {:>9.2f}s {:>9.1f} MB  {}'.format(
+                    name, scale_key(scale), result['wall_seconds'], result['peak_rss_mb'],
+                    ' '.join('{}={:.2f}s'.format(phase, seconds) for phase, seconds in result['phases'].items())))
+
+    baseline = load_baseline(baseline_file_name)
+    if update_baseline:
+        for scale, scale_results in results.items():
+            baseline.setdefault(scale, {}).update(scale_results)
+        with open(baseline_file_name, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print('Updated {}'.format(baseline_file_name))
+        return 0
+
+    regressions = compare_to_baseline(results, baseline, tolerance)
+    for regression in regressions:
+        print('SLOWER: ' + regression, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-s", "--scale",
+                        help="data size relative to one human Ensembl release, can be repeated, e.g. -s 1 -s 5 -s 20",
+                        action='append',
+                        type=float)
+    parser.add_argument("-b", "--benchmark",
+                        help="benchmark to run, can be repeated. Default: all",
+                        action='append',
+                        choices=list(BENCHMARKS))
+    parser.add_argument("--baseline",
+                        help="baseline file",
+                        default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance",
+                        help="fail when a benchmark is this fraction slower than its baseline",
+                        default=DEFAULT_TOLERANCE,
+                        type=float)
+    parser.add_argument("--update-baseline",
+                        help="store the measured times as the new baseline instead of comparing",
+                        action='store_true')
+    parser.add_argument("-r", "--repeat",
+                        help="run each benchmark this many times and keep the fastest",
+                        default=1,
+                        type=int)
+    parser.add_argument("--data-dir",
+                        help="where the synthetic data sets are generated and kept between runs",
+                        default=os.path.join(DEFAULT_CACHE_DIR, 'benchmarks'))
+    parser.add_argument("--seed",
+                        help="random seed of the synthetic data",
+                        default=1,
+                        type=int)
+    args = parser.parse_args()
+
+    sys.exit(main(args.scale or [1.0],
+                  args.benchmark or list(BENCHMARKS),
+                  args.baseline,
+                  args.tolerance,
+                  args.update_baseline,
+                  args.repeat,
+                  args.data_dir,
+                  args.seed))
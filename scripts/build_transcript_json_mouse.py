@@ -9,6 +9,10 @@ A JSON file will be produced that holds for each gene its canonical transcript,
 
 import pandas as pd
 import argparse
+from ensembl_tables import read_table, TRANSCRIPT_INFO_SCHEMA, PFAM_SCHEMA
+from json_lines import write_json_lines
+import pipeline_profile
+from pipeline_profile import phase
 
 def exons_per_transcript(exons):
     '''Builds a nested data frame from exon file for JSON output
@@ -23,7 +27,8 @@ def exons_per_transcript(exons):
 
         transcript_id, exontype, exonid, start, end, rank, strand, version = row
         if exontype == 'exon':
-            exon = {'id': exonid, 'start': int(start), 'end': int(end), 'rank': rank, 'strand': int(strand), 'version': version}
+            # rank and version have always been written as floats
+            exon = {'id': exonid, 'start': int(start), 'end': int(end), 'rank': float(rank), 'strand': int(strand), 'version': float(version)}
             all_exons.setdefault(transcript_id, {}).setdefault('exons', []).append(exon)
         elif exontype in ['five_prime_UTR', 'three_prime_UTR']:
             utr = {'start': int(start), 'end': int(end), 'strand': int(strand)}
@@ -78,23 +83,29 @@ def main(ensembl_biomart_transcripts,
          ensembl_biomart_ccds,
          ensembl_biomart_transcripts_json):
 
-    # Read input and set index column
-    transcripts_df = pd.read_csv(ensembl_biomart_transcripts, sep='\t', index_col=0).sort_index()
-    ccds_df = pd.read_csv(ensembl_biomart_ccds, sep='\t', index_col=0).sort_index()
-    refseq_df = pd.read_csv(ensembl_biomart_refseq, sep='\t', index_col=0).sort_index()
-    exons_df = pd.read_csv(ensembl_transcript_info, sep='\t')
-    pfam_df = pd.read_csv(ensembl_biomart_pfam, sep='\t')
+    with phase('load') as profiled:
+        # Read input and set index column
+        transcripts_df = pd.read_csv(ensembl_biomart_transcripts, sep='\t', index_col=0).sort_index()
+        ccds_df = pd.read_csv(ensembl_biomart_ccds, sep='\t', index_col=0).sort_index()
+        refseq_df = pd.read_csv(ensembl_biomart_refseq, sep='\t', index_col=0).sort_index()
+        exons_df = read_table(ensembl_transcript_info, TRANSCRIPT_INFO_SCHEMA)
+        pfam_df = read_table(ensembl_biomart_pfam, PFAM_SCHEMA)
+        profiled.rows = len(transcripts_df) + len(exons_df) + len(pfam_df)
 
-    # collapse on transcript
-    exons = exons_per_transcript(exons_df).sort_index()
-    pfam = pfam_domains_per_transcript(pfam_df).sort_index()
+    with phase('nest') as profiled:
+        # collapse on transcript
+        exons = exons_per_transcript(exons_df).sort_index()
+        pfam = pfam_domains_per_transcript(pfam_df).sort_index()
+        profiled.rows = len(exons) + len(pfam)
 
-    # merge all tables
-    merged = combine_tables(transcripts_df, refseq_df, exons, pfam, ccds_df)
+    with phase('join') as profiled:
+        # merge all tables
+        merged = combine_tables(transcripts_df, refseq_df, exons, pfam, ccds_df)
+        profiled.rows = len(merged)
 
-    # print records as json
-    merged.to_json(ensembl_biomart_transcripts_json,
-                                      orient='records', lines=True, compression='gzip')
+    with phase('write') as profiled:
+        # print records as json
+        profiled.rows = write_json_lines(merged, ensembl_biomart_transcripts_json)
 
 
 if __name__ == '__main__':
@@ -112,8 +123,10 @@ if __name__ == '__main__':
                         help="input/ensembl_biomart_ccds.txt")
     parser.add_argument("ensembl_biomart_transcripts_json",
                         help="tmp/ensembl_biomart_transcripts.json.gz")
+    pipeline_profile.add_profile_argument(parser)
 
     args = parser.parse_args()
+    pipeline_profile.configure(args.ensembl_biomart_transcripts_json, args.profile)
     main(args.ensembl_biomart_transcripts,
          args.ensembl_transcript_info,
          args.ensembl_biomart_pfam,
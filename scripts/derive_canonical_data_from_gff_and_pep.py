@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+'''
+Builds tmp/ensembl_canonical_data.txt from local files instead of the Ensembl
+lookup REST API, see download_transcript_info_from_ensembl.py. Whether a
+transcript is canonical and its version come from the transcripts table that
+index_gff3.py splits from the GFF3 (tmp/ensembl_gff_transcripts.txt, canonical
+from the Ensembl_canonical tag of Ensembl release 104 and later), the protein
+ID and length from the peptide FASTA (pep.all.fa.gz) of the same release,
+read once as a stream.
+'''
+
+import argparse
+import gzip
+import sys
+
+import pandas as pd
+
+import pipeline_profile
+from pipeline_profile import phase
+from ensembl_tables import read_table, write_sidecar, CANONICAL_DATA_SCHEMA, GFF_TRANSCRIPTS_SCHEMA
+
+CANONICAL_TAG = 'Ensembl_canonical'
+
+
+class MissingCanonicalTagError(Exception):
+    pass
+
+
+def open_text(file_name):
+    return gzip.open(file_name, 'rt') if file_name.endswith('.gz') else open(file_name)
+
+
+def strip_version(ensembl_id):
+    return ensembl_id.split('.', 1)[0]
+
+
+def get_gff_transcripts(gff_transcripts_table):
+    """Canonical flag and version by transcript id from the GFF3 transcripts
+    table of index_gff3.py"""
+    versions = gff_transcripts_table['version'].astype(object).where(gff_transcripts_table['version'].notna(), None)
+    return {transcript_id: (bool(is_canonical), None if version is None else int(version))
+            for transcript_id, is_canonical, version in zip(gff_transcripts_table['transcript_id'],
+                                                            gff_transcripts_table['is_canonical'], versions)}
+
+
+def read_pep_proteins(fasta_lines):
+    """Protein id and length by transcript id from the headers and sequences of
+    an Ensembl peptide FASTA, e.g. >ENSP00000288602.7 pep ... transcript:ENST00000288602.11 ..."""
+    proteins = {}
+    transcript_id = protein_id = None
+    length = 0
+    for line in fasta_lines:
+        if line[0] == '>':
+            if transcript_id is not None:
+                proteins[transcript_id] = (protein_id, length)
+            fields = line[1:].split()
+            protein_id = strip_version(fields[0])
+            transcript_id = next((strip_version(field[len('transcript:'):]) for field in fields[1:]
+                                  if field.startswith('transcript:')), None)
+            length = 0
+        else:
+            length += len(line.strip().rstrip('*'))
+    if transcript_id is not None:
+        proteins[transcript_id] = (protein_id, length)
+    return proteins
+
+
+def get_transcript_info(transcript_ids, gff_transcripts, pep_proteins):
+    """is_canonical, transcript_id_version, protein_stable_id and
+    protein_length per transcript id, as the REST lookup gives them"""
+    rows = []
+    for transcript_id in transcript_ids:
+        is_canonical, version = gff_transcripts.get(transcript_id, (False, None))
+        protein_id, length = pep_proteins.get(transcript_id, (None, None))
+        rows.append(('1' if is_canonical else '0', version, protein_id, length))
+    transcript_info = pd.DataFrame(rows, columns=['is_canonical', 'transcript_id_version', 'protein_stable_id',
+                                                  'protein_length'])
+    for column in ['transcript_id_version', 'protein_length']:
+        transcript_info[column] = transcript_info[column].astype('Int64')
+    return transcript_info
+
+
+def main(ensembl_biomart_geneids, ensembl_gff_transcripts, pep_file, ensembl_canonical_data):
+    with phase('load') as profiled:
+        gene_info = pd.read_csv(ensembl_biomart_geneids, sep='\t', dtype=str)
+        gene_info.columns = [c.lower().replace(' ', '_') for c in gene_info.columns]
+        gff_transcripts = get_gff_transcripts(read_table(ensembl_gff_transcripts, GFF_TRANSCRIPTS_SCHEMA))
+        with open_text(pep_file) as fasta:
+            pep_proteins = read_pep_proteins(fasta)
+        profiled.rows = len(gene_info)
+
+    if not any(is_canonical for is_canonical, _ in gff_transcripts.values()):
+        raise MissingCanonicalTagError('%s has no %s tags, which Ensembl adds from release 104. Use '
+                                       'download_transcript_info_from_ensembl.py for older releases'
+                                       % (ensembl_gff_transcripts, CANONICAL_TAG))
+
+    with phase('normalize') as profiled:
+        transcript_info = get_transcript_info(gene_info['transcript_stable_id'].map(strip_version),
+                                              gff_transcripts, pep_proteins)
+        profiled.rows = len(transcript_info)
+
+    with phase('write') as profiled:
+        gene_transcript_info = pd.concat([gene_info, transcript_info], axis=1, sort=False)
+        gene_transcript_info.to_csv(ensembl_canonical_data, sep='\t', index=False)
+        # typed sidecar for the canonical transcript selection
+        write_sidecar(ensembl_canonical_data, CANONICAL_DATA_SCHEMA)
+        profiled.rows = len(gene_transcript_info)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ensembl_biomart_geneids",
+                        help="input/ensembl_biomart_geneids.txt")
+    parser.add_argument("ensembl_gff_transcripts",
+                        help="tmp/ensembl_gff_transcripts.txt")
+    parser.add_argument("pep_file",
+                        help="tmp/homo_sapiens.pep.all.fa.gz")
+    parser.add_argument("ensembl_canonical_data",
+                        help="tmp/ensembl_canonical_data.txt")
+    pipeline_profile.add_profile_argument(parser)
+    args = parser.parse_args()
+    pipeline_profile.configure(args.ensembl_canonical_data, args.profile)
+
+    try:
+        main(args.ensembl_biomart_geneids, args.ensembl_gff_transcripts, args.pep_file, args.ensembl_canonical_data)
+    except MissingCanonicalTagError as error:
+        sys.stderr.write('%s\n' % error)
+        sys.exit(1)
@@ -5,136 +5,338 @@ This script uses the table of gene IDs downloaded from Ensembl BioMart,
 and for each transcript it will query the Ensembl lookup REST API to derive
 whether it is a canonical transcript for that gene, and also the length of 
 the associated protein. The API calls will be done in blocks of <qsize>.
+
+Several blocks are requested at a time. Requests wait as long as Ensembl asks
+with the Retry-After and X-RateLimit-* headers, failed requests are retried
+with exponential backoff, and after a gateway timeout a block is requested in
+smaller batches. Every finished block is appended to the journal
+tmp/transcript_info.ndjson, so an interrupted run continues where it stopped.
+Responses are also kept in the Ensembl REST cache (see ensembl_rest_cache.py)
+by release of the server, so later runs only query transcripts that are not
+cached yet.
 '''
 
 import pandas as pd
-import numpy as np
 import requests
 import sys
 import os
 import argparse
-import re
-
-
-def request_transcript_ids(transcripts, grch37):
-    # Prepare API call
-    if grch37:
-        server = "https://grch37.rest.ensembl.org"
-    else:
-        server = "https://rest.ensembl.org"
-    ext = "/lookup/id"
-    headers = {"Content-Type": "application/json", "Accept": "application/json"}
-    transcripts_formatted = '", "'.join(transcripts)
-    data = '{"expand": 1, "format":"full", "ids": ["%s"] }' % transcripts_formatted
-
-    # Perform API call
-    try:
-        r = requests.post(server+ext, headers=headers, data=data)
-    except requests.exceptions.ConnectionError:
-        sys.stderr.write('Connection error when trying to query Ensembl API')
-        sys.exit(1)
-
-    # Check if return JSON is ok
-    if not r.ok:
-        r.raise_for_status()
-        sys.exit(1)
-
-    return r.json()
+import bisect
+import hashlib
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pipeline_profile
+from pipeline_profile import phase
+from ensembl_tables import write_sidecar, CANONICAL_DATA_SCHEMA
+from ensembl_rest_cache import DEFAULT_CACHE_FILE, EnsemblOfflineError, EnsemblRestCache, get_release, \
+    offline_from_environment
+
+
+ENSEMBL_REST_SERVER = "https://rest.ensembl.org"
+ENSEMBL_GRCH37_REST_SERVER = "https://grch37.rest.ensembl.org"
+LOOKUP_ENDPOINT = "/lookup/id"
+# Ensembl allows 15 requests per second, but a POST of 1000 ids takes seconds
+DEFAULT_CONCURRENCY = 4
+MIN_BATCH_SIZE = 25
+MAX_RETRIES = 8
+BACKOFF_SECONDS = 2
+MAX_BACKOFF_SECONDS = 120
+# connect and read timeout
+REQUEST_TIMEOUT_SECONDS = (30, 300)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+JOURNAL_FILE_NAME = 'transcript_info.ndjson'
+
+
+class EnsemblRestError(Exception):
+    pass
+
+
+class BatchTimeout(Exception):
+    pass
+
+
+def trim_lookup_response(data):
+    """The fields of a /lookup/id response used here, which keeps cached
+    responses small. None for ids Ensembl does not know"""
+    if not isinstance(data, dict):
+        return None
+    trimmed = {key: data[key] for key in ('is_canonical', 'version') if key in data}
+    if isinstance(data.get('Translation'), dict):
+        trimmed['Translation'] = {key: data['Translation'][key] for key in ('id', 'length')
+                                  if key in data['Translation']}
+    return trimmed
+
+
+class EnsemblLookupClient:
+    """Looks up Ensembl ids with POST /lookup/id, from several threads. The
+    rate limit and the batch size are shared by all threads: after a 429 or an
+    exhausted X-RateLimit-Remaining all threads wait, and after a gateway
+    timeout all threads continue with half the batch size. With a cache, only
+    ids not cached for release are requested, and offline none are."""
+
+    def __init__(self, server, concurrency=DEFAULT_CONCURRENCY, batch_size=1000,
+                 retries=MAX_RETRIES, timeout=REQUEST_TIMEOUT_SECONDS, min_batch_size=MIN_BATCH_SIZE,
+                 cache=None, release=None, offline=False, backoff=BACKOFF_SECONDS):
+        self.server = server
+        self.cache = cache
+        self.release = release
+        self.offline = offline
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        # monotonic time before which no request is sent
+        self.not_before = 0.0
+        self.thread_state = threading.local()
+
+    def session(self):
+        # requests sessions are not thread safe, keep one per thread
+        if not hasattr(self.thread_state, 'session'):
+            self.thread_state.session = requests.Session()
+        return self.thread_state.session
+
+    def wait_for_rate_limit(self):
+        while True:
+            with self.lock:
+                delay = self.not_before - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def update_rate_limit(self, response):
+        """Make all threads wait as the rate limit headers of response ask.
+        Returns the wait, None if the headers do not ask for one"""
+        headers = response.headers
+        try:
+            if 'Retry-After' in headers:
+                delay = float(headers['Retry-After'])
+            elif headers.get('X-RateLimit-Remaining') == '0':
+                delay = float(headers.get('X-RateLimit-Reset', 1))
+            else:
+                return None
+        except ValueError:
+            delay = self.backoff
+        with self.lock:
+            self.not_before = max(self.not_before, time.monotonic() + delay)
+        return delay
+
+    def shrink_batch_size(self, failed_size):
+        with self.lock:
+            self.batch_size = max(self.min_batch_size, min(self.batch_size, failed_size // 2))
+            sys.stderr.write('Ensembl timed out on %s ids, continuing with batches of %s\n'
+                             % (failed_size, self.batch_size))
+
+    def post(self, ids):
+        """One batch, retried on connection errors and server errors. Raises
+        BatchTimeout on a gateway timeout if the batch can still be split"""
+        data = json.dumps({"expand": 1, "format": "full", "ids": list(ids)})
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        for attempt in range(self.retries + 1):
+            self.wait_for_rate_limit()
+            try:
+                response = self.session().post(self.server + LOOKUP_ENDPOINT, headers=headers, data=data,
+                                               timeout=self.timeout)
+            except requests.exceptions.ReadTimeout as timeout:
+                error, timed_out = timeout, True
+            except requests.exceptions.ConnectionError as connection_error:
+                error, timed_out = connection_error, False
+            else:
+                rate_limit_wait = self.update_rate_limit(response)
+                if response.ok:
+                    return response.json()
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                if response.status_code == 429 and rate_limit_wait is not None:
+                    # the rate limit headers already set the wait, a bare 429 backs off below
+                    error = 'HTTP 429'
+                    continue
+                error, timed_out = 'HTTP %s' % response.status_code, response.status_code == 504
+            if timed_out and len(ids) > self.min_batch_size:
+                raise BatchTimeout()
+            if attempt < self.retries:
+                time.sleep(min(MAX_BACKOFF_SECONDS, self.backoff * 2 ** attempt) * random.uniform(0.5, 1))
+        raise EnsemblRestError('Ensembl REST API failed %s times for %s ids from %s: %s'
+                               % (self.retries + 1, len(ids), ids[0], error))
+
+    def lookup(self, ids):
+        """Look up ids in batches of at most the current batch size. Returns
+        the decoded responses merged into one dict"""
+        ids = list(ids)
+        decoded = {}
+        if self.cache is not None:
+            decoded = self.cache.get_many(self.server, LOOKUP_ENDPOINT, self.release, ids)
+        missing = [transcript for transcript in ids if transcript not in decoded]
+        if missing and self.offline:
+            raise EnsemblOfflineError('%s of %s ids from %s are not in the Ensembl REST cache'
+                                      % (len(missing), len(ids), missing[0]))
+        pending = [missing] if missing else []
+        while pending:
+            batch = pending.pop()
+            batch_size = self.batch_size
+            if len(batch) > batch_size:
+                pending.extend(batch[start:start + batch_size] for start in range(0, len(batch), batch_size))
+                continue
+            try:
+                responses = {transcript: trim_lookup_response(data) for transcript, data in self.post(batch).items()}
+            except BatchTimeout:
+                self.shrink_batch_size(len(batch))
+                pending.append(batch)
+                continue
+            if self.cache is not None:
+                self.cache.put_many(self.server, LOOKUP_ENDPOINT, self.release, responses)
+            decoded.update(responses)
+        return decoded
 
 
 def get_transcript_info(transcript, ensembl_transcript_response):
+    """is_canonical, version, protein id and protein length of transcript,
+    None where unknown"""
     # Attempt to parse API response. Sometimes the transcript does not have an API response, probably because the API is
     # on a newer Ensembl release than the input files. Restarting the pipeline will attempt to continue.
-    try:
-        data = ensembl_transcript_response.get(transcript, {})
-        is_canonical = data.get('is_canonical', np.nan)
-
-        transcript_id_version = str(data.get('version')) if 'version' in data else np.nan
-
-        translation = data.get('Translation', {})
-        protein_stable_id = translation.get('id', np.nan)
-
-        # ensure protein_length is integer (or NaN)
-        protein_length = translation.get('length', np.nan)
-        protein_length = (
-            int(protein_length) if not pd.isna(protein_length) else np.nan
-        )
-
-    except (TypeError, KeyError):
-        is_canonical = np.nan
-        transcript_id_version = np.nan
-        protein_stable_id = np.nan
-        protein_length = np.nan
-
-    return pd.Series(
-        [is_canonical, transcript_id_version, protein_stable_id, protein_length],
-        index=['is_canonical', 'transcript_id_version', 'protein_stable_id', 'protein_length']
-    )
-
-
-def get_rest_jobs(tmp_dir, ngenes):
-    '''Reads the tmp dir and determines which indexes still need processing.
-    '''
-
-    # determine which indices are already processed. Start and stop are derived from filenames.
-    filename_re = re.compile('transcript_info_([0-9]*)-([0-9]*)\.txt$')
-    tmp_files = [fn for fn in os.listdir(tmp_dir) if re.match(filename_re, fn)!=None]
-
-    ngenes_set = set(range(0, ngenes))
-    passed = set()
-    for fn in tmp_files:
-        match = re.search(filename_re, fn)
-        start, end = int(match.group(1)), int(match.group(2))
-        passed.update(range(start, end))
-
-    return ngenes_set.difference(passed)
-
-
-def lookup_transcripts(gene_info, tmp_dir, jobs, query_size, grch37=True):
-    '''Loops through gene IDs and looks them up in Ensembl if needed.
-    Results are merged into a data frame.
+    data = ensembl_transcript_response.get(transcript) or {}
+    translation = data.get('Translation') or {}
+    protein_length = translation.get('length')
+    return [data.get('is_canonical'),
+            data.get('version'),
+            translation.get('id'),
+            int(protein_length) if protein_length is not None else None]
+
+
+class TranscriptInfoJournal:
+    """Append-only NDJSON checkpoint of the crawl. The first line identifies
+    the input transcripts, every other line holds the start and end index of
+    a finished chunk and its transcript info rows. A journal of other input
+    is started over, and a line cut off by a crash is dropped."""
+
+    def __init__(self, file_name, transcripts):
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        header = {'transcripts': len(transcripts),
+                  'sha1': hashlib.sha1('\n'.join(transcripts).encode()).hexdigest()}
+        self.entries, valid_size = self.read(file_name, header)
+        self.file = open(file_name, 'ab')
+        if valid_size == 0:
+            self.file.truncate(0)
+            self.write(header)
+        else:
+            self.file.truncate(valid_size)
+
+    @staticmethod
+    def read(file_name, header):
+        """The entries of the journal and the size of its valid part, 0 if it
+        does not exist or belongs to other input"""
+        entries = []
+        valid_size = 0
+        if not os.path.exists(file_name):
+            return entries, valid_size
+        with open(file_name, 'rb') as journal:
+            for line_number, line in enumerate(journal):
+                try:
+                    entry = json.loads(line) if line.endswith(b'\n') else None
+                except ValueError:
+                    entry = None
+                if line_number == 0 and entry != header:
+                    return [], 0
+                if entry is None:
+                    break
+                if line_number > 0:
+                    entries.append(entry)
+                valid_size += len(line)
+        return entries, valid_size
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry).encode() + b'\n')
+        self.file.flush()
+
+    def append(self, start, end, rows):
+        with self.lock:
+            self.write({'start': start, 'end': end, 'rows': rows})
+            self.entries.append({'start': start, 'end': end, 'rows': rows})
+
+    def completed_ranges(self):
+        """The finished index ranges, sorted and merged"""
+        ranges = []
+        for start, end in sorted((entry['start'], entry['end']) for entry in self.entries):
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+        return ranges
+
+    def to_frame(self, ngenes):
+        """All transcript info rows by index, in one pass over the entries"""
+        rows = [None] * ngenes
+        for entry in self.entries:
+            rows[entry['start']:entry['end']] = entry['rows']
+        # check whether every transcript has been retrieved
+        assert all(row is not None for row in rows)
+        transcript_info = pd.DataFrame(rows, columns=['is_canonical', 'transcript_id_version', 'protein_stable_id',
+                                                      'protein_length'])
+        # numbers as the parsed tmp files gave them before, floats if any is missing
+        for column in ['transcript_id_version', 'protein_length']:
+            transcript_info[column] = pd.to_numeric(transcript_info[column])
+        transcript_info['is_canonical'] = transcript_info['is_canonical'].fillna(False).astype(bool) \
+            .map({True: '1', False: '0'})
+        return transcript_info
+
+    def close(self):
+        self.file.close()
+
+
+def get_pending_chunks(completed_ranges, ngenes, query_size):
+    """The chunks of query_size transcripts not covered by completed_ranges"""
+    starts = [start for start, _ in completed_ranges]
+    pending = []
+    for low_index in range(0, ngenes, query_size):
+        high_index = min(low_index + query_size, ngenes)
+        covering = bisect.bisect_right(starts, low_index) - 1
+        if covering < 0 or completed_ranges[covering][1] < high_index:
+            pending.append((low_index, high_index))
+    return pending
+
+
+def save_transcript_info_chunk(client, journal, transcripts_chunk, low_index, high_index):
+    '''Request, decode and save info for a chunk of transcripts'''
+    decoded = client.lookup(transcripts_chunk)
+    journal.append(low_index, high_index, [get_transcript_info(transcript, decoded) for transcript in transcripts_chunk])
+
+
+def lookup_transcripts(gene_info, journal, query_size, client):
+    '''Loops through gene IDs and looks them up in Ensembl if needed, several
+    chunks at a time. Results are merged into a data frame.
     '''
 
     last_job = len(gene_info)
-
-    transcripts_all = gene_info['versioned_transcript_id']
-    transcript_info = pd.DataFrame({'is_canonical':[], 'transcript_id_version':[], 'protein_stable_id':[], 'protein_length':[]})
-
-    # Iterate over transcripts
-    for low_index in range(0, last_job, query_size):
-        high_index = min(low_index + query_size, last_job)
-        tmp_file = os.path.join(tmp_dir, 'transcript_info_%s-%s.txt' % (low_index, high_index))
-
-        # Check whether we already processed all indices between start and stop, else redo this chunk.
-        if len(set(range(low_index, high_index)).intersection(jobs)) > 0:
-            print('Retrieving %s-%s of %s transcripts from Ensembl' % (low_index, high_index, last_job))
-            transcripts_chunk = transcripts_all[low_index:high_index]
-
-            # Request, decode and save info for transcripts
-            decoded = request_transcript_ids(transcripts_chunk.tolist(), grch37)
-            transcript_info_chunk = transcripts_chunk.apply(lambda x: get_transcript_info(x, decoded))
-            transcript_info_chunk.to_csv(tmp_file, sep='\t', index=True)
-
-    # read all files and append to final table, but keep index
-    filename_re = re.compile('transcript_info_([0-9]*)-([0-9]*)\.txt$')
-    tmp_files = [fn for fn in os.listdir(tmp_dir) if re.match(filename_re, fn)!=None]
-    for fn in tmp_files:
-        transcript_info_chunk = pd.read_csv(os.path.join(tmp_dir, fn), sep='\t', index_col=0)
-        transcript_info = pd.concat([transcript_info, transcript_info_chunk], ignore_index=False)
-
-    # Prepare transcript info table for merging. Sort and remove duplicate indices.
-    transcript_info.sort_index(inplace=True)
-    transcript_info = transcript_info.loc[~transcript_info.index.duplicated(keep='first')]
-    transcript_info['is_canonical'].fillna(False, inplace=True)
-    transcript_info['is_canonical'] = transcript_info['is_canonical'].astype(bool)
-    transcript_info['is_canonical'].replace({True: '1', False: '0'}, inplace=True)
-
-    return transcript_info
-
-
-def main(ensembl_biomart_geneids, ensembl_canonical_data, query_size):
-    gene_info = pd.read_csv(ensembl_biomart_geneids, sep='\t', dtype=str)
-    gene_info.columns = [c.lower().replace(' ', '_') for c in gene_info.columns]
+    transcripts_all = gene_info['versioned_transcript_id'].tolist()
+
+    with ThreadPoolExecutor(client.concurrency) as pool:
+        futures = {pool.submit(save_transcript_info_chunk, client, journal, transcripts_all[low_index:high_index],
+                               low_index, high_index): (low_index, high_index)
+                   for low_index, high_index in get_pending_chunks(journal.completed_ranges(), last_job, query_size)}
+        try:
+            for future in as_completed(futures):
+                future.result()
+                print('Retrieved %s-%s of %s transcripts from Ensembl' % (futures[future] + (last_job,)))
+        except BaseException:
+            # chunks in flight are still saved, the others are left for the next run
+            pool.shutdown(cancel_futures=True)
+            raise
+
+    return journal.to_frame(last_job)
+
+
+def main(ensembl_biomart_geneids, ensembl_canonical_data, query_size, concurrency=DEFAULT_CONCURRENCY, server=None,
+         rest_cache=DEFAULT_CACHE_FILE, offline=False):
+    with phase('load') as profiled:
+        gene_info = pd.read_csv(ensembl_biomart_geneids, sep='\t', dtype=str)
+        gene_info.columns = [c.lower().replace(' ', '_') for c in gene_info.columns]
+        profiled.rows = len(gene_info)
     # print('Retrieving transcript information per gene to retrieve:\n'
     #       '- whether transcript is canonical\n'
     #       '- protein ID\n'
@@ -142,30 +344,32 @@ def main(ensembl_biomart_geneids, ensembl_canonical_data, query_size):
     # print('Can retrieve max 1000 transcripts per POST request, see '
     #       'https://github.com/Ensembl/ensembl-rest/wiki/POST-Requests')
 
-    # Create temporary directory to save files for each transcripts file
-    tmp_dir = os.path.join(os.path.dirname(ensembl_canonical_data), 'transcript_info/')
-    if not os.path.exists(tmp_dir):
-        os.makedirs(tmp_dir)
-
-    ngenes = len(gene_info)
-
     # check if genome is grch37 (hg19) -- Ensembl has a dedicated mirror for grch37
     grch37 = 'grch37' in ensembl_biomart_geneids
-
-    # get indexes todo
-    jobs = get_rest_jobs(tmp_dir, ngenes)
-
-    # retrieve transcript annotation
-    transcript_info = lookup_transcripts(gene_info, tmp_dir, jobs, query_size, grch37)
-
-    # check whether the total number of jobs is correct
-    assert(len(transcript_info.index) == len(gene_info.index))
-    # check whether the order of transcripts is incremental and nonredundant
-    assert(list(transcript_info.index) == list(range(0, len(transcript_info.index))))
-
-    # merge with gene IDs, save
-    gene_transcript_info = pd.concat([gene_info, transcript_info], axis=1, sort=False)
-    gene_transcript_info.to_csv(ensembl_canonical_data, sep='\t', index=False)
+    server = server or (ENSEMBL_GRCH37_REST_SERVER if grch37 else ENSEMBL_REST_SERVER)
+    cache = EnsemblRestCache(rest_cache) if rest_cache else None
+    release = get_release(server, cache, offline) if cache is not None or offline else None
+    client = EnsemblLookupClient(server, concurrency, query_size, cache=cache, release=release, offline=offline)
+
+    # finished chunks are saved in the journal, to continue after a crash
+    journal = TranscriptInfoJournal(os.path.join(os.path.dirname(ensembl_canonical_data), JOURNAL_FILE_NAME),
+                                    gene_info['versioned_transcript_id'].tolist())
+
+    with phase('download') as profiled:
+        # retrieve transcript annotation
+        try:
+            transcript_info = lookup_transcripts(gene_info, journal, query_size, client)
+        finally:
+            journal.close()
+        profiled.rows = len(transcript_info)
+
+    with phase('write') as profiled:
+        # merge with gene IDs, save
+        gene_transcript_info = pd.concat([gene_info, transcript_info], axis=1, sort=False)
+        gene_transcript_info.to_csv(ensembl_canonical_data, sep='\t', index=False)
+        # typed sidecar for the canonical transcript selection
+        write_sidecar(ensembl_canonical_data, CANONICAL_DATA_SCHEMA)
+        profiled.rows = len(gene_transcript_info)
 
 
 if __name__ == "__main__":
@@ -178,6 +382,30 @@ if __name__ == "__main__":
                         help="The number of Ensembl IDs that are submitted per POST request",      
                         default=1000,
                         type=int)
+    parser.add_argument("-c", "--concurrency",
+                        help="The number of POST requests in flight at a time",
+                        default=DEFAULT_CONCURRENCY,
+                        type=int)
+    parser.add_argument("--server",
+                        help="Ensembl REST server. Default: the GRCh37 server if the input path contains grch37, "
+                             "else " + ENSEMBL_REST_SERVER)
+    parser.add_argument("--rest-cache",
+                        help="Ensembl REST response cache file, empty to disable. Default: " + DEFAULT_CACHE_FILE,
+                        default=DEFAULT_CACHE_FILE)
+    parser.add_argument("--offline",
+                        help="Only use cached Ensembl REST responses. Default from $GENOME_NEXUS_IMPORTER_ENSEMBL_OFFLINE",
+                        action='store_true',
+                        default=offline_from_environment())
+    pipeline_profile.add_profile_argument(parser)
     args = parser.parse_args()
+    pipeline_profile.configure(args.ensembl_canonical_data, args.profile)
 
-    main(args.ensembl_biomart_geneids, args.ensembl_canonical_data, query_size=args.querysize)
+    try:
+        main(args.ensembl_biomart_geneids, args.ensembl_canonical_data, query_size=args.querysize,
+             concurrency=args.concurrency, server=args.server, rest_cache=args.rest_cache, offline=args.offline)
+    except EnsemblOfflineError as error:
+        sys.stderr.write('%s\n' % error)
+        sys.exit(1)
+    except EnsemblRestError as error:
+        sys.stderr.write('%s\nRun again to continue with the transcripts not retrieved yet.\n' % error)
+        sys.exit(1)
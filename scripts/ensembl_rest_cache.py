@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""On-disk cache of Ensembl REST responses, shared by the pipeline scripts.
+
+Responses are stored in SQLite, keyed by server, endpoint, Ensembl release
+and (versioned) id. Rebuilding a release, or re-running after changing an
+unrelated input, then only queries Ensembl for ids it has not seen. The
+release is the one the REST server reports (/info/data), which is not
+necessarily the release of the input files.
+
+The cache is ~/.cache/genome-nexus-importer/ensembl_rest.sqlite, or the file
+in $GENOME_NEXUS_IMPORTER_ENSEMBL_CACHE. With
+GENOME_NEXUS_IMPORTER_ENSEMBL_OFFLINE=1 nothing is requested from Ensembl:
+the newest cached release is used and an id that is not cached is an error.
+To run CI offline, export the part of the cache it needs:
+
+    python scripts/ensembl_rest_cache.py --server https://rest.ensembl.org ci_ensembl_rest.sqlite
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+
+import requests
+
+from hgnc_symbols import DEFAULT_CACHE_DIR
+
+DEFAULT_CACHE_FILE = os.environ.get('GENOME_NEXUS_IMPORTER_ENSEMBL_CACHE',
+                                    os.path.join(DEFAULT_CACHE_DIR, 'ensembl_rest.sqlite'))
+OFFLINE_ENV = 'GENOME_NEXUS_IMPORTER_ENSEMBL_OFFLINE'
+# ids per query, below the SQLite limit on parameters
+QUERY_SIZE = 500
+
+CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS responses (
+    server TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    release INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (server, endpoint, release, id))'''
+
+
+class EnsemblOfflineError(Exception):
+    pass
+
+
+def offline_from_environment():
+    return os.environ.get(OFFLINE_ENV, '').strip().lower() not in ('', '0', 'false', 'no')
+
+
+class EnsemblRestCache:
+    """Decoded JSON values by server, endpoint, release and id. Safe to use
+    from several threads, and from several processes through SQLite's
+    locking"""
+
+    def __init__(self, file_name=DEFAULT_CACHE_FILE):
+        if os.path.dirname(file_name):
+            os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(file_name, timeout=60, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(CREATE_TABLE)
+
+    def get_many(self, server, endpoint, release, ids):
+        """The cached values of ids, by id. Ids that are not cached are left out"""
+        ids = list(ids)
+        values = {}
+        with self.lock:
+            for start in range(0, len(ids), QUERY_SIZE):
+                chunk = ids[start:start + QUERY_SIZE]
+                rows = self.connection.execute(
+                    'SELECT id, value FROM responses WHERE server = ? AND endpoint = ? AND release = ? '
+                    'AND id IN ({})'.format(', '.join('?' * len(chunk))),
+                    [server, endpoint, release] + chunk)
+                values.update((ensembl_id, json.loads(value)) for ensembl_id, value in rows)
+        return values
+
+    def put_many(self, server, endpoint, release, values):
+        """Store a dict of values by id"""
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                ((server, endpoint, release, ensembl_id, json.dumps(value)) for ensembl_id, value in values.items()))
+
+    def get(self, server, endpoint, release, ensembl_id, default=None):
+        return self.get_many(server, endpoint, release, [ensembl_id]).get(ensembl_id, default)
+
+    def put(self, server, endpoint, release, ensembl_id, value):
+        self.put_many(server, endpoint, release, {ensembl_id: value})
+
+    def latest_release(self, server):
+        with self.lock:
+            release, = self.connection.execute('SELECT MAX(release) FROM responses WHERE server = ?',
+                                               [server]).fetchone()
+        return release
+
+    def export(self, file_name, server=None, release=None):
+        """Copy the cached responses, optionally only those of a server and
+        release, to another cache file. Returns the number of responses"""
+        EnsemblRestCache(file_name).close()
+        conditions = [(column, value) for column, value in [('server', server), ('release', release)]
+                      if value is not None]
+        where = ' AND '.join('{} = ?'.format(column) for column, _ in conditions) or '1'
+        with self.lock:
+            self.connection.execute('ATTACH DATABASE ? AS export', [file_name])
+            try:
+                with self.connection:
+                    cursor = self.connection.execute(
+                        'INSERT OR REPLACE INTO export.responses SELECT * FROM main.responses WHERE ' + where,
+                        [value for _, value in conditions])
+                return cursor.rowcount
+            finally:
+                self.connection.execute('DETACH DATABASE export')
+
+    def close(self):
+        self.connection.close()
+
+
+def get_release(server, cache=None, offline=False, session=requests):
+    """The Ensembl release served by server. Offline, the newest release
+    cached for server"""
+    if offline:
+        release = cache.latest_release(server) if cache is not None else None
+        if release is None:
+            raise EnsemblOfflineError('No cached Ensembl REST responses of {}'.format(server))
+        return release
+    response = session.get(server + '/info/data', headers={'Content-Type': 'application/json'}, timeout=60)
+    response.raise_for_status()
+    return max(response.json()['releases'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output",
+                        help="cache file to export to, responses already in it are kept")
+    parser.add_argument("--cache",
+                        help="cache file to export from",
+                        default=DEFAULT_CACHE_FILE)
+    parser.add_argument("--server",
+                        help="only export the responses of this server, e.g. https://grch37.rest.ensembl.org")
+    parser.add_argument("--release",
+                        help="only export the responses of this Ensembl release",
+                        type=int)
+    args = parser.parse_args()
+
+    cache = EnsemblRestCache(args.cache)
+    print('Exported {} responses to {}'.format(cache.export(args.output, args.server, args.release), args.output))
+    cache.close()
@@ -0,0 +1,192 @@
+"""Compact, typed loading of the large tab separated Ensembl tables.
+
+Reading these tables with dtype=str stores every value as a Python string,
+which dominates peak memory on a full Ensembl release. The schemas below
+give low-cardinality columns a categorical dtype and coordinates, ranks and
+strands narrow (nullable) integer dtypes. Columns are keyed by their header
+in lowercase with spaces replaced by underscores, so 'Pfam domain start' is
+'pfam_domain_start'. Columns not in the schema are read as strings.
+
+If pyarrow is installed, the typed table is also stored next to the TSV as an
+uncompressed Arrow IPC (Feather) sidecar, <file>.arrow, which reloads much
+faster than parsing the TSV. The sidecar records the dtypes it was read with
+and the size and modification time of the TSV. It is only used while both
+match, so the TSV stays the canonical artifact. Producing steps write the
+sidecar with write_sidecar, for other tables the first read_table writes it."""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.feather
+except ImportError:
+    pyarrow = None
+
+SIDECAR_SUFFIX = '.arrow'
+SIDECAR_METADATA_KEY = b'genome_nexus_importer'
+
+# tmp/ensembl_transcript_info.txt, exons and UTRs from the GFF3
+TRANSCRIPT_INFO_SCHEMA = {
+    'transcript_id': 'category',
+    'type': 'category',
+    'id': 'object',
+    'start': 'int32',
+    'end': 'int32',
+    'rank': 'Int16',
+    'strand': 'Int8',
+    'version': 'Int16',
+}
+
+# tmp/ensembl_gff_cds.txt, CDS segments from the GFF3
+GFF_CDS_SCHEMA = {
+    'transcript_id': 'category',
+    'protein_id': 'category',
+    'chromosome': 'category',
+    'start': 'int32',
+    'end': 'int32',
+    'strand': 'Int8',
+    'phase': 'Int8',
+}
+
+# tmp/ensembl_gff_transcripts.txt, transcript spans from the GFF3
+GFF_TRANSCRIPTS_SCHEMA = {
+    'transcript_id': 'object',
+    'gene_id': 'object',
+    'name': 'object',
+    'type': 'category',
+    'biotype': 'category',
+    'chromosome': 'category',
+    'start': 'int32',
+    'end': 'int32',
+    'strand': 'Int8',
+    'version': 'Int16',
+    'is_canonical': 'bool',
+}
+
+# tmp/ensembl_gff_genes.txt, gene spans from the GFF3
+GFF_GENES_SCHEMA = {
+    'gene_id': 'object',
+    'name': 'object',
+    'type': 'category',
+    'biotype': 'category',
+    'chromosome': 'category',
+    'start': 'int32',
+    'end': 'int32',
+    'strand': 'Int8',
+    'version': 'Int16',
+}
+
+# tmp/ensembl_biomart_transcripts.txt. Symbols are looked up per transcript,
+# which is slower on categories
+BIOMART_TRANSCRIPTS_SCHEMA = {
+    'transcript_stable_id': 'object',
+    'versioned_transcript_id': 'object',
+    'transcript_id_version': 'Int16',
+    'gene_stable_id': 'category',
+    'hgnc_symbol': 'object',
+    'protein_stable_id': 'object',
+    'protein_length': 'Int32',
+}
+
+# input/ensembl_biomart_pfam.txt
+PFAM_SCHEMA = {
+    'gene_stable_id': 'category',
+    'transcript_stable_id': 'object',
+    'versioned_transcript_id': 'object',
+    'gene_name': 'category',
+    'pfam_domain_id': 'category',
+    'pfam_domain_start': 'Int32',
+    'pfam_domain_end': 'Int32',
+}
+
+# tmp/ensembl_canonical_data.txt. Symbols and gene ids are used as index of
+# the canonical transcript selection, so they stay strings
+CANONICAL_DATA_SCHEMA = {
+    'gene_stable_id': 'object',
+    'transcript_stable_id': 'object',
+    'versioned_transcript_id': 'object',
+    'hgnc_symbol': 'object',
+    'hgnc_id': 'category',
+    'is_canonical': 'bool',
+    'transcript_id_version': 'object',
+    'protein_stable_id': 'object',
+    'protein_length': 'Int32',
+}
+
+
+def schema_column_name(column):
+    return column.lower().replace(' ', '_')
+
+
+def get_dtypes(columns, schema):
+    return {column: schema.get(schema_column_name(column), 'object') for column in columns}
+
+
+def get_source_stat(file_name):
+    stat = os.stat(file_name)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def read_tsv(file_name, schema, **kwargs):
+    header = pd.read_csv(file_name, sep='\t', nrows=0, **kwargs).columns
+    return pd.read_csv(file_name, sep='\t', dtype=get_dtypes(header, schema), **kwargs)
+
+
+def read_sidecar(file_name, schema):
+    """The table from the sidecar of file_name, or None if there is no sidecar
+    or it is stale or read with other dtypes"""
+    sidecar_file_name = file_name + SIDECAR_SUFFIX
+    if pyarrow is None or not os.path.exists(sidecar_file_name):
+        return None
+    try:
+        table = pyarrow.feather.read_table(sidecar_file_name, memory_map=True)
+        metadata = json.loads((table.schema.metadata or {}).get(SIDECAR_METADATA_KEY, b'{}'))
+    except (pyarrow.ArrowInvalid, ValueError):
+        return None
+    if metadata.get('source') != get_source_stat(file_name) or \
+            metadata.get('dtypes') != get_dtypes(table.column_names, schema):
+        return None
+    table = table.to_pandas()
+    # missing strings are None in Arrow and NaN in a parsed TSV
+    for column in table.columns[table.dtypes == object]:
+        table[column] = table[column].where(table[column].notna(), np.nan)
+    return table
+
+
+def write_sidecar(file_name, schema, table=None):
+    """Store the table of file_name, read with schema, in its sidecar. Reads
+    the TSV if table is not given. Does nothing without pyarrow"""
+    if pyarrow is None:
+        return
+    source = get_source_stat(file_name)
+    if table is None:
+        table = read_tsv(file_name, schema)
+    arrow_table = pyarrow.Table.from_pandas(table, preserve_index=False)
+    metadata = dict(arrow_table.schema.metadata or {})
+    metadata[SIDECAR_METADATA_KEY] = json.dumps({'source': source,
+                                                 'dtypes': get_dtypes(table.columns, schema)}).encode()
+    # write and rename, so readers never see a partial sidecar
+    sidecar_file_name = file_name + SIDECAR_SUFFIX
+    pyarrow.feather.write_feather(arrow_table.replace_schema_metadata(metadata), sidecar_file_name + '~',
+                                  compression='uncompressed')
+    os.replace(sidecar_file_name + '~', sidecar_file_name)
+
+
+def read_table(file_name, schema, **kwargs):
+    """Read a tab separated table with the dtypes from schema, from its
+    sidecar if that is fresh. Extra read_csv arguments bypass the sidecar"""
+    if kwargs:
+        return read_tsv(file_name, schema, **kwargs)
+    table = read_sidecar(file_name, schema)
+    if table is None:
+        table = read_tsv(file_name, schema)
+        try:
+            write_sidecar(file_name, schema, table)
+        except OSError:
+            # e.g. a read-only data directory
+            pass
+    return table
@@ -17,6 +17,7 @@
 
 import json
 import re
+import hashlib
 import pandas as pd
 import numpy as np
 from Bio import SeqIO
@@ -27,32 +28,18 @@ import time
 from collections import OrderedDict
 import argparse
 import subprocess
-import Levenshtein
+import pipeline_profile
+from pipeline_profile import phase
+from sequence_index import OneSubstitutionIndex
 
-# generate sequence to uniprot id dictionary
-def generate_dict(key, value, dictionary):
-    if key not in dictionary:
-        dictionary[key] = []
-    dictionary[key].append(value)
+# sequences are keyed by a 16 byte digest instead of the sequence itself
+def get_sequence_digest(sequence):
+    return hashlib.blake2b(sequence.encode(), digest_size=16).digest()
 
-def generate_biomart_uniprot(ensp, dictionary):
-    if ensp in dictionary:
-        return dictionary[ensp]
-    return ''
-
-def is_matched(uniprot_id_with_isoform, uniprot_biomart):
-    if ',' in uniprot_id_with_isoform:
-        return False
-    else:
-        if '-' in uniprot_id_with_isoform:
-            uniprot_id = uniprot_id_with_isoform.split('-')[0]
-        else:
-            uniprot_id = uniprot_id_with_isoform
-
-        if uniprot_id == uniprot_biomart:
-            return True
-        else:
-            return False
+def is_matched(uniprot_ids_with_isoform, biomart_uniprot_ids):
+    # a single uniprot id, without isoform equal to the biomart id
+    return ~uniprot_ids_with_isoform.str.contains(',', regex=False) & \
+        (uniprot_ids_with_isoform.str.partition('-')[0] == biomart_uniprot_ids)
 
 def get_uniprot_from_biomart(df_transcript, biomart_ensp_to_uniprot_dict, genome_build):
     start = 0
@@ -88,32 +75,20 @@ def get_uniprot_from_biomart(df_transcript, biomart_ensp_to_uniprot_dict, genome
             biomart_ensp_to_uniprot_dict[ensp] = uniprot
         start = start + chunk
 
-def find_uniprot_ids_with_one_levenshtein_distance(ensembl_sequence, ensp_id, sequence_length_dict, sequence_to_uniprot_dict):
-    if ensembl_sequence:
-        potential_uniprot_sequences = sequence_length_dict.get(len(ensembl_sequence))
-    else:
+def find_uniprot_ids_with_one_levenshtein_distance(ensembl_sequence, uniprot_sequence_index, digest_to_uniprot_dict):
+    if not ensembl_sequence:
         return None
-    
+
+    # UniProt sequences of the same length at Levenshtein distance 1 are one substitution away
     uniprot_ids = []
-    if potential_uniprot_sequences:
-        for uniprot_sequence in potential_uniprot_sequences:
-            if Levenshtein.distance(ensembl_sequence, uniprot_sequence) == 1:
-                uniprot_ids.append(','.join(sequence_to_uniprot_dict.get(uniprot_sequence)))
+    for uniprot_sequence in uniprot_sequence_index.find(ensembl_sequence):
+        uniprot_ids.append(','.join(digest_to_uniprot_dict.get(get_sequence_digest(uniprot_sequence))))
     if len(uniprot_ids) == 0:
         return None
     else:
         return uniprot_ids
 
-# get uniprot id(isoform) from ensp_to_sequence_dict and add into transcript dataframe
-def get_uniprot_id_with_isoform(ensp, dictionary, sequence_to_uniprot_dict):
-    if ensp in dictionary:
-        seq = dictionary[ensp]
-        if seq in sequence_to_uniprot_dict:
-            uniprot = ','.join(sequence_to_uniprot_dict[seq])
-            return uniprot
-    return ''
-
-def multiple_uniprot_ids_compare_with_biomart(uniprot_id_with_isoform, biomart_uniprot_id, reviewed_mapping_dict):
+def multiple_uniprot_ids_compare_with_biomart(uniprot_id_with_isoform, biomart_uniprot_id):
     uniprot_ids = uniprot_id_with_isoform.split(',')
     final_uniprot_id = None
     for uniprot_id in uniprot_ids:
@@ -125,17 +100,16 @@ def multiple_uniprot_ids_compare_with_biomart(uniprot_id_with_isoform, biomart_u
             final_uniprot_id = uniprot_id
     return final_uniprot_id
 
-def curation(uniprot_id_with_isoform, biomart_uniprot_id, ensp_id, ensp_to_sequence_dict, reviewed_mapping_dict, sequence_length_dict, sequence_to_uniprot_dict):
+# curation by sequence, the same for all ensp with the same sequence and biomart uniprot id
+def curation(uniprot_id_with_isoform, biomart_uniprot_id, uniprot_ids_with_one_levenshtein_distance):
     final_uniprot_id = None
-    ensembl_sequence = ensp_to_sequence_dict.get(ensp_id)
-        
+
     # 0 uniprot ids, 0 or 1 biomart
     if not uniprot_id_with_isoform:
-        uniprot_ids_with_one_levenshtein_distance = find_uniprot_ids_with_one_levenshtein_distance(ensembl_sequence, ensp_id, sequence_length_dict, sequence_to_uniprot_dict)
         if uniprot_ids_with_one_levenshtein_distance and len(uniprot_ids_with_one_levenshtein_distance) == 1:
             final_uniprot_id = uniprot_ids_with_one_levenshtein_distance[0]
         elif uniprot_ids_with_one_levenshtein_distance and len(uniprot_ids_with_one_levenshtein_distance) > 1 and biomart_uniprot_id and biomart_uniprot_id in uniprot_ids_with_one_levenshtein_distance:
-            final_uniprot_id = multiple_uniprot_ids_compare_with_biomart(','.join(uniprot_ids_with_one_levenshtein_distance), biomart_uniprot_id, reviewed_mapping_dict)
+            final_uniprot_id = multiple_uniprot_ids_compare_with_biomart(','.join(uniprot_ids_with_one_levenshtein_distance), biomart_uniprot_id)
     
     else:
         uniprot_ids_with_isoform = uniprot_id_with_isoform.split(',')
@@ -146,18 +120,16 @@ def curation(uniprot_id_with_isoform, biomart_uniprot_id, ensp_id, ensp_to_seque
         # multiple uniprot ids, 0 or 1 biomart
         elif len(uniprot_ids_with_isoform) > 1:
             if biomart_uniprot_id and biomart_uniprot_id in uniprot_ids_with_isoform:
-                final_uniprot_id = multiple_uniprot_ids_compare_with_biomart(uniprot_id_with_isoform, biomart_uniprot_id, reviewed_mapping_dict)
-
-    # if no uniprot id could be mapped, try to find from previous mapping
-    if not final_uniprot_id:
-        if ensp_id in reviewed_mapping_dict:
-            final_uniprot_id = reviewed_mapping_dict.get(ensp_id)[0]
-    
-    if not final_uniprot_id or ',' in final_uniprot_id:
-        final_uniprot_id = ''
+                final_uniprot_id = multiple_uniprot_ids_compare_with_biomart(uniprot_id_with_isoform, biomart_uniprot_id)
 
     return final_uniprot_id
 
+def get_final_uniprot_ids(sequence_uniprot_ids, ensp_ids, reviewed_mapping):
+    # if no uniprot id could be mapped, try to find from previous mapping
+    final_uniprot_ids = sequence_uniprot_ids.where(sequence_uniprot_ids.fillna('') != '', ensp_ids.map(reviewed_mapping))
+    final_uniprot_ids = final_uniprot_ids.fillna('')
+    return final_uniprot_ids.where(~final_uniprot_ids.str.contains(',', regex=False), '')
+
 
 def main(ensembl_biomart_transcripts, ensembl_fasta, uniprot_sequence_with_isoform, genome_build_version):
     # extract transcripts
@@ -166,76 +138,101 @@ def main(ensembl_biomart_transcripts, ensembl_fasta, uniprot_sequence_with_isofo
         genome_build = 'grch37'
     else:
         genome_build = 'grch38'
-    # get result dataframe from transcript json file
-    df_transcript = None
-    transcript_ids = []
-    protein_ids = []
-    protein_lengths = []
-    ccds_ids = []
-    for line in transcript:
-        data = json.loads(line)
-        transcript_ids.append(data['transcript_stable_id'] if data['transcript_stable_id'] is not None else "")
-        protein_ids.append(data['protein_stable_id'] if data['protein_stable_id'] is not None else "")
-        protein_lengths.append(data['protein_length'] if data['protein_length'] is not None else "")
-        ccds_ids.append(data['ccds_id'] if data['ccds_id'] is not None else "")
-    d = {'enst_id': transcript_ids, 'ensp_id': protein_ids, 'ensembl_protein_length': protein_lengths, 'ccds_id': ccds_ids }
-    df_transcript = pd.DataFrame(d)
+    with phase('load') as profiled:
+        # get result dataframe from transcript json file
+        df_transcript = None
+        transcript_ids = []
+        protein_ids = []
+        protein_lengths = []
+        ccds_ids = []
+        for line in transcript:
+            data = json.loads(line)
+            transcript_ids.append(data['transcript_stable_id'] if data['transcript_stable_id'] is not None else "")
+            protein_ids.append(data['protein_stable_id'] if data['protein_stable_id'] is not None else "")
+            protein_lengths.append(data['protein_length'] if data['protein_length'] is not None else "")
+            ccds_ids.append(data['ccds_id'] if data['ccds_id'] is not None else "")
+        d = {'enst_id': transcript_ids, 'ensp_id': protein_ids, 'ensembl_protein_length': protein_lengths, 'ccds_id': ccds_ids }
+        df_transcript = pd.DataFrame(d)
 
-    # generate ensembl sequence map from ensembl fasta file
-    fasta_sequences = SeqIO.parse(open(ensembl_fasta),'fasta')
-    ensp_to_sequence_dict = dict()
-    for fasta in fasta_sequences:
-        id, sequence = fasta.id, str(fasta.seq)
-        # ensp_to_sequence_dict[ensp] = sequence
-        ensp_to_sequence_dict[id.split('.')[0]] = sequence
+        # generate ensembl sequence map from ensembl fasta file
+        fasta_sequences = SeqIO.parse(open(ensembl_fasta),'fasta')
+        ensp_to_digest_dict = dict()
+        ensembl_sequences = dict()
+        for fasta in fasta_sequences:
+            id, sequence = fasta.id, str(fasta.seq)
+            # ensp_to_digest_dict[ensp] = digest, ensembl_sequences[digest] = sequence, once per unique sequence
+            digest = get_sequence_digest(sequence)
+            ensp_to_digest_dict[id.split('.')[0]] = digest
+            ensembl_sequences.setdefault(digest, sequence)
 
-    # generate uniprot sequence(with isoform) dictionary from uniprot fasta file    
-    fasta_sequences_uniprot_isoform = SeqIO.parse(open(uniprot_sequence_with_isoform),'fasta')
-    sequence_to_uniprot_dict = dict() # todo some dicts are not using anywhere
-    uniprot_to_gene_dict = dict()
-    uniprot_isoform_dict = dict()
-    uniprot_no_isoform_set = set()
-    sequence_length_dict = dict()
-    for fasta in fasta_sequences_uniprot_isoform:
-        id, sequence = fasta.id, str(fasta.seq)
-        if sequence not in sequence_to_uniprot_dict:
-            sequence_to_uniprot_dict[sequence] = []
-        # sequence_to_uniprot_dict[sequence] = [uniprot_ids]
-        sequence_to_uniprot_dict[sequence].append(id.split('|')[1])
-        
-        # sequence_length_dict[length] = [sequence]
-        sequence_length = len(sequence)
-        if sequence_length not in sequence_length_dict:
-            sequence_length_dict[sequence_length] = []
-        sequence_length_dict[sequence_length].append(sequence)
+        # generate uniprot sequence(with isoform) dictionary from uniprot fasta file    
+        fasta_sequences_uniprot_isoform = SeqIO.parse(open(uniprot_sequence_with_isoform),'fasta')
+        digest_to_uniprot_dict = dict() # todo some dicts are not using anywhere
+        uniprot_to_gene_dict = dict()
+        uniprot_isoform_dict = dict()
+        uniprot_no_isoform_set = set()
+        uniprot_sequences = []
+        for fasta in fasta_sequences_uniprot_isoform:
+            id, sequence = fasta.id, str(fasta.seq)
+            digest = get_sequence_digest(sequence)
+            if digest not in digest_to_uniprot_dict:
+                digest_to_uniprot_dict[digest] = []
+            # digest_to_uniprot_dict[digest] = [uniprot_ids]
+            digest_to_uniprot_dict[digest].append(id.split('|')[1])
+            uniprot_sequences.append(sequence)
         
-        if '-' in id.split('|')[1]:
-            id_temp = id.split('|')[1].split('-')[0]
-        else:
-            id_temp = id.split('|')[1]
-        uniprot_to_gene_dict[id_temp] = id.split('|')[2].split('_')[0]
-        uniprot_no_isoform_set.add(id_temp)
+            if '-' in id.split('|')[1]:
+                id_temp = id.split('|')[1].split('-')[0]
+            else:
+                id_temp = id.split('|')[1]
+            uniprot_to_gene_dict[id_temp] = id.split('|')[2].split('_')[0]
+            uniprot_no_isoform_set.add(id_temp)
         
-        if id_temp not in uniprot_isoform_dict:
-            uniprot_isoform_dict[id_temp] = []
-        uniprot_isoform_dict[id_temp].append(id.split('|')[1])
+            if id_temp not in uniprot_isoform_dict:
+                uniprot_isoform_dict[id_temp] = []
+            uniprot_isoform_dict[id_temp].append(id.split('|')[1])
+
+        # one substitution index of the UniProt sequences, for the Ensembl sequences without an identical one
+        unmatched_sequences = {digest: sequence for digest, sequence in ensembl_sequences.items() if digest not in digest_to_uniprot_dict}
+        uniprot_sequence_index = OneSubstitutionIndex(uniprot_sequences, {len(sequence) for sequence in unmatched_sequences.values()})
+        profiled.rows = len(df_transcript) + len(ensp_to_digest_dict) + len(uniprot_sequences)
+        del ensembl_sequences, uniprot_sequences
     
-    # get uniprot from biomart and generate a map
-    biomart_ensp_to_uniprot_dict = dict()
-    get_uniprot_from_biomart(df_transcript, biomart_ensp_to_uniprot_dict, genome_build)
+    with phase('load biomart') as profiled:
+        # get uniprot from biomart and generate a map
+        biomart_ensp_to_uniprot_dict = dict()
+        get_uniprot_from_biomart(df_transcript, biomart_ensp_to_uniprot_dict, genome_build)
     
 
-    # get reviewed mapping(previous mapping), generate reviewed_mapping_dict
-    reviewed_map = '../data/uniprot/input/reviewed_map_' + genome_build.lower() + '.tsv'
-    df_reviewed_map = pd.read_csv(reviewed_map, sep='\t')
-    reviewed_mapping_dict = dict()
-    df_reviewed_map.apply(lambda row: generate_dict(row['ensp_id'], row['Final_mapping_uniprot_id'], reviewed_mapping_dict), axis=1)
+        # get reviewed mapping(previous mapping), the first mapping of every ensp
+        reviewed_map = '../data/uniprot/input/reviewed_map_' + genome_build.lower() + '.tsv'
+        df_reviewed_map = pd.read_csv(reviewed_map, sep='\t')
+        reviewed_mapping = df_reviewed_map.drop_duplicates('ensp_id').set_index('ensp_id')['Final_mapping_uniprot_id']
+        profiled.rows = len(biomart_ensp_to_uniprot_dict) + len(df_reviewed_map)
     
-    # 
-    df_transcript['biomart_uniprot_id'] = df_transcript.apply(lambda row: generate_biomart_uniprot(row['ensp_id'], biomart_ensp_to_uniprot_dict), axis = 1)
-    df_transcript['uniprot_id_with_isoform'] = df_transcript.apply(lambda row: get_uniprot_id_with_isoform(row['ensp_id'], ensp_to_sequence_dict, sequence_to_uniprot_dict), axis = 1)
-    df_transcript['is_matched'] = df_transcript.apply(lambda row: is_matched(row['uniprot_id_with_isoform'], row['biomart_uniprot_id']), axis = 1)
-    df_transcript['final_uniprot_id'] = df_transcript.apply(lambda row: curation(row['uniprot_id_with_isoform'], row['biomart_uniprot_id'], row['ensp_id'], ensp_to_sequence_dict, reviewed_mapping_dict, sequence_length_dict, sequence_to_uniprot_dict), axis = 1)
+    with phase('join') as profiled:
+        # ensp -> sequence digest -> uniprot ids, empty if there is no identical uniprot sequence
+        sequence_digests = df_transcript['ensp_id'].map(ensp_to_digest_dict).fillna(b'')
+        df_transcript['biomart_uniprot_id'] = df_transcript['ensp_id'].map(biomart_ensp_to_uniprot_dict).fillna('')
+        df_transcript['uniprot_id_with_isoform'] = sequence_digests.map(
+            {digest: ','.join(uniprot_ids) for digest, uniprot_ids in digest_to_uniprot_dict.items()}).fillna('')
+        df_transcript['is_matched'] = is_matched(df_transcript['uniprot_id_with_isoform'], df_transcript['biomart_uniprot_id'])
+
+        # curate once per unique sequence and biomart uniprot id, and search the uniprot sequences one substitution
+        # away once per unique sequence without an identical one
+        sequences = pd.DataFrame({'sequence_digest': sequence_digests,
+                                  'uniprot_id_with_isoform': df_transcript['uniprot_id_with_isoform'],
+                                  'biomart_uniprot_id': df_transcript['biomart_uniprot_id']})
+        unique_sequences = sequences.drop_duplicates(ignore_index=True)
+        uniprot_ids_with_one_levenshtein_distance = {
+            digest: find_uniprot_ids_with_one_levenshtein_distance(unmatched_sequences.get(digest), uniprot_sequence_index, digest_to_uniprot_dict)
+            for digest in unique_sequences.loc[unique_sequences['uniprot_id_with_isoform'] == '', 'sequence_digest'].unique()}
+        unique_sequences = unique_sequences.assign(sequence_uniprot_id=[
+            curation(uniprot_id_with_isoform, biomart_uniprot_id, uniprot_ids_with_one_levenshtein_distance.get(digest))
+            for digest, uniprot_id_with_isoform, biomart_uniprot_id in unique_sequences.itertuples(index=False)])
+        sequence_uniprot_ids = sequences.merge(unique_sequences, how='left', on=list(sequences.columns))['sequence_uniprot_id']
+        df_transcript['final_uniprot_id'] = get_final_uniprot_ids(sequence_uniprot_ids, df_transcript['ensp_id'], reviewed_mapping)
+        profiled.rows = len(df_transcript)
 
     # summary
     total_transcripts = np.count_nonzero(df_transcript['enst_id'])
@@ -248,15 +245,17 @@ def main(ensembl_biomart_transcripts, ensembl_fasta, uniprot_sequence_with_isofo
     print (str(have_ensp) + " have ensp id: " + str(have_ensp/total_transcripts * 100) + "%")
     print (str(map_to_uniprot) + " have been mapped to uniprot successfully")
     print (str(map_to_uniprot/have_ensp * 100) + "% of ensp can be mapped to uniprot, " + str(map_to_uniprot/total_transcripts * 100) + "% overall success rate")
-    print ("there are " + str(len(sequence_to_uniprot_dict)) + " unique sequence from 20375 uniprot")
+    print ("there are " + str(len(digest_to_uniprot_dict)) + " unique sequence from 20375 uniprot")
     print (str(map_to_uniprot_by_biomart) + " transcripts can be mapped by BioMart: " + str(map_to_uniprot_by_biomart / total_transcripts * 100) + "%")
 
-    # Save output file
-    full_mapping_file_name = '../data/uniprot/export/' + genome_build_version + '_enst_to_uniprot_mapping_full.txt'
-    id_mapping_file_name = '../data/uniprot/export/' + genome_build_version + '_enst_to_uniprot_mapping_id.txt'
+    with phase('write') as profiled:
+        # Save output file
+        full_mapping_file_name = '../data/uniprot/export/' + genome_build_version + '_enst_to_uniprot_mapping_full.txt'
+        id_mapping_file_name = '../data/uniprot/export/' + genome_build_version + '_enst_to_uniprot_mapping_id.txt'
 
-    df_transcript.to_csv(full_mapping_file_name, index=False, sep='\t', header=True)
-    df_transcript.to_csv(id_mapping_file_name, columns=['enst_id','final_uniprot_id'], index=False, sep='\t', header=True)
+        df_transcript.to_csv(full_mapping_file_name, index=False, sep='\t', header=True)
+        df_transcript.to_csv(id_mapping_file_name, columns=['enst_id','final_uniprot_id'], index=False, sep='\t', header=True)
+        profiled.rows = len(df_transcript)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -268,5 +267,7 @@ if __name__ == "__main__":
                         help="../data/uniprot/input/uniprot_reviewed.fasta")
     parser.add_argument("genome_build_version",
                         help="grch37_ensembl92 or grch38_ensembl92 or grch38_ensembl95")
+    pipeline_profile.add_profile_argument(parser)
     args = parser.parse_args()
+    pipeline_profile.configure(None, args.profile)
     main(args.ensembl_biomart_transcripts, args.ensembl_fasta, args.uniprot_sequence_with_isoform, args.genome_build_version)
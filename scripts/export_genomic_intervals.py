@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+'''
+Exports the genomic intervals of transcripts, exons and UTRs as flat JSON
+lines, for the ensembl.transcript_intervals collection. Coordinates are
+1-based and inclusive, as in the GFF3. Exons and UTRs get the chromosome and
+gene of their transcript.
+
+Every interval gets the UCSC bin of the smallest bin level that contains it.
+With an index on (chromosome, bin, start), the intervals overlapping a region
+are found by an indexed query on the few bins that can hold them:
+
+    {chromosome: '7', bin: {$in: get_overlapping_bins(start, end)},
+     start: {$lte: end}, end: {$gte: start}}
+
+The rows are sorted by chromosome and start, so the export is also a sorted
+array per chromosome.
+'''
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import pipeline_profile
+from pipeline_profile import phase
+from ensembl_tables import read_table, TRANSCRIPT_INFO_SCHEMA, GFF_TRANSCRIPTS_SCHEMA
+from json_lines import write_json_lines
+
+# UCSC binning scheme: 128 kb bins, each level 8 times larger, up to 512 Mb
+BIN_FIRST_SHIFT = 17
+BIN_NEXT_SHIFT = 3
+BIN_OFFSETS = [512 + 64 + 8 + 1, 64 + 8 + 1, 8 + 1, 1, 0]
+
+COLUMNS = ['chromosome', 'bin', 'start', 'end', 'strand', 'type', 'transcript_id', 'gene_id', 'exon_id', 'rank']
+
+
+def get_bins(starts, ends):
+    """The bin of each interval between 1-based inclusive starts and ends"""
+    # 0-based first and last base
+    first = (np.asarray(starts, dtype=np.int64) - 1) >> BIN_FIRST_SHIFT
+    last = (np.asarray(ends, dtype=np.int64) - 1) >> BIN_FIRST_SHIFT
+    bins = np.full(len(first), -1, dtype=np.int64)
+    for offset in BIN_OFFSETS:
+        fits = (bins < 0) & (first == last)
+        bins[fits] = offset + first[fits]
+        first >>= BIN_NEXT_SHIFT
+        last >>= BIN_NEXT_SHIFT
+    if (bins < 0).any():
+        raise ValueError('Intervals beyond 512 Mb cannot be binned')
+    return bins
+
+
+def get_overlapping_bins(start, end):
+    """All bins that can hold an interval overlapping start-end, 1-based and
+    inclusive"""
+    first = (start - 1) >> BIN_FIRST_SHIFT
+    last = (end - 1) >> BIN_FIRST_SHIFT
+    bins = []
+    for offset in BIN_OFFSETS:
+        bins.extend(range(offset + first, offset + last + 1))
+        first >>= BIN_NEXT_SHIFT
+        last >>= BIN_NEXT_SHIFT
+    return bins
+
+
+def get_intervals(transcript_info, transcripts):
+    """One row per transcript, exon and UTR, with its bin, sorted by
+    chromosome and start"""
+    transcripts = transcripts.set_index('transcript_id')
+    transcript_info = transcript_info[transcript_info['transcript_id'].isin(transcripts.index)]
+    features = pd.DataFrame({
+        'chromosome': transcript_info['transcript_id'].map(transcripts['chromosome']).astype(str),
+        'start': transcript_info['start'],
+        'end': transcript_info['end'],
+        'strand': transcript_info['strand'],
+        'type': transcript_info['type'].astype(str),
+        'transcript_id': transcript_info['transcript_id'].astype(str),
+        'gene_id': transcript_info['transcript_id'].map(transcripts['gene_id']).astype(object),
+        'exon_id': transcript_info['id'],
+        'rank': transcript_info['rank'],
+    })
+    transcript_rows = pd.DataFrame({
+        'chromosome': transcripts['chromosome'].astype(str),
+        'start': transcripts['start'],
+        'end': transcripts['end'],
+        'strand': transcripts['strand'],
+        'type': 'transcript',
+        'transcript_id': transcripts.index,
+        'gene_id': transcripts['gene_id'],
+    })
+    intervals = pd.concat([transcript_rows, features], ignore_index=True, sort=False)
+    intervals['bin'] = get_bins(intervals['start'], intervals['end'])
+    return intervals.sort_values(['chromosome', 'start', 'end'], kind='stable', ignore_index=True)[COLUMNS]
+
+
+def main(ensembl_transcript_info, ensembl_gff_transcripts, transcript_intervals_json):
+    with phase('load') as profiled:
+        transcript_info = read_table(ensembl_transcript_info, TRANSCRIPT_INFO_SCHEMA)
+        transcripts = read_table(ensembl_gff_transcripts, GFF_TRANSCRIPTS_SCHEMA)
+        profiled.rows = len(transcript_info) + len(transcripts)
+
+    with phase('normalize') as profiled:
+        intervals = get_intervals(transcript_info, transcripts)
+        profiled.rows = len(intervals)
+
+    with phase('write') as profiled:
+        profiled.rows = write_json_lines(intervals, transcript_intervals_json)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ensembl_transcript_info",
+                        help="tmp/ensembl_transcript_info.txt")
+    parser.add_argument("ensembl_gff_transcripts",
+                        help="tmp/ensembl_gff_transcripts.txt")
+    parser.add_argument("transcript_intervals_json",
+                        help="tmp/ensembl_transcript_intervals.json.gz")
+    pipeline_profile.add_profile_argument(parser)
+    args = parser.parse_args()
+    pipeline_profile.configure(args.transcript_intervals_json, args.profile)
+
+    main(args.ensembl_transcript_info, args.ensembl_gff_transcripts, args.transcript_intervals_json)
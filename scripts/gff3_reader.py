@@ -0,0 +1,78 @@
+"""Streaming access to (gzipped) Ensembl GFF3 files.
+
+open_gff3 decompresses through the fastest backend available: python-isal,
+zlib-ng, a pigz subprocess, and Python's gzip module otherwise. Lines are
+split into their nine columns by iter_features, and attributes are looked up
+by key with parse_attributes or compile_attribute_pattern, instead of by
+position."""
+
+import contextlib
+import gzip
+import io
+import re
+import shutil
+import subprocess
+
+# the threaded variants decompress in a thread of their own
+try:
+    from isal import igzip_threaded as fast_gzip
+except ImportError:
+    try:
+        from zlib_ng import gzip_ng_threaded as fast_gzip
+    except ImportError:
+        fast_gzip = None
+
+READ_BUFFER_SIZE = 1 << 20
+
+
+def get_gzip_backend():
+    if fast_gzip is not None:
+        return fast_gzip.__name__.split('.')[0]
+    if shutil.which('pigz'):
+        return 'pigz'
+    return 'gzip'
+
+
+@contextlib.contextmanager
+def open_gff3(file_name):
+    """Text lines of a GFF3 file, decompressed if its name ends in .gz"""
+    if not file_name.endswith('.gz'):
+        with open(file_name, buffering=READ_BUFFER_SIZE) as gff:
+            yield gff
+    elif fast_gzip is not None:
+        with fast_gzip.open(file_name, 'rt') as gff:
+            yield gff
+    elif shutil.which('pigz'):
+        # decompresses in another process, alongside the parsing
+        with subprocess.Popen(['pigz', '-dc', file_name], stdout=subprocess.PIPE, bufsize=READ_BUFFER_SIZE) as pigz:
+            yield io.TextIOWrapper(pigz.stdout)
+            if pigz.wait() != 0:
+                raise OSError('pigz could not decompress {}'.format(file_name))
+    else:
+        with gzip.open(file_name, 'rt') as gff:
+            yield gff
+
+
+def iter_features(gff_lines, types=None):
+    """The columns of every feature line, optionally only of features of the
+    given types. Comments and directives are skipped"""
+    for line in gff_lines:
+        if line[0] == '#':
+            continue
+        columns = line.rstrip('\n').split('\t')
+        if len(columns) == 9 and (types is None or columns[2] in types):
+            yield columns
+
+
+def parse_attributes(attributes):
+    """The attribute column as a dict, e.g. {'Parent': 'transcript:ENST00000456328', 'rank': '1'}"""
+    return dict(attribute.split('=', 1) for attribute in attributes.split(';') if '=' in attribute)
+
+
+def compile_attribute_pattern(*keys):
+    """A pattern that looks up several attributes by key in one match, whatever
+    their order: pattern.match(attribute_column).groups() gives the values in
+    the order of keys, None for missing attributes. Much faster per line than
+    parse_attributes"""
+    # a key starts the column or follows a separator, so 'id' does not match 'exon_id'
+    return re.compile(''.join(r'(?:(?=(?:.*;)?{}=([^;\n]*)))?'.format(re.escape(key)) for key in keys))
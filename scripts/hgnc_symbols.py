@@ -0,0 +1,100 @@
+"""Resolve gene symbols to HGNC approved symbols. Lookups are case-insensitive.
+Approved symbols take precedence over previous symbols, previous symbols over
+aliases. When a previous symbol or alias belongs to multiple genes, the first
+gene in the HGNC file wins. The index built from an HGNC complete set is
+cached on disk, keyed by the hash of the file."""
+
+import hashlib
+import json
+import os
+import pandas as pd
+
+# bump when the cached index format or the resolution rules change
+INDEX_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.environ.get('GENOME_NEXUS_IMPORTER_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'genome-nexus-importer'))
+
+
+class HgncSymbolResolver:
+    def __init__(self, approved, previous, aliases):
+        # lowercase symbol -> approved symbol
+        self.approved = approved
+        self.previous = previous
+        self.aliases = aliases
+
+    @classmethod
+    def from_symbols(cls, symbols, previous_symbols, alias_symbols, separator='|'):
+        """Build from parallel sequences of approved symbols and their
+        separated previous symbols and aliases"""
+        symbols = pd.Series(list(symbols), dtype=object)
+
+        def index(lists):
+            lists = pd.Series(list(lists), index=symbols.values, dtype=object).dropna()
+            lists = lists[lists.map(lambda value: isinstance(value, str))]
+            other_symbols = lists.str.strip('"').str.split(separator).explode().str.strip()
+            other_symbols = other_symbols[other_symbols.notna() & (other_symbols != '')]
+            other_symbols = pd.DataFrame({'key': other_symbols.str.lower().values, 'approved': other_symbols.index})
+            other_symbols = other_symbols.drop_duplicates('key')
+            return dict(zip(other_symbols['key'], other_symbols['approved']))
+
+        approved = symbols.dropna()
+        approved = pd.DataFrame({'key': approved.str.lower().values, 'approved': approved.values}).drop_duplicates('key')
+        return cls(dict(zip(approved['key'], approved['approved'])),
+                   index(previous_symbols),
+                   index(alias_symbols))
+
+    @classmethod
+    def from_hgnc_table(cls, hgnc_df):
+        """Build from an HGNC complete set table, ignoring withdrawn entries"""
+        if 'name' in hgnc_df.columns:
+            hgnc_df = hgnc_df[hgnc_df['name'] != 'entry withdrawn']
+        return cls.from_symbols(hgnc_df['symbol'], hgnc_df['prev_symbol'], hgnc_df['alias_symbol'])
+
+    def resolve(self, symbol, use_aliases=True):
+        """Return the approved symbol for symbol, or None if it is unknown"""
+        if not isinstance(symbol, str):
+            return None
+        key = symbol.strip().lower()
+        indices = [self.approved, self.previous, self.aliases] if use_aliases else [self.approved, self.previous]
+        for index in indices:
+            if key in index:
+                return index[key]
+        return None
+
+    def is_known(self, symbol):
+        """True if symbol is an approved, previous or alias symbol"""
+        return self.resolve(symbol) is not None
+
+
+def file_digest(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_hgnc_symbol_resolver(hgnc_file_name, cache_dir=DEFAULT_CACHE_DIR):
+    """Load the resolver for an HGNC complete set file, from cache when that
+    exact file was indexed before. Pass cache_dir=None to not use the cache"""
+    cache_file_name = None
+    if cache_dir is not None:
+        cache_file_name = os.path.join(cache_dir, 'hgnc_symbols.v{}.{}.json'.format(INDEX_VERSION, file_digest(hgnc_file_name)))
+        if os.path.exists(cache_file_name):
+            with open(cache_file_name) as cache_file:
+                index = json.load(cache_file)
+            return HgncSymbolResolver(index['approved'], index['previous'], index['aliases'])
+
+    hgnc_df = pd.read_csv(hgnc_file_name, sep='\t', dtype=str,
+                          usecols=lambda column: column in {'symbol', 'name', 'prev_symbol', 'alias_symbol'})
+    resolver = HgncSymbolResolver.from_hgnc_table(hgnc_df)
+
+    if cache_file_name is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file first, so parallel runs never read a partial index
+        tmp_file_name = '{}.{}.tmp'.format(cache_file_name, os.getpid())
+        with open(tmp_file_name, 'w') as cache_file:
+            json.dump({'approved': resolver.approved, 'previous': resolver.previous, 'aliases': resolver.aliases}, cache_file)
+        os.replace(tmp_file_name, cache_file_name)
+    return resolver
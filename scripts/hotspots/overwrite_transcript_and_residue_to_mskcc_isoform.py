@@ -1,45 +1,21 @@
 #!/usr/bin/env python3
 import argparse
+import os
+import sys
 import pandas as pd
 
-
-def load_hgnc(hgnc_path: str):
-    """
-    Load HGNC file, return:
-    - current_symbols: set of approved symbols
-    - prev_to_current: map of old symbol -> current symbol
-    """
-    hgnc = pd.read_csv(hgnc_path, sep="\t", dtype=str).fillna("")
-
-    current_symbols = set(hgnc["symbol"].astype(str))
-
-    prev_to_current = {}
-    for _, row in hgnc.iterrows():
-        current = row["symbol"]
-        prev_field = row.get("prev_symbol", "")
-        if not prev_field:
-            continue
-        for prev_sym in prev_field.split("|"):
-            prev_sym = prev_sym.strip()
-            if prev_sym:
-                prev_to_current.setdefault(prev_sym, current)
-
-    return current_symbols, prev_to_current
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from transcript_versions import load_transcript_version_index
+from hgnc_symbols import HgncSymbolResolver, load_hgnc_symbol_resolver
 
 
-def normalize_symbol(symbol: str,
-                     current_symbols: set,
-                     prev_to_current: dict) -> str:
+def normalize_symbol(symbol: str, symbol_resolver: HgncSymbolResolver) -> str:
     """
-    1. if symbol already current, return as-is
+    1. if symbol already current, return the current symbol
     2. else if symbol is a prev_symbol, map to current
     3. else keep as-is
     """
-    if symbol in current_symbols:
-        return symbol
-    if symbol in prev_to_current:
-        return prev_to_current[symbol]
-    return symbol
+    return symbol_resolver.resolve(symbol, use_aliases=False) or symbol
 
 
 def load_isoform_overrides(path: str) -> dict:
@@ -72,20 +48,9 @@ def load_biomart_versions(biomart_path: str) -> dict:
     """
     Build:
       transcript_stable_id (no version) -> version number string
-    from ensembl_biomart_geneids.txt
+    from ensembl_biomart_geneids.txt, using the shared transcript version index
     """
-    biomart = pd.read_csv(biomart_path, sep="\t", dtype=str).fillna("")
-    versions = {}
-    for _, row in biomart.iterrows():
-        tid = row["Transcript stable ID"]
-        ver_full = row["Versioned transcript ID"]
-        if tid:
-            if "." in ver_full:
-                _, ver_num = ver_full.split(".", 1)
-            else:
-                ver_num = ""
-            versions.setdefault(tid, ver_num)
-    return versions
+    return load_transcript_version_index(biomart_path)
 
 
 def load_residue_change_map(residue_path: str) -> dict:
@@ -108,8 +73,7 @@ def load_residue_change_map(residue_path: str) -> dict:
 
 def transform_hotspots(
     hotspots_df: pd.DataFrame,
-    current_symbols: set,
-    prev_to_current: dict,
+    symbol_resolver: HgncSymbolResolver,
     override_map: dict,
     biomart_ver_map: dict,
     residue_change_map: dict
@@ -132,11 +96,7 @@ def transform_hotspots(
     for _, row in hotspots_df.iterrows():
         # Step 1. normalize symbol
         original_symbol = str(row["hugo_symbol"])
-        final_symbol = normalize_symbol(
-            original_symbol,
-            current_symbols,
-            prev_to_current
-        )
+        final_symbol = normalize_symbol(original_symbol, symbol_resolver)
 
         # Step 2. transcript selection + version
         orig_tid = str(row["transcript_id"])
@@ -198,7 +158,7 @@ def main():
     args = parser.parse_args()
 
     # load inputs
-    current_symbols, prev_to_current = load_hgnc(args.hgnc)
+    symbol_resolver = load_hgnc_symbol_resolver(args.hgnc)
     override_map = load_isoform_overrides(args.overrides)
     biomart_ver_map = load_biomart_versions(args.biomart)
     residue_change_map = load_residue_change_map(args.residue_changes)
@@ -207,8 +167,7 @@ def main():
     # transform
     result_df = transform_hotspots(
         hotspots_df,
-        current_symbols,
-        prev_to_current,
+        symbol_resolver,
         override_map,
         biomart_ver_map,
         residue_change_map
@@ -19,15 +19,23 @@ Logs and outputs:
  - reports the total number of rows in original hotspots file, the number of rows replaced and the number of rows dropped
  - outputs a new updated combined 2d and 3d hotspot file (grch38)
 
+Protein sequences are kept in the Ensembl REST cache (see ../ensembl_rest_cache.py), by release of the server, so
+a second run does not query Ensembl again.
+
 Links to used API docs: 
  - https://rest.ensembl.org/documentation/info/sequence_id
  """
 
 
 import argparse
+import os
+import sys
 import requests
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ensembl_rest_cache import EnsemblOfflineError, EnsemblRestCache, get_release, offline_from_environment
+
 from requests.adapters import HTTPAdapter, Retry
 s = requests.Session()
 retries = Retry(total=5,
@@ -39,7 +47,22 @@ ENSEMBL_GRCH38_SERVER = "https://rest.ensembl.org"
 ENSEMBL_GRCH37_SERVER = "https://grch37.rest.ensembl.org"
 nr_ensembl_ws_calls = 1
 
+SEQUENCE_ENDPOINT = "/sequence/id?type=protein"
+
 protein_sequence_cache = {}
+# Ensembl REST cache on disk and the release of each server, opened on first use
+rest_cache = None
+server_releases = {}
+
+
+def get_rest_cache_and_release(ensembl_server: str):
+    global rest_cache
+    if rest_cache is None:
+        rest_cache = EnsemblRestCache()
+    if ensembl_server not in server_releases:
+        server_releases[ensembl_server] = get_release(ensembl_server, rest_cache, offline_from_environment(), s)
+    return rest_cache, server_releases[ensembl_server]
+
 
 def get_translated_protein_sequence(ensembl_server: str, transcript_id: str) -> str:
     """ Returns the translated protein sequence for the given transcript id.
@@ -49,6 +72,13 @@ def get_translated_protein_sequence(ensembl_server: str, transcript_id: str) ->
     cache_key = "{0}_{1}".format(ensembl_server, transcript_id)
     if cache_key in protein_sequence_cache:
         return protein_sequence_cache[cache_key]
+    cache, release = get_rest_cache_and_release(ensembl_server)
+    sequence = cache.get(ensembl_server, SEQUENCE_ENDPOINT, release, transcript_id)
+    if sequence is not None:
+        protein_sequence_cache[cache_key] = sequence
+        return sequence
+    if offline_from_environment():
+        raise EnsemblOfflineError("{0} is not in the Ensembl REST cache of {1}".format(transcript_id, ensembl_server))
     api_url = "{0}/sequence/id/{1}?type=protein".format(ensembl_server, transcript_id) 
     response = s.get(api_url, headers={ "Content-Type" : "text/plain"}, timeout=2)
     nr_ensembl_ws_calls += 1
@@ -60,6 +90,7 @@ def get_translated_protein_sequence(ensembl_server: str, transcript_id: str) ->
         else:
             response.raise_for_status()
     protein_sequence_cache[cache_key] = response.text
+    cache.put(ensembl_server, SEQUENCE_ENDPOINT, release, transcript_id, response.text)
     return response.text
 
 
@@ -87,32 +118,40 @@ def new_transcript_id_is_valid(grch37_transcript_id: str,
     return grch37_sequence == grch38_sequence
 
 
-def get_new_hugo_symbol(old_hugo_symbol: str, hugo_and_transcript_map: str) -> str:
+def get_symbol_index(hugo_and_transcript_map: dict) -> dict:
+    """Index the "previous_symbols" and "synonyms" columns of the map values by symbol.
+       Symbols are case-sensitive, and a symbol of several genes maps to the first gene in the map
+    """
+    symbol_index = {}
+    for new_hugo_symbol, other_columns in hugo_and_transcript_map.items():
+        for column in ['previous_symbols', 'synonyms']:
+            if type(other_columns[column]) == str:
+                for symbol in other_columns[column].split(','):
+                    symbol_index.setdefault(symbol.strip(), new_hugo_symbol)
+    return symbol_index
+
+
+def get_new_hugo_symbol(old_hugo_symbol: str, hugo_and_transcript_map: dict, symbol_index: dict = None) -> str:
     """Looks for the give old_hugo_symbol in  "previous_symbols" or "synonyms" columns of the map values
        and when found, returns the corresponding key (the new hugo_symbol). If not found, returns None.
     """
-    for new_hugo_symbol, other_columns in hugo_and_transcript_map.items():
-        if type(other_columns['previous_symbols']) == str:
-            previous_symbols = [x.strip() for x in other_columns['previous_symbols'].split(',')]
-            if old_hugo_symbol in previous_symbols:
-                print("found {0} in 'previous_symbols".format(old_hugo_symbol))
-                return new_hugo_symbol
-        if type(other_columns['synonyms']) == str:
-            synonyms = [x.strip() for x in other_columns['synonyms'].split(',')]
-            if old_hugo_symbol in synonyms:
-                print("found {0} in 'synonyms".format(old_hugo_symbol))
-                return new_hugo_symbol
-    return None
-
-
-def find_grch38_transcript_id(hugo_symbol: str, hugo_and_transcript_map: dict, grch38_isoform_override_source: str) -> str:
+    if symbol_index is None:
+        symbol_index = get_symbol_index(hugo_and_transcript_map)
+    new_hugo_symbol = symbol_index.get(old_hugo_symbol)
+    if new_hugo_symbol is not None:
+        print("found {0} in 'previous_symbols' or 'synonyms' of {1}".format(old_hugo_symbol, new_hugo_symbol))
+    return new_hugo_symbol
+
+
+def find_grch38_transcript_id(hugo_symbol: str, hugo_and_transcript_map: dict, grch38_isoform_override_source: str,
+                              symbol_index: dict = None) -> str:
     """Tries to find the hugo symbol in the map's index or in the alias column. If found,
        returns the respective transcript id according to grch38_isoform_override_source.
        If not found, returns None.
     """
     if hugo_symbol not in hugo_and_transcript_map:
         # then try to find the row that has this symbol as one of the values in "previous_symbols" or "synonyms"
-        hugo_symbol = get_new_hugo_symbol(hugo_symbol, hugo_and_transcript_map)
+        hugo_symbol = get_new_hugo_symbol(hugo_symbol, hugo_and_transcript_map, symbol_index)
         if hugo_symbol is None:
             return None
           
@@ -123,6 +162,7 @@ def generate_updated_grch38_hotspots_info(grch38_hugo_and_transcript_id_file_nam
                                           grch38_isoform_override_source: str,
                                           grch37_hotspots_2d_3d_file_name: str) -> None:
     hugo_and_transcript_map = get_gene_and_transcript_map(grch38_hugo_and_transcript_id_file_name)
+    symbol_index = get_symbol_index(hugo_and_transcript_map)
     grch37_hotspots_df = pd.read_csv(grch37_hotspots_2d_3d_file_name, sep='\t', dtype=str)
     
     rows_to_drop = []
@@ -132,7 +172,7 @@ def generate_updated_grch38_hotspots_info(grch38_hugo_and_transcript_id_file_nam
         hugo_symbol = row['hugo_symbol']
         print("Processing {0} ...".format(hugo_symbol))
         grch37_transcript_id = row['transcript_id']
-        proposed_grch38_transcript_id = find_grch38_transcript_id(hugo_symbol, hugo_and_transcript_map, grch38_isoform_override_source)
+        proposed_grch38_transcript_id = find_grch38_transcript_id(hugo_symbol, hugo_and_transcript_map, grch38_isoform_override_source, symbol_index)
         is_valid = proposed_grch38_transcript_id is not None and \
                    new_transcript_id_is_valid(grch37_transcript_id,
                                               proposed_grch38_transcript_id)
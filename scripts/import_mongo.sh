@@ -101,6 +101,17 @@ if [[ "$SLIM_MODE" == "true" ]]; then
   exit 0
 fi
 
+# Genomic intervals of transcripts, exons and UTRs, for indexed region queries. Exports of older pipeline runs lack them
+INTERVALS_FILE="${DIR}/../data/${REF_ENSEMBL_VERSION}/export/ensembl_transcript_intervals.json.gz"
+if [[ -f "$INTERVALS_FILE" ]]; then
+  if should_import "ensembl.transcript_intervals"; then
+    import "ensembl.transcript_intervals" <(gunzip -c "$INTERVALS_FILE") '--drop --type json'
+    mongosh "$MONGO_URI" --quiet --eval "db.getSiblingDB('${MONGO_DB}').getCollection('ensembl.transcript_intervals').createIndex({chromosome: 1, bin: 1, start: 1})"
+  fi
+else
+  echo "[INFO] No ensembl_transcript_intervals.json.gz in export → skipping ensembl.transcript_intervals."
+fi
+
 # Exit early if non-human
 if [[ "$SPECIES" != "homo_sapiens" ]]; then
   echo "[INFO] Non-human species detected. Skipping human-specific imports."
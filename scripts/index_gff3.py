@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+'''
+Splits an Ensembl GFF3 into typed tables in a single pass over the file:
+
+    exons        ensembl_transcript_info.txt, exons and UTRs, as
+                 transform_gff_to_tsv_for_exon_info_from_ensembl.py writes it
+    cds          ensembl_gff_cds.txt, CDS segments with their protein id and phase
+    transcripts  ensembl_gff_transcripts.txt, transcript spans, biotypes and
+                 canonical flags
+    genes        ensembl_gff_genes.txt, gene spans and biotypes
+
+The tables are written to the directory of the manifest, tmp/gff3_index.json,
+which lists their files, columns, dtypes and row counts. Each table also gets
+its typed Arrow sidecar if pyarrow is installed, see ensembl_tables.py, so
+later steps read the pre-parsed tables instead of decompressing and parsing
+the GFF3 again.
+'''
+
+import argparse
+import contextlib
+import json
+import os
+
+import pipeline_profile
+from pipeline_profile import phase
+from ensembl_tables import read_table, write_sidecar, get_dtypes, get_source_stat, TRANSCRIPT_INFO_SCHEMA, \
+    GFF_CDS_SCHEMA, GFF_TRANSCRIPTS_SCHEMA, GFF_GENES_SCHEMA
+from gff3_reader import open_gff3, iter_features, compile_attribute_pattern
+from transform_gff_to_tsv_for_exon_info_from_ensembl import COLUMNS, FEATURE_TYPES, STRANDS, WRITE_BATCH_SIZE, \
+    get_transcript_info_row
+
+MANIFEST_VERSION = 1
+CANONICAL_TAG = 'Ensembl_canonical'
+
+# file name, columns and schema by table name
+GFF3_TABLES = {
+    'exons': ('ensembl_transcript_info.txt', COLUMNS, TRANSCRIPT_INFO_SCHEMA),
+    'cds': ('ensembl_gff_cds.txt', list(GFF_CDS_SCHEMA), GFF_CDS_SCHEMA),
+    'transcripts': ('ensembl_gff_transcripts.txt', list(GFF_TRANSCRIPTS_SCHEMA), GFF_TRANSCRIPTS_SCHEMA),
+    'genes': ('ensembl_gff_genes.txt', list(GFF_GENES_SCHEMA), GFF_GENES_SCHEMA),
+}
+
+CDS_ATTRIBUTES = compile_attribute_pattern('Parent', 'protein_id')
+TRANSCRIPT_ATTRIBUTES = compile_attribute_pattern('ID', 'Parent', 'Name', 'biotype', 'version', 'tag')
+GENE_ATTRIBUTES = compile_attribute_pattern('ID', 'Name', 'biotype', 'version')
+
+
+class TableWriter:
+    """Writes the rows of a tab separated table in batches"""
+
+    def __init__(self, file_name, columns):
+        self.output = open(file_name, 'w')
+        self.output.write('\t'.join(columns) + '\n')
+        self.batch = []
+        self.rows = 0
+
+    def add(self, row):
+        self.batch.append('\t'.join(row) + '\n')
+        if len(self.batch) == WRITE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.output.writelines(self.batch)
+        self.rows += len(self.batch)
+        self.batch = []
+
+    def close(self):
+        self.flush()
+        self.output.close()
+
+
+def strip_prefix(feature_id):
+    """ENST00000456328 from transcript:ENST00000456328"""
+    return feature_id.split(':', 1)[-1]
+
+
+def get_cds_row(columns):
+    parent, protein_id = CDS_ATTRIBUTES.match(columns[8]).groups('')
+    return [strip_prefix(parent), protein_id, columns[0], columns[3], columns[4], STRANDS.get(columns[6], ''),
+            columns[7] if columns[7] != '.' else '']
+
+
+def get_transcript_row(columns):
+    transcript_id, parent, name, biotype, version, tags = TRANSCRIPT_ATTRIBUTES.match(columns[8]).groups('')
+    return [strip_prefix(transcript_id), strip_prefix(parent), name, columns[2], biotype, columns[0], columns[3],
+            columns[4], STRANDS.get(columns[6], ''), version, '1' if CANONICAL_TAG in tags.split(',') else '0']
+
+
+def get_gene_row(columns):
+    gene_id, name, biotype, version = GENE_ATTRIBUTES.match(columns[8]).groups('')
+    return [strip_prefix(gene_id), name, columns[2], biotype, columns[0], columns[3], columns[4],
+            STRANDS.get(columns[6], ''), version]
+
+
+def get_table_file_names(output_dir):
+    return {name: os.path.join(output_dir, file_name) for name, (file_name, _, _) in GFF3_TABLES.items()}
+
+
+def index_gff3(gff_file, output_dir):
+    """Write all tables of a GFF3 file to output_dir in one pass. Returns the
+    number of rows by table name"""
+    file_names = get_table_file_names(output_dir)
+    with contextlib.ExitStack() as stack:
+        writers = {}
+        for name, (_, columns, _) in GFF3_TABLES.items():
+            writers[name] = TableWriter(file_names[name], columns)
+            stack.callback(writers[name].close)
+        gff = stack.enter_context(open_gff3(gff_file))
+        for columns in iter_features(gff):
+            # transcripts and genes have many types (mRNA, lnc_RNA, ncRNA_gene, ...), so their ids tell them apart
+            if columns[2] in FEATURE_TYPES:
+                writers['exons'].add(get_transcript_info_row(columns))
+            elif columns[2] == 'CDS':
+                writers['cds'].add(get_cds_row(columns))
+            elif columns[8].startswith('ID=transcript:'):
+                writers['transcripts'].add(get_transcript_row(columns))
+            elif columns[8].startswith('ID=gene:'):
+                writers['genes'].add(get_gene_row(columns))
+    return {name: writer.rows for name, writer in writers.items()}
+
+
+def write_manifest(gff_file, gff3_index, rows):
+    """Write the manifest of the tables next to it, after their sidecars"""
+    output_dir = os.path.dirname(gff3_index)
+    tables = {}
+    for name, file_name in get_table_file_names(output_dir).items():
+        _, columns, schema = GFF3_TABLES[name]
+        write_sidecar(file_name, schema)
+        tables[name] = {'file': os.path.basename(file_name),
+                        'rows': rows[name],
+                        'dtypes': get_dtypes(columns, schema)}
+    manifest = {'version': MANIFEST_VERSION,
+                'source': dict(file=os.path.basename(gff_file), **get_source_stat(gff_file)),
+                'tables': tables}
+    with open(gff3_index + '~', 'w') as output:
+        json.dump(manifest, output, indent=2)
+        output.write('\n')
+    os.replace(gff3_index + '~', gff3_index)
+
+
+def read_gff3_table(gff3_index, name):
+    """A table listed in the manifest gff3_index, with its dtypes"""
+    with open(gff3_index) as manifest_file:
+        manifest = json.load(manifest_file)
+    file_name = os.path.join(os.path.dirname(gff3_index), manifest['tables'][name]['file'])
+    return read_table(file_name, GFF3_TABLES[name][2])
+
+
+def main(gff_file, gff3_index):
+    with phase('load') as profiled:
+        rows = index_gff3(gff_file, os.path.dirname(gff3_index))
+        profiled.rows = sum(rows.values())
+
+    with phase('write') as profiled:
+        write_manifest(gff_file, gff3_index, rows)
+        profiled.rows = len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("gff_file",
+                        help="tmp/homo_sapiens.gff3.gz")
+    parser.add_argument("gff3_index",
+                        help="tmp/gff3_index.json, the tables are written to the same directory")
+    pipeline_profile.add_profile_argument(parser)
+    args = parser.parse_args()
+    pipeline_profile.configure(args.gff3_index, args.profile)
+
+    main(args.gff_file, args.gff3_index)
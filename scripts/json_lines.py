@@ -0,0 +1,63 @@
+"""Streaming export of DataFrames as JSON lines, one JSON record per row.
+
+Rows are serialized a chunk at a time with the JSON encoder of pandas, so the
+output is the same as DataFrame.to_json(orient='records', lines=True) without
+the whole document set in memory. Output file names ending in .gz are
+compressed chunk by chunk on several threads, each chunk as a separate gzip
+member. Concatenated members are a valid gzip file, read as one stream by
+gunzip -c (as in import_mongo.sh), zcat and Python's gzip module."""
+
+import collections
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+CHUNK_SIZE = 20000
+# as gzip on the command line, much faster than 9 for a slightly larger file
+COMPRESS_LEVEL = 6
+
+
+def iter_json_chunks(frames, chunk_size=CHUNK_SIZE):
+    for frame in frames:
+        # an empty frame is written as an empty line, as to_json does
+        for start in range(0, max(len(frame), 1), chunk_size):
+            chunk = frame.iloc[start:start + chunk_size]
+            yield len(chunk), chunk.to_json(orient='records', lines=True)
+
+
+def compress_chunk(text):
+    # mtime 0 makes the output reproducible
+    return gzip.compress(text.encode('utf-8'), COMPRESS_LEVEL, mtime=0)
+
+
+def write_json_lines(frames, output, chunk_size=CHUNK_SIZE, threads=None):
+    """Write the rows of a DataFrame, or of an iterable of DataFrames one after
+    the other, as JSON lines. Output is a file name, compressed if it ends in
+    .gz, or a text file object such as sys.stdout. Returns the number of rows"""
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+    rows = 0
+    if not isinstance(output, str):
+        for chunk_rows, text in iter_json_chunks(frames, chunk_size):
+            output.write(text)
+            rows += chunk_rows
+        return rows
+    if not output.endswith('.gz'):
+        with open(output, 'w') as output_file:
+            return write_json_lines(frames, output_file, chunk_size)
+
+    threads = threads or os.cpu_count() or 1
+    with open(output, 'wb') as output_file, ThreadPoolExecutor(threads) as pool:
+        # zlib releases the GIL, so chunks compress while the next ones are
+        # serialized. Limit the chunks in flight to bound memory
+        pending = collections.deque()
+        for chunk_rows, text in iter_json_chunks(frames, chunk_size):
+            pending.append(pool.submit(compress_chunk, text))
+            rows += chunk_rows
+            if len(pending) > 2 * threads:
+                output_file.write(pending.popleft().result())
+        while pending:
+            output_file.write(pending.popleft().result())
+    return rows
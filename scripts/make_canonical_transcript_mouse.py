@@ -8,6 +8,8 @@ Additionally, some dataframe reformatting is performed to resemble the human dat
 
 import pandas as pd
 import argparse
+import pipeline_profile
+from pipeline_profile import phase
 
 def load_MGI_data(ensembl_data, genemodel_data):
     """Loads MGI mouse data frames and combines relevant columns. 
@@ -85,11 +87,17 @@ def add_canonical(merged_df, canonical_transcripts):
 
 
 def main(transcript_info, ensembl_data, genemodel_data, canonical_transcripts_per_symbol):
-    mgi_data = load_MGI_data(ensembl_data, genemodel_data)
-    canonical = get_canonical_transcript_by_ensembl(transcript_info)
-    formatted_df = add_canonical(mgi_data, canonical)
+    with phase('load') as profiled:
+        mgi_data = load_MGI_data(ensembl_data, genemodel_data)
+        canonical = get_canonical_transcript_by_ensembl(transcript_info)
+        profiled.rows = len(mgi_data) + len(canonical)
+    with phase('join') as profiled:
+        formatted_df = add_canonical(mgi_data, canonical)
+        profiled.rows = len(formatted_df)
     
-    formatted_df.to_csv(canonical_transcripts_per_symbol, sep="\t", header=True, index=False)
+    with phase('write') as profiled:
+        formatted_df.to_csv(canonical_transcripts_per_symbol, sep="\t", header=True, index=False)
+        profiled.rows = len(formatted_df)
 
 
 if __name__ == "__main__":
@@ -102,6 +110,8 @@ if __name__ == "__main__":
                         help="common_input/mouse/MGI_Gene_Model_Coord.rpt")
     parser.add_argument("ensembl_biomart_canonical_transcripts_per_mgi",
                         help="tmp/ensembl_biomart_canonical_transcripts_per_mgi.txt")
+    pipeline_profile.add_profile_argument(parser)
     args = parser.parse_args()
+    pipeline_profile.configure(args.ensembl_biomart_canonical_transcripts_per_mgi, args.profile)
 
     main(args.transcript_info, args.ensembl_data, args.genemodel_data, args.ensembl_biomart_canonical_transcripts_per_mgi)
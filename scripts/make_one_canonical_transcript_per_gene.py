@@ -1,174 +1,208 @@
 #!/usr/bin/env python3
 import pandas as pd
 import numpy as np
-import itertools
 import argparse
-
-def normalize_version_string(x):
-    if pd.isna(x):
-        return None
-    s = str(x).strip()
-    if not s or s.lower() in {"nan", "none"}:
-        return None
-    if s.endswith(".0"):
-        s = s[:-2]
-    return s if s.isdigit() else None
-
-def split_enst_id(enst):
-    # split enst id, e.g. ENST00000123456.7 -> 'ENST00000123456','7'
-    if enst is None or pd.isna(enst):
-        return None, None
-    s = str(enst).strip()
-    if "." in s:
-        b, v = s.split(".", 1)
-        return b, normalize_version_string(v)
-    return s, None
-
-def find_transcript_version(transcript_info_df, base_enst):
-    if not base_enst:
-        return np.nan
-    rows = transcript_info_df[transcript_info_df['transcript_stable_id'] == base_enst]
-    if rows.empty:
-        return np.nan
-    # Prefer transcript_id_version, else parse from versioned_transcript_id
-    if 'transcript_id_version' in rows:
-        version = rows['transcript_id_version'].apply(normalize_version_string).dropna()
-    else:
-        version = pd.Series([], dtype=object)
-    if version.empty and 'versioned_transcript_id' in rows:
-        version = rows['versioned_transcript_id'].astype(str).str.extract(r'\.(\d+)$')[0].dropna()
-    uniq = sorted({v for v in version if isinstance(v, str) and v.isdigit()}, key=lambda x: int(x))
-    return uniq[-1] if uniq else np.nan
-
-def get_overrides_transcript(overrides_tables, ensembl_table, ensembl_table_indexed_by_gene_stable_id, hgnc_symbol, hgnc_canonical_genes, overrides_table_names):
-    """Find canonical transcript id for given hugo symbol. Overrides_tables is
-    a list of different override tables"""
-    for index in range(len(overrides_tables)):
-        overrides = overrides_tables[index]
-        try:
-            # corner case when there are multiple overrides for a given gene symbol
-            if overrides.loc[hgnc_symbol].ndim > 1:
-                transcript = overrides.loc[hgnc_symbol].isoform_override.values[0]
-                isoform_override = overrides_table_names[index]
-            else:
-                transcript = overrides.loc[hgnc_symbol]['isoform_override']
-                isoform_override = overrides_table_names[index]
-            # return transcript and isoform_override_explanation
-            return transcript, isoform_override
-        except KeyError:
-            pass
-    # get ensembl canonical version otherwise
-    return get_ensembl_canonical_transcript_id_from_hgnc_then_ensembl(ensembl_table, ensembl_table_indexed_by_gene_stable_id, hgnc_symbol, hgnc_canonical_genes, 'transcript_stable_id')
-
-def pick_canonical_longest_transcript_from_ensembl_table(ensembl_rows, field):
-    """Get canonical transcript id with largest protein length or if there is
-    no such thing, pick biggest gene id"""
-    return ensembl_rows.sort_values('is_canonical protein_length gene_stable_id'.split(), ascending=False)[field].values[0], "ensembl longest"
-
-def get_ensembl_canonical(ensembl_rows, field):
-
-    if (ensembl_rows.ndim == 1 and len(ensembl_rows) == 0) or (ensembl_rows.ndim == 2 and len(ensembl_rows) == 0):
-        return np.nan, np.nan
-    elif ensembl_rows.ndim == 1:
-        # this gene onlyhas one transcript from ensembl_table
-        return ensembl_rows[field], "ensembl only one transcript"
-    elif ensembl_rows.ndim == 2:
-        # there are multiple transcripts found by hugo_symbol or ensembl_gene_id
-        # we need to pick the longest transcript in this case
-        return pick_canonical_longest_transcript_from_ensembl_table(ensembl_rows, field)
-
-def get_ensembl_canonical_transcript_id_from_hgnc_then_ensembl(ensembl_table, ensembl_table_indexed_by_gene_stable_id, hgnc_symbol, hgnc_canonical_genes, field):
-    """Determine canonical transcript based on hgnc mappings to ensembl id.
-    If not possible use ensembl's data.
-    ensembl_table is the same as ensembl_table_indexed_by_gene_stable_id
-    But ensembl_table has hugo_symbol as index
-    ensembl_table_indexed_by_gene_stable_id has gene_stable_id as index
-    Adding ensembl_table_indexed_by_gene_stable_id to improve performance since this is the most time consuming part
+import json
+import multiprocessing
+import os
+from transcript_versions import normalize_version_string, split_enst_id, build_transcript_version_index
+from hgnc_symbols import load_hgnc_symbol_resolver
+from ensembl_tables import read_table, CANONICAL_DATA_SCHEMA
+import pipeline_profile
+from pipeline_profile import phase
+
+def split_enst_ids(transcripts, version_index):
+    """Split transcript ids into bare id and version. Unversioned ids get the
+    latest version known for them in Ensembl"""
+    split = [split_enst_id(transcript) for transcript in transcripts]
+    bases = pd.Series([base for base, _ in split], index=transcripts.index, dtype=object)
+    versions = pd.Series([version for _, version in split], index=transcripts.index, dtype=object)
+    unversioned = versions.isna()
+    versions[unversioned] = bases[unversioned].map(version_index)
+    return bases, versions
+
+def compile_isoform_overrides(custom, uniprot, mskcc):
+    """Compile the isoform override tables into one lookup indexed by hugo
+    symbol. Per source it holds whether there is an override and the first
+    override transcript of the gene symbol, plus the mskcc note"""
+    compiled = {}
+    for source, overrides in [('genome_nexus', custom), ('uniprot', uniprot), ('mskcc', mskcc)]:
+        overrides = overrides[~overrides.index.duplicated()]
+        compiled[source + '_override'] = pd.Series(True, index=overrides.index)
+        compiled[source + '_transcript'] = overrides['isoform_override']
+    if 'note' in mskcc.columns:
+        notes = mskcc.loc[~mskcc.index.duplicated(), 'note']
+        notes = notes[notes.map(lambda note: isinstance(note, str) and bool(note.strip()))]
+        compiled['mskcc_note'] = notes.map(str.strip).astype(object)
+    return pd.DataFrame(compiled)
+
+def index_by_symbol_and_gene(transcript_info_df):
+    """The ensembl table indexed by hgnc symbol and by gene stable id. The
+    sorts are stable, so the rows of a symbol or gene keep their order in the
+    input, which breaks ties between transcripts. Rows of other symbols can't
+    change that order, so neither can they change the fingerprint of the
+    symbol"""
+    transcript_info_df = transcript_info_df.set_index('hgnc_symbol').sort_index(kind='stable')
+    transcript_info_indexed_by_gene_stable_id = transcript_info_df
+    # duplicate a temp column to use as index
+    transcript_info_indexed_by_gene_stable_id["gene_stable_id_temp"] = transcript_info_df['gene_stable_id']
+    transcript_info_indexed_by_gene_stable_id = transcript_info_indexed_by_gene_stable_id.set_index('gene_stable_id_temp').sort_index(kind='stable')
+    return transcript_info_df, transcript_info_indexed_by_gene_stable_id
+
+def pick_canonical_longest_transcripts(ensembl_table):
+    """Get canonical transcript id with largest protein length for every index
+    value of ensembl_table at once, or if there is no such thing, pick biggest
+    gene id. Ties keep the row order of ensembl_table"""
+    ranked = ensembl_table.reset_index(drop=True)
+    ranked['ensembl_key'] = ensembl_table.index
+    ranked['table_order'] = np.arange(len(ranked))
+    ranked = ranked[ranked['ensembl_key'].notna()]
+    ranked = ranked.sort_values('ensembl_key is_canonical protein_length gene_stable_id table_order'.split(),
+                                ascending=[True, False, False, False, True])
+    transcripts_per_key = ranked.groupby('ensembl_key', sort=False).size()
+    canonical = ranked.drop_duplicates('ensembl_key').set_index('ensembl_key')
+    canonical['explanation'] = np.where(transcripts_per_key.reindex(canonical.index) == 1,
+                                        "ensembl only one transcript", "ensembl longest")
+    return canonical
+
+def get_ensembl_canonical_transcripts_from_hgnc_then_ensembl(canonical_by_symbol, canonical_by_gene_stable_id, hugos, hgnc_canonical_genes):
+    """Determine canonical transcript for all hugo symbols based on hgnc
+    mappings to ensembl id. If not possible use ensembl's data.
+    canonical_by_symbol and canonical_by_gene_stable_id are the transcripts
+    picked by pick_canonical_longest_transcripts from the ensembl table
+    indexed by hugo_symbol and by gene_stable_id respectively
     """
+    hgnc_gene_ids = hgnc_canonical_genes['ensembl_gene_id'].reindex(hugos)
+    by_gene = canonical_by_gene_stable_id.reindex(hgnc_gene_ids)
+    by_gene.index = hugos
+    found_by_gene = by_gene['explanation'].notna()
+    # if couldn't find any transcripts by ensembl_gene_id, switch to searching by hgnc_symbol
+    by_symbol = canonical_by_symbol.reindex(hugos[~found_by_gene.values])
+    return pd.concat([by_gene[found_by_gene], by_symbol]).reindex(hugos)
+
+def get_transcript_ids_and_explanations(hugos, canonical_by_symbol, canonical_by_gene_stable_id, version_index, hgnc_df, isoform_overrides):
+    """Pick ensembl canonical and override transcripts for all hugo symbols
+    at once. Returns one row per hugo symbol"""
+    hugos = pd.Index(hugos)
+    ensembl = get_ensembl_canonical_transcripts_from_hgnc_then_ensembl(canonical_by_symbol, canonical_by_gene_stable_id, hugos, hgnc_df)
+    overrides = isoform_overrides.reindex(hugos)
+
+    one_transcript_per_hugo_symbol = pd.DataFrame(index=hugos)
+    one_transcript_per_hugo_symbol['ensembl_canonical_gene'] = ensembl['gene_stable_id']
+    one_transcript_per_hugo_symbol['ensembl_canonical_transcript'], one_transcript_per_hugo_symbol['ensembl_canonical_transcript_version'] = \
+        split_enst_ids(ensembl['versioned_transcript_id'], version_index)
+    one_transcript_per_hugo_symbol['ensembl_canonical_transcript_explanation'] = ensembl['explanation']
+
+    for source, isoform_override in [('genome_nexus', "genome nexus isoform override"),
+                                     ('uniprot', "uniprot isoform override"),
+                                     ('mskcc', "mskcc isoform override")]:
+        # get ensembl canonical version otherwise
+        has_override = overrides[source + '_override'].notna()
+        transcripts = overrides[source + '_transcript'].where(has_override, ensembl['transcript_stable_id'])
+        explanations = pd.Series(np.where(has_override, isoform_override, ensembl['explanation']), index=hugos, dtype=object)
+        one_transcript_per_hugo_symbol[source + '_canonical_transcript'], one_transcript_per_hugo_symbol[source + '_canonical_transcript_version'] = \
+            split_enst_ids(transcripts, version_index)
+        one_transcript_per_hugo_symbol[source + '_canonical_transcript_explanation'] = explanations
+
+    if 'mskcc_note' in overrides.columns:
+        has_note = overrides['mskcc_note'].notna()
+        one_transcript_per_hugo_symbol.loc[has_note, 'mskcc_canonical_transcript_explanation'] += "; " + overrides.loc[has_note, 'mskcc_note']
+
+    return one_transcript_per_hugo_symbol
+
+# inputs of get_transcript_ids_and_explanations shared with the forked workers
+_shared_inputs = None
+
+def _get_transcript_ids_and_explanations_for_shard(hugos):
+    return get_transcript_ids_and_explanations(hugos, **_shared_inputs)
+
+def get_transcript_ids_and_explanations_in_shards(workers, hugos, **inputs):
+    """Split the hugo symbols in shards and process them in a pool of forked
+    workers. The read-only inputs are inherited by the workers instead of
+    being pickled for every shard. Results keep the order of hugos"""
+    global _shared_inputs
+    _shared_inputs = inputs
+    shards = [shard for shard in np.array_split(np.asarray(hugos, dtype=object), workers * 4) if len(shard) > 0]
     try:
-        # try to find hgnc_symbol from hgnc_canonical_genes
-        # it should only have one row returned, otherwise raise an exception
-        hgnc_gene_rows = hgnc_canonical_genes.loc[hgnc_symbol]
-    except KeyError:
-        raise(Exception("Unknown hugo symbol"))
-    if hgnc_gene_rows.ndim == 1:
-        try:
-            # from the only one record found in hgnc_canonical_genes, we could have the ensembl_gene_id from the record
-            # find transcripts from ensembl_table (same as ensembl_table_indexed_by_gene_stable_id) by searching ensembl_gene_id
-            # here we use ensembl_table_indexed_by_gene_stable_id instead to increase performance
-            # get_ensembl_canonical returns one transcript from all transcripts found by ensembl_gene_id
-            return get_ensembl_canonical(ensembl_table_indexed_by_gene_stable_id.loc[hgnc_gene_rows.ensembl_gene_id], field)
-        except KeyError:
-            # if couldn't find any transcripts by ensembl_gene_id, switch to searching by hgnc_symbol
-            # there's actually 222 of these (see notebook)
-            try:
-                return get_ensembl_canonical(ensembl_table.loc[hgnc_symbol], field)
-            except KeyError:
-                return np.nan, np.nan
-    else:
-        raise(Exception("One hugo symbol expected in hgnc_canonical_genes"))
-
-def get_transcript_id_and_explanation(transcript_info_df, transcript_info_indexed_by_gene_stable_id, hugo_symbol, hgnc_df, mskcc, uniprot, custom):
-    ensembl_canonical_gene, ensembl_canonical_gene_explanation = get_ensembl_canonical_transcript_id_from_hgnc_then_ensembl(transcript_info_df, transcript_info_indexed_by_gene_stable_id, hugo_symbol, hgnc_df, 'gene_stable_id')
-    ensembl_canonical_transcript, ensembl_canonical_transcript_explanation = get_ensembl_canonical_transcript_id_from_hgnc_then_ensembl(transcript_info_df, transcript_info_indexed_by_gene_stable_id, hugo_symbol, hgnc_df, 'versioned_transcript_id')
-    genome_nexus_overrides_transcript, genome_nexus_overrides_transcript_explanation = get_overrides_transcript([custom], transcript_info_df, transcript_info_indexed_by_gene_stable_id, hugo_symbol, hgnc_df, ["genome nexus isoform override"])
-    uniprot_overrides_transcript, uniprot_overrides_transcript_explanation = get_overrides_transcript([uniprot], transcript_info_df, transcript_info_indexed_by_gene_stable_id, hugo_symbol, hgnc_df, ["uniprot isoform override"])
-    mskcc_overrides_transcript, mskcc_overrides_transcript_explanation = get_overrides_transcript([mskcc], transcript_info_df, transcript_info_indexed_by_gene_stable_id, hugo_symbol, hgnc_df, ["mskcc isoform override"])
-
-    ensembl_transcript_id_base, ensembl_transcript_id_version = split_enst_id(ensembl_canonical_transcript)
-    gn_transcript_id_base,  gn_transcript_id_version  = split_enst_id(genome_nexus_overrides_transcript)
-    uniprot_transcript_id_base, uniprot_transcript_id_version = split_enst_id(uniprot_overrides_transcript)
-    mskcc_transcript_id_base, mskcc_transcript_id_version = split_enst_id(mskcc_overrides_transcript)
-
-    if not ensembl_transcript_id_version:
-        ensembl_transcript_id_version = find_transcript_version(transcript_info_df, ensembl_transcript_id_base)
-    if not gn_transcript_id_version:
-        gn_transcript_id_version = find_transcript_version(transcript_info_df, gn_transcript_id_base)
-    if not uniprot_transcript_id_version:
-        uniprot_transcript_id_version = find_transcript_version(transcript_info_df, uniprot_transcript_id_base)
-    if not mskcc_transcript_id_version:
-        mskcc_transcript_id_version = find_transcript_version(transcript_info_df, mskcc_transcript_id_base)
-
-    try:
-        if 'note' in mskcc.columns:
-            m = mskcc.loc[hugo_symbol]
-            note = m['note'].iloc[0] if isinstance(m, pd.DataFrame) else m.get('note')
-            if isinstance(note, str) and note.strip():
-                mskcc_overrides_transcript_explanation = f"{mskcc_overrides_transcript_explanation}; {note.strip()}"
-    except KeyError:
-        pass
-
-    return pd.Series([
-                ensembl_canonical_gene,
-                ensembl_transcript_id_base,
-                ensembl_transcript_id_version,
-                ensembl_canonical_transcript_explanation,
-                gn_transcript_id_base,
-                gn_transcript_id_version,
-                genome_nexus_overrides_transcript_explanation,
-                uniprot_transcript_id_base,
-                uniprot_transcript_id_version,
-                uniprot_overrides_transcript_explanation,
-                mskcc_transcript_id_base,
-                mskcc_transcript_id_version,
-                mskcc_overrides_transcript_explanation
-            ],
-            index="""
-            ensembl_canonical_gene
-            ensembl_canonical_transcript
-            ensembl_canonical_transcript_version
-            ensembl_canonical_transcript_explanation
-            genome_nexus_canonical_transcript
-            genome_nexus_canonical_transcript_version
-            genome_nexus_canonical_transcript_explanation
-            uniprot_canonical_transcript
-            uniprot_canonical_transcript_version
-            uniprot_canonical_transcript_explanation
-            mskcc_canonical_transcript
-            mskcc_canonical_transcript_version
-            mskcc_canonical_transcript_explanation
-            """.split()
-        )
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            return pd.concat(pool.map(_get_transcript_ids_and_explanations_for_shard, shards))
+    finally:
+        _shared_inputs = None
+
+def blank_unresolved_symbols(one_transcript_per_hugo_symbol, unchanged_output=None):
+    """Keep output identical to building one row per symbol: missing transcript
+    ids are written as 'None', unless nothing was found for the symbol at all,
+    or for no symbol at all. unchanged_output holds the previous output rows
+    of symbols which are not recomputed"""
+    one_transcript_per_hugo_symbol.loc[one_transcript_per_hugo_symbol.isna().all(axis=1)] = np.nan
+    unresolved_columns = one_transcript_per_hugo_symbol.isna().all()
+    if unchanged_output is not None:
+        unresolved_columns &= (unchanged_output[one_transcript_per_hugo_symbol.columns] == '').all()
+    one_transcript_per_hugo_symbol.loc[:, unresolved_columns] = np.nan
+    return one_transcript_per_hugo_symbol
+
+def get_mskcc_refseq_mapping(mskcc):
+    """Map bare ENST id of mskcc isoform overrides to their RefSeq id, last
+    override wins"""
+    if 'refseq_id' not in mskcc.columns or 'isoform_override' not in mskcc.columns:
+        return {}
+    overrides = mskcc[mskcc['isoform_override'].notna() & mskcc['refseq_id'].notna()]
+    return dict(zip(overrides['isoform_override'].astype(str).str.split('.').str[0], overrides['refseq_id'].astype(str)))
+
+def digest_rows(table, key):
+    """Digest all rows per value of column key. The digest depends on the
+    row order within a key, which decides ties between transcripts"""
+    table = table[table[key].notna()]
+    row_hashes = pd.util.hash_pandas_object(table, index=False)
+    positions = table.groupby(key, sort=False).cumcount()
+    row_hashes = pd.util.hash_pandas_object(pd.DataFrame({'row': row_hashes.values, 'position': positions.values}), index=False)
+    # uint64 sum wraps around
+    return {str(k): str(digest) for k, digest in row_hashes.groupby(table[key].values).sum().items()}
+
+def get_input_fingerprints(transcript_info_df, transcript_info_indexed_by_gene_stable_id, version_index, hgnc_df, mskcc, uniprot, custom, mskcc_refseq_mapping):
+    """Fingerprint the input rows by the key they affect, so a later run can
+    tell which hugo symbols changed"""
+    return {'ensembl_by_symbol': digest_rows(transcript_info_df.reset_index(), 'hgnc_symbol'),
+            'ensembl_by_gene': digest_rows(transcript_info_indexed_by_gene_stable_id.reset_index(drop=True), 'gene_stable_id'),
+            'transcript_versions': version_index,
+            'hgnc': digest_rows(hgnc_df.reset_index(), 'approved_symbol'),
+            'uniprot': digest_rows(uniprot.reset_index(), 'gene_name'),
+            'mskcc': digest_rows(mskcc.reset_index(), 'gene_name'),
+            'custom': digest_rows(custom.reset_index(), 'gene_name'),
+            'mskcc_refseq': mskcc_refseq_mapping}
+
+def load_previous_output(ensembl_biomart_canonical_transcripts_per_hgnc, fingerprints_file_name):
+    """Read previous output and the fingerprints of its inputs, returns None
+    for both if either is missing"""
+    if not os.path.exists(ensembl_biomart_canonical_transcripts_per_hgnc) or not os.path.exists(fingerprints_file_name):
+        return None, None
+    previous_output = pd.read_csv(ensembl_biomart_canonical_transcripts_per_hgnc, sep='\t', dtype=str, keep_default_na=False).set_index('hgnc_symbol')
+    with open(fingerprints_file_name) as fingerprints_file:
+        return previous_output, json.load(fingerprints_file)
+
+def get_unpatchable_column(previous_output):
+    """A computed transcript column of previous output that is empty for
+    every symbol, None if there is none. Such a column hides the 'None' values
+    of its symbols, so recomputed rows can't be patched in"""
+    computed_columns = [column for column in previous_output.columns if '_canonical_' in column]
+    empty_columns = (previous_output[computed_columns] == '').all()
+    return empty_columns.index[empty_columns][0] if empty_columns.any() else None
+
+def find_affected_symbols(hugos, hgnc_df, previous_output, previous_fingerprints, fingerprints):
+    """Find hugo symbols whose output row can differ from previous output"""
+    def changed(name):
+        old, new = previous_fingerprints.get(name, {}), fingerprints[name]
+        return {key for key in set(old).union(new) if old.get(key) != new.get(key)}
+
+    affected = set(hugos) - set(previous_output.index)
+    for name in ['hgnc', 'ensembl_by_symbol', 'uniprot', 'mskcc', 'custom']:
+        affected |= changed(name)
+    affected |= set(hgnc_df.index[hgnc_df['ensembl_gene_id'].isin(changed('ensembl_by_gene'))])
+    # versions and refseq ids are looked up by transcript, wherever it was picked
+    transcript_columns = [column for column in previous_output.columns if column.endswith('_canonical_transcript')]
+    affected |= set(previous_output.index[previous_output[transcript_columns].isin(changed('transcript_versions')).any(axis=1)])
+    affected |= set(previous_output.index[previous_output['mskcc_canonical_transcript'].isin(changed('mskcc_refseq'))])
+    return pd.Index(hugos)[pd.Index(hugos).isin(affected)]
 
 def lowercase_set(x):
     return set({i.lower() for i in x})
@@ -190,115 +224,98 @@ def main(ensembl_biomart_geneids_transcript_info,
          isoform_overrides_at_mskcc,
          isoform_overrides_genome_nexus,
          ignored_genes_file_name,
-         ensembl_biomart_canonical_transcripts_per_hgnc):
-    # input files
-    transcript_info_df = pd.read_csv(ensembl_biomart_geneids_transcript_info, sep='\t', dtype={'is_canonical':bool, 'transcript_id_version': object})
-    if 'transcript_id_version' in transcript_info_df.columns:
-        transcript_info_df['transcript_id_version'] = transcript_info_df['transcript_id_version'].apply(normalize_version_string)
-    transcript_info_df = transcript_info_df.drop_duplicates()
-    uniprot = pd.read_csv(isoform_overrides_uniprot, sep='\t')\
-        .rename(columns={'enst_id':'isoform_override'})\
-        .set_index('gene_name'.split())
-    mskcc = pd.read_csv(isoform_overrides_at_mskcc, sep='\t')\
-        .rename(columns={'enst_id':'isoform_override'})\
-        .set_index('gene_name'.split())
-    custom = pd.read_csv(isoform_overrides_genome_nexus, sep='\t')\
-        .rename(columns={'enst_id':'isoform_override'})\
-        .set_index('gene_name'.split())
-    hgnc_df = pd.read_csv(hgnc_complete_set, sep='\t', dtype=object)
-
-    # Convert new column names to old stable column names. If this is not done properly, Genome Nexus and any other
-    # downstream applications break
-    # TODO: Update Genome Nexus to accept the latest HGNC column names so that remapping is not necessary.
-    column_name_mapping = {'name': 'approved_name',
-                           'symbol': 'approved_symbol',
-                           'prev_symbol': 'previous_symbols',
-                           'alias_symbol': 'synonyms',
-                           'location': 'chromosome',
-                           'entrez_id': 'entrez_gene_id',
-                           'ena': 'accession_numbers',
-                           'refseq_accession': 'refseq_ids',
-                           'uniprot_ids': 'uniprot_id',
-                           'ensembl_id': 'ensembl_gene_id'}
-    hgnc_df.rename(columns=column_name_mapping, inplace=True)
-    hgnc_df = hgnc_df[hgnc_df['approved_name'] != 'entry withdrawn'].copy()
-    hugos = hgnc_df['approved_symbol'].unique()
-    hgnc_df = hgnc_df.set_index('approved_symbol')
-    # assume each row has approved symbol
-    assert(len(hugos) == len(hgnc_df))
-
-    # only test the cancer genes for oddities (these are very important)
-    oncokb_file = 'common_input/oncokb_cancer_genes_list.txt'
-    oncokb_df = pd.read_csv(oncokb_file, sep='\t')
-    cgs = set(oncokb_df['Hugo Symbol'])
-    # each cancer gene stable id should have only one associated cancer gene symbol
-    assert(transcript_info_df[transcript_info_df.hgnc_symbol.isin(cgs)].groupby('gene_stable_id').hgnc_symbol.nunique().sort_values().nunique() == 1)
-    # each transcript stable id always belongs to only one gene stable id
-    assert(transcript_info_df.groupby('transcript_stable_id').gene_stable_id.nunique().sort_values().nunique() == 1)
-
-    # create hgnc_symbol to gene id mapping
-    # ignore hugo symbols from ensembl data dump (includes prev symbols and synonyms)
-    syns = hgnc_df.synonyms.str.strip('"').str.split("|").dropna()
-    syns = set(itertools.chain.from_iterable(syns))
-    previous_symbols = hgnc_df.previous_symbols.str.strip('"').str.split("|").dropna()
-    previous_symbols = set(itertools.chain.from_iterable(previous_symbols))
-
-    # there is overlap between symbols, synonyms and previous symbols
-    # therefore use logic in above order when querying
-    # assert(len(syns.intersection(previous_symbols)) == 0) #329
-    # assert(len(set(hugos).intersection(syns)) == 0) # 495
-    # assert(len(set(hugos).intersection(previous_symbols)) == 0) #227
-
-    # Build reverse lookup: old/alias symbol -> current HGNC approved symbol
-    prev_to_approved = {}
-    for approved_sym, prev_list in hgnc_df.previous_symbols.str.strip('"').str.split("|").dropna().items():
-        for ps in prev_list:
-            ps = ps.strip()
-            if ps:
-                prev_to_approved[ps.lower()] = approved_sym
-    alias_to_approved = {}
-    for approved_sym, alias_list in hgnc_df.synonyms.str.strip('"').str.split("|").dropna().items():
-        for s in alias_list:
-            s = s.strip()
-            if s:
-                alias_to_approved[s.lower()] = approved_sym
-
-    # all cancer genes and hugo symbols in ensembl data dump should be
-    # contained in hgnc approved symbols and synonyms
-    # c12orf9 is only in sanger's cancer gene census and has been withdrawn
-    missing_cgs = lowercase_set(set(cgs)) - {'c12orf9'} - lowercase_set(set(hugos).union(syns).union(previous_symbols))
-    if missing_cgs:
-        print('------ Outdated OncoKB cancer gene symbols (updating to latest HGNC) ------')
-        symbol_updates = {}
-        for old_sym_lower in sorted(missing_cgs):
-            old_sym = next(s for s in cgs if s.lower() == old_sym_lower)
-            new_sym = prev_to_approved.get(old_sym_lower) or alias_to_approved.get(old_sym_lower)
-            if new_sym:
-                print(f'  {old_sym} -> {new_sym}')
-                symbol_updates[old_sym] = new_sym
-            else:
-                print(f'  {old_sym} -> NOT FOUND in HGNC (manual review needed)')
-        if symbol_updates:
-            oncokb_df['Hugo Symbol'] = oncokb_df['Hugo Symbol'].replace(symbol_updates)
-            oncokb_df.to_csv(oncokb_file, sep='\t', index=False)
-            print(f'Updated {oncokb_file} with {len(symbol_updates)} symbol change(s)')
-            cgs = set(oncokb_df['Hugo Symbol'])
-        print('------ End of outdated symbols ------')
-    assert(len(lowercase_set(set(cgs)) - set(['c12orf9']) - lowercase_set(set(hugos).union(syns).union(previous_symbols))) == 0)
-    no_symbols_in_hgnc = lowercase_set(transcript_info_df.hgnc_symbol.dropna().unique()) - lowercase_set(set(hugos).union(syns).union(previous_symbols))
-    new_genes = ignore_certain_genes(ignore_rna_gene(no_symbols_in_hgnc),ignored_genes_file_name)
-    if len(new_genes) != 0:
-        print('------ New genes need to be added into ignored_genes.txt ------\n' +
-        '------ Start of new genes list ------\n' +
-        '\n'.join(new_genes) + '\n'
-        '------ End of new genes list ------\n')
-    assert(len(new_genes) == 0)
-
-    transcript_info_df = transcript_info_df.set_index('hgnc_symbol').sort_index()
-    transcript_info_indexed_by_gene_stable_id = transcript_info_df
-    # duplicate a temp column to use as index
-    transcript_info_indexed_by_gene_stable_id["gene_stable_id_temp"] = transcript_info_df['gene_stable_id']
-    transcript_info_indexed_by_gene_stable_id = transcript_info_indexed_by_gene_stable_id.set_index('gene_stable_id_temp').sort_index()
+         ensembl_biomart_canonical_transcripts_per_hgnc,
+         workers=1,
+         incremental=False):
+    with phase('load') as profiled:
+        # input files
+        transcript_info_df = read_table(ensembl_biomart_geneids_transcript_info, CANONICAL_DATA_SCHEMA)
+        if 'transcript_id_version' in transcript_info_df.columns:
+            transcript_info_df['transcript_id_version'] = transcript_info_df['transcript_id_version'].apply(normalize_version_string)
+        transcript_info_df = transcript_info_df.drop_duplicates()
+        uniprot = pd.read_csv(isoform_overrides_uniprot, sep='\t')\
+            .rename(columns={'enst_id':'isoform_override'})\
+            .set_index('gene_name'.split())
+        mskcc = pd.read_csv(isoform_overrides_at_mskcc, sep='\t')\
+            .rename(columns={'enst_id':'isoform_override'})\
+            .set_index('gene_name'.split())
+        custom = pd.read_csv(isoform_overrides_genome_nexus, sep='\t')\
+            .rename(columns={'enst_id':'isoform_override'})\
+            .set_index('gene_name'.split())
+        hgnc_df = pd.read_csv(hgnc_complete_set, sep='\t', dtype=object)
+        profiled.rows = len(transcript_info_df) + len(hgnc_df)
+
+    with phase('normalize') as profiled:
+        # Convert new column names to old stable column names. If this is not done properly, Genome Nexus and any other
+        # downstream applications break
+        # TODO: Update Genome Nexus to accept the latest HGNC column names so that remapping is not necessary.
+        column_name_mapping = {'name': 'approved_name',
+                               'symbol': 'approved_symbol',
+                               'prev_symbol': 'previous_symbols',
+                               'alias_symbol': 'synonyms',
+                               'location': 'chromosome',
+                               'entrez_id': 'entrez_gene_id',
+                               'ena': 'accession_numbers',
+                               'refseq_accession': 'refseq_ids',
+                               'uniprot_ids': 'uniprot_id',
+                               'ensembl_id': 'ensembl_gene_id'}
+        hgnc_df.rename(columns=column_name_mapping, inplace=True)
+        hgnc_df = hgnc_df[hgnc_df['approved_name'] != 'entry withdrawn'].copy()
+        hugos = hgnc_df['approved_symbol'].unique()
+        hgnc_df = hgnc_df.set_index('approved_symbol')
+        # assume each row has approved symbol
+        assert(len(hugos) == len(hgnc_df))
+
+        # only test the cancer genes for oddities (these are very important)
+        oncokb_file = 'common_input/oncokb_cancer_genes_list.txt'
+        oncokb_df = pd.read_csv(oncokb_file, sep='\t')
+        cgs = set(oncokb_df['Hugo Symbol'])
+        # each cancer gene stable id should have only one associated cancer gene symbol
+        assert(transcript_info_df[transcript_info_df.hgnc_symbol.isin(cgs)].groupby('gene_stable_id').hgnc_symbol.nunique().sort_values().nunique() == 1)
+        # each transcript stable id always belongs to only one gene stable id
+        assert(transcript_info_df.groupby('transcript_stable_id').gene_stable_id.nunique().sort_values().nunique() == 1)
+
+        # ignore hugo symbols from ensembl data dump (includes prev symbols and synonyms)
+        # there is overlap between symbols, synonyms and previous symbols,
+        # the resolver queries them in that order
+        symbol_resolver = load_hgnc_symbol_resolver(hgnc_complete_set)
+
+        def unknown_symbols(symbols):
+            return lowercase_set({symbol for symbol in symbols if not symbol_resolver.is_known(symbol)})
+
+        # all cancer genes and hugo symbols in ensembl data dump should be
+        # contained in hgnc approved symbols and synonyms
+        # c12orf9 is only in sanger's cancer gene census and has been withdrawn
+        missing_cgs = unknown_symbols(cgs) - {'c12orf9'}
+        if missing_cgs:
+            print('------ Outdated OncoKB cancer gene symbols (updating to latest HGNC) ------')
+            symbol_updates = {}
+            for old_sym_lower in sorted(missing_cgs):
+                old_sym = next(s for s in cgs if s.lower() == old_sym_lower)
+                new_sym = symbol_resolver.resolve(old_sym)
+                if new_sym:
+                    print(f'  {old_sym} -> {new_sym}')
+                    symbol_updates[old_sym] = new_sym
+                else:
+                    print(f'  {old_sym} -> NOT FOUND in HGNC (manual review needed)')
+            if symbol_updates:
+                oncokb_df['Hugo Symbol'] = oncokb_df['Hugo Symbol'].replace(symbol_updates)
+                oncokb_df.to_csv(oncokb_file, sep='\t', index=False)
+                print(f'Updated {oncokb_file} with {len(symbol_updates)} symbol change(s)')
+                cgs = set(oncokb_df['Hugo Symbol'])
+            print('------ End of outdated symbols ------')
+        assert(len(unknown_symbols(cgs) - set(['c12orf9'])) == 0)
+        no_symbols_in_hgnc = unknown_symbols(transcript_info_df.hgnc_symbol.dropna().unique())
+        new_genes = ignore_certain_genes(ignore_rna_gene(no_symbols_in_hgnc),ignored_genes_file_name)
+        if len(new_genes) != 0:
+            print('------ New genes need to be added into ignored_genes.txt ------\n' +
+            '------ Start of new genes list ------\n' +
+            '\n'.join(new_genes) + '\n'
+            '------ End of new genes list ------\n')
+        assert(len(new_genes) == 0)
+
+        transcript_info_df, transcript_info_indexed_by_gene_stable_id = index_by_symbol_and_gene(transcript_info_df)
+        profiled.rows = len(transcript_info_df)
 
     # for testing use
     # NSD3 replaces WHSC1L1
@@ -306,45 +323,75 @@ def main(ensembl_biomart_geneids_transcript_info,
     # there are multiple in ensembl data dump
     # hugos = ['KRT18P53', 'NSD3', 'AATF']
 
-    # TODO Optimize this part, as this part takes most time
-    one_transcript_per_hugo_symbol = pd.Series(hugos).apply(lambda x: get_transcript_id_and_explanation(transcript_info_df, transcript_info_indexed_by_gene_stable_id, x, hgnc_df, mskcc, uniprot, custom ))
-    one_transcript_per_hugo_symbol.index = hugos
-    one_transcript_per_hugo_symbol.index.name = 'hgnc_symbol'
-
-    # merge in other hgnc fields
-    merged = pd.merge(one_transcript_per_hugo_symbol.reset_index(), hgnc_df.reset_index(), left_on='hgnc_symbol', right_on='approved_symbol')
-    del merged['approved_symbol']
-    del merged['ensembl_gene_id']
-
-    if "grch37" in isoform_overrides_at_mskcc:
-        if 'refseq_id' in mskcc.columns and 'isoform_override' in mskcc.columns:
-            # Create a mapping from base ENST ID -> RefSeq ID
-            mapping = {}
-            for _, row in mskcc.iterrows():
-                if pd.notna(row['isoform_override']) and pd.notna(row['refseq_id']):
-                    bare_enst = str(row['isoform_override']).split('.')[0]
-                    refseq = str(row['refseq_id'])
-                    mapping[bare_enst] = refseq
-            
+    with phase('select') as profiled:
+        version_index = build_transcript_version_index(transcript_info_df)
+        if "grch37" in isoform_overrides_at_mskcc:
+            mskcc_refseq_mapping = get_mskcc_refseq_mapping(mskcc)
+        else:
+            # TODO: it will be added once have a isoform_overrides_at_mskcc_grch38.txt
+            mskcc_refseq_mapping = None
+
+        # in incremental mode only recompute symbols affected by changed input rows
+        recomputed_hugos = pd.Index(hugos)
+        unchanged_output = None
+        if incremental:
+            fingerprints_file_name = ensembl_biomart_canonical_transcripts_per_hgnc + '.fingerprints.json'
+            fingerprints = get_input_fingerprints(transcript_info_df, transcript_info_indexed_by_gene_stable_id, version_index,
+                                                  hgnc_df, mskcc, uniprot, custom, mskcc_refseq_mapping or {})
+            previous_output, previous_fingerprints = load_previous_output(ensembl_biomart_canonical_transcripts_per_hgnc, fingerprints_file_name)
+            unpatchable_column = get_unpatchable_column(previous_output) if previous_output is not None else None
+            if unpatchable_column is not None:
+                print('Incremental mode disabled: column {} is empty for every symbol, recomputing all'.format(unpatchable_column))
+            elif previous_output is not None:
+                recomputed_hugos = find_affected_symbols(hugos, hgnc_df, previous_output, previous_fingerprints, fingerprints)
+                unchanged_output = previous_output.reindex(pd.Index(hugos).difference(recomputed_hugos, sort=False))
+                print('Recomputing {} of {} hugo symbols'.format(len(recomputed_hugos), len(hugos)))
+
+        canonical_inputs = dict(canonical_by_symbol=pick_canonical_longest_transcripts(transcript_info_df),
+                                canonical_by_gene_stable_id=pick_canonical_longest_transcripts(transcript_info_indexed_by_gene_stable_id),
+                                version_index=version_index,
+                                hgnc_df=hgnc_df,
+                                isoform_overrides=compile_isoform_overrides(custom, uniprot, mskcc))
+        if workers > 1:
+            one_transcript_per_hugo_symbol = get_transcript_ids_and_explanations_in_shards(workers, recomputed_hugos, **canonical_inputs)
+        else:
+            one_transcript_per_hugo_symbol = get_transcript_ids_and_explanations(recomputed_hugos, **canonical_inputs)
+        one_transcript_per_hugo_symbol = blank_unresolved_symbols(one_transcript_per_hugo_symbol, unchanged_output)
+        one_transcript_per_hugo_symbol.index.name = 'hgnc_symbol'
+        profiled.rows = len(one_transcript_per_hugo_symbol)
+
+    with phase('join') as profiled:
+        # merge in other hgnc fields
+        merged = pd.merge(one_transcript_per_hugo_symbol.reset_index(), hgnc_df.reset_index(), left_on='hgnc_symbol', right_on='approved_symbol')
+        del merged['approved_symbol']
+        del merged['ensembl_gene_id']
+
+        if mskcc_refseq_mapping is not None:
             # Apply mapping based on the chosen canonical transcript for MSKCC isoform
-            refseq_updates = merged['mskcc_canonical_transcript'].map(mapping)
+            refseq_updates = merged['mskcc_canonical_transcript'].map(mskcc_refseq_mapping)
             merged['refseq_ids'] = refseq_updates.combine_first(merged['refseq_ids'])
-            
-    elif "grch38" in isoform_overrides_at_mskcc:
-        # TODO: it will be added once have a isoform_overrides_at_mskcc_grch38.txt
-        pass
 
-    # Convert entrez_gene_id to nullable integer to avoid float representation
-    if 'entrez_gene_id' in merged.columns:
-        merged['entrez_gene_id'] = merged['entrez_gene_id'].astype('Int64')
+        # Convert entrez_gene_id to nullable integer to avoid float representation
+        if 'entrez_gene_id' in merged.columns:
+            merged['entrez_gene_id'] = merged['entrez_gene_id'].astype('Int64')
+
+        # Replace '|' to ', ' to be in the correct format
+        merged = merged.astype(str).replace({'\\|': ', '}, regex=True)
 
-    # Replace '|' to ', ' to be in the correct format
-    merged = merged.astype(str).replace({'\\|': ', '}, regex=True)
+        # Replace 'nan' and '<NA>' strings (from NaN/NA values) with empty string
+        merged = merged.replace({'nan': '', '<NA>': ''})
 
-    # Replace 'nan' and '<NA>' strings (from NaN/NA values) with empty string
-    merged = merged.replace({'nan': '', '<NA>': ''})
+        if unchanged_output is not None:
+            # patch recomputed symbols into the previous output, in hgnc order
+            merged = pd.concat([merged.set_index('hgnc_symbol'), unchanged_output[merged.columns[1:]]]).reindex(pd.Index(hugos, name='hgnc_symbol')).reset_index()
+        profiled.rows = len(merged)
 
-    merged.to_csv(ensembl_biomart_canonical_transcripts_per_hgnc, sep='\t', index=False)
+    with phase('write') as profiled:
+        merged.to_csv(ensembl_biomart_canonical_transcripts_per_hgnc, sep='\t', index=False)
+        if incremental:
+            with open(fingerprints_file_name, 'w') as fingerprints_file:
+                json.dump(fingerprints, fingerprints_file)
+        profiled.rows = len(merged)
 
 
 if __name__ == "__main__":
@@ -363,7 +410,17 @@ if __name__ == "__main__":
                         help="common_input/ignored_genes.txt")
     parser.add_argument("ensembl_biomart_canonical_transcripts_per_hgnc",
                         help="tmp/ensembl_biomart_canonical_transcripts_per_hgnc.txt")
+    parser.add_argument("-w", "--workers",
+                        help="Number of processes to split the hugo symbols over",
+                        default=1,
+                        type=int)
+    parser.add_argument("-i", "--incremental",
+                        help="Only recompute hugo symbols affected by input changes since the previous output, "
+                             "using the fingerprints stored next to it",
+                        action="store_true")
+    pipeline_profile.add_profile_argument(parser)
     args = parser.parse_args()
+    pipeline_profile.configure(args.ensembl_biomart_canonical_transcripts_per_hgnc, args.profile)
 
     main(args.ensembl_biomart_geneids_transcript_info,
          args.hgnc_complete_set,
@@ -371,4 +428,6 @@ if __name__ == "__main__":
          args.isoform_overrides_at_mskcc,
          args.isoform_overrides_genome_nexus,
          args.ignored_genes_file_name,
-         args.ensembl_biomart_canonical_transcripts_per_hgnc)
+         args.ensembl_biomart_canonical_transcripts_per_hgnc,
+         workers=args.workers,
+         incremental=args.incremental)
@@ -0,0 +1,199 @@
+"""Per-phase timing and peak memory instrumentation for the pipeline scripts.
+
+Scripts wrap their named phases (load, normalize, join, nest, write) in
+`with phase('load') as p: ...` and may set `p.rows`. This is a no-op unless
+profiling is enabled with --profile or GENOME_NEXUS_IMPORTER_PROFILE=1. When
+enabled, wall time, CPU time (including worker processes), peak RSS and row
+counts per phase are written as JSON to <output>.profile.json, or to
+<script>.profile.json in the working directory for scripts writing to stdout.
+
+Use --profile cprofile (or pyinstrument, if installed) to also dump a
+profile per phase next to the report, e.g. <output>.profile.load.prof."""
+
+import atexit
+import contextlib
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+PROFILE_ENV = 'GENOME_NEXUS_IMPORTER_PROFILE'
+PROFILE_MODES = ['phases', 'cprofile', 'pyinstrument']
+
+
+def add_profile_argument(parser):
+    parser.add_argument("--profile",
+                        help="Write per-phase wall/CPU time, peak RSS and row counts to <output>.profile.json. "
+                             "Optionally dump a cProfile or pyinstrument profile per phase. "
+                             "Default from ${}".format(PROFILE_ENV),
+                        nargs='?',
+                        const='phases',
+                        choices=PROFILE_MODES,
+                        default=profile_mode_from_environment())
+
+
+def profile_mode_from_environment():
+    mode = os.environ.get(PROFILE_ENV, '').strip().lower()
+    if mode in ('', '0', 'false', 'no'):
+        return None
+    return mode if mode in PROFILE_MODES else 'phases'
+
+
+def _cpu_seconds():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS of this process, only possible on Linux"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _max_rss_bytes(who):
+    peak = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _peak_rss_bytes():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return _max_rss_bytes(resource.RUSAGE_SELF)
+
+
+class Phase:
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.peak_rss = 0
+
+
+class PhaseProfiler:
+    def __init__(self, report_file_name, mode='phases'):
+        self.report_file_name = report_file_name
+        self.mode = mode
+        if mode == 'pyinstrument':
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                print('pyinstrument is not installed, using cProfile instead', file=sys.stderr)
+                self.mode = 'cprofile'
+        self.phases = []
+        self._open_phases = []
+        self._peak_rss = 0
+        self._start_wall = time.perf_counter()
+        self._start_cpu = _cpu_seconds()
+
+    def _fold_peak_into_open_phases(self):
+        peak_rss = _peak_rss_bytes()
+        self._peak_rss = max(self._peak_rss, peak_rss)
+        for open_phase in self._open_phases:
+            open_phase.peak_rss = max(open_phase.peak_rss, peak_rss)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        current = Phase(name)
+        # the peak of the enclosing phases must be saved before it is reset
+        self._fold_peak_into_open_phases()
+        _reset_peak_rss()
+        self._open_phases.append(current)
+        dump_profiler = self._start_dump_profiler()
+        start_wall, start_cpu = time.perf_counter(), _cpu_seconds()
+        try:
+            yield current
+        finally:
+            wall, cpu = time.perf_counter() - start_wall, _cpu_seconds() - start_cpu
+            self._stop_dump_profiler(dump_profiler, name)
+            self._fold_peak_into_open_phases()
+            self._open_phases.pop()
+            self.phases.append({'name': name,
+                                'depth': len(self._open_phases),
+                                'wall_seconds': round(wall, 3),
+                                'cpu_seconds': round(cpu, 3),
+                                'peak_rss_mb': round(current.peak_rss / 2 ** 20, 1),
+                                'rows': current.rows})
+
+    def _start_dump_profiler(self):
+        if self.mode == 'cprofile':
+            import cProfile
+            dump_profiler = cProfile.Profile()
+            dump_profiler.enable()
+            return dump_profiler
+        if self.mode == 'pyinstrument':
+            import pyinstrument
+            dump_profiler = pyinstrument.Profiler()
+            dump_profiler.start()
+            return dump_profiler
+        return None
+
+    def _stop_dump_profiler(self, dump_profiler, name):
+        if dump_profiler is None:
+            return
+        dump_file_name = '{}.{}'.format(os.path.splitext(self.report_file_name)[0], name.replace(' ', '_'))
+        if self.mode == 'cprofile':
+            dump_profiler.disable()
+            dump_profiler.dump_stats(dump_file_name + '.prof')
+        else:
+            dump_profiler.stop()
+            with open(dump_file_name + '.txt', 'w') as dump_file:
+                dump_file.write(dump_profiler.output_text())
+
+    def report(self):
+        self._fold_peak_into_open_phases()
+        return {'script': os.path.basename(sys.argv[0]),
+                'argv': sys.argv[1:],
+                'python': platform.python_version(),
+                'phases': self.phases,
+                'total': {'wall_seconds': round(time.perf_counter() - self._start_wall, 3),
+                          'cpu_seconds': round(_cpu_seconds() - self._start_cpu, 3),
+                          'peak_rss_mb': round(self._peak_rss / 2 ** 20, 1),
+                          'children_peak_rss_mb': round(_max_rss_bytes(resource.RUSAGE_CHILDREN) / 2 ** 20, 1)}}
+
+    def write_report(self):
+        with open(self.report_file_name, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+
+_profiler = None
+
+
+def configure(output_file_name, mode):
+    """Enable profiling of this run if mode is set (see add_profile_argument).
+    The report is written to <output_file_name>.profile.json on exit. Pass
+    None as output_file_name for scripts writing to stdout"""
+    global _profiler
+    if not mode:
+        return
+    if output_file_name is None:
+        output_file_name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    _profiler = PhaseProfiler(output_file_name + '.profile.json', mode)
+    atexit.register(_profiler.write_report)
+
+
+def stop():
+    """Stop profiling in this process without writing a report, e.g. in forked
+    workers whose work is part of a phase of the parent"""
+    global _profiler
+    _profiler = None
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Time a named phase of the running script, if profiling is enabled"""
+    if _profiler is None:
+        yield Phase(name)
+    else:
+        with _profiler.phase(name) as current:
+            yield current
@@ -0,0 +1,72 @@
+"""Index of protein sequences for finding those one substitution away from a
+query sequence.
+
+Sequences of the same length are at Levenshtein distance 1 when they differ
+in exactly one residue, that is, when they are equal with that residue
+masked out. The index stores a hash of every sequence with each of its
+positions masked in turn, in a sorted array. A query hashes its own masked
+variants and looks them up with a binary search, so it takes time in the
+length of the query instead of comparing it with every sequence of that
+length. Hash collisions are ruled out by comparing the candidates themselves.
+
+The hashes are polynomial in the residue codes, modulo 2**64. A masked
+variant of a sequence is its hash minus the term of the masked residue, so
+all variants take one vectorized pass per sequence."""
+
+import numpy as np
+
+HASH_BASE = np.uint64(1099511628211)
+
+
+def get_codes(sequence):
+    return np.frombuffer(sequence.encode('ascii'), dtype=np.uint8).astype(np.uint64)
+
+
+class OneSubstitutionIndex:
+    """Finds the sequences that differ from a query in exactly one position.
+    Sequences are kept in the order they are given, including duplicates.
+    With lengths given, only sequences of these lengths are indexed"""
+
+    def __init__(self, sequences, lengths=None):
+        self.sequences = [sequence for sequence in sequences if lengths is None or len(sequence) in lengths]
+        max_length = max((len(sequence) for sequence in self.sequences), default=0)
+        # HASH_BASE ** k, with numpy's wrap around on overflow
+        self.powers = np.ones(max_length, dtype=np.uint64)
+        self.powers[1:] = np.cumprod(np.full(max(max_length - 1, 0), HASH_BASE, dtype=np.uint64))
+        indices_by_length = {}
+        for index, sequence in enumerate(self.sequences):
+            indices_by_length.setdefault(len(sequence), []).append(index)
+        # sorted masked hashes and the index of their sequence, by length. A
+        # query only searches the few sequences of its own length
+        self.buckets = {}
+        for length, indices in indices_by_length.items():
+            keys = np.concatenate([self.get_masked_hashes(self.sequences[index]) for index in indices])
+            order = np.argsort(keys)
+            self.buckets[length] = keys[order], np.repeat(np.array(indices, dtype=np.int32), length)[order]
+
+    def get_masked_hashes(self, sequence):
+        """The hash of sequence with each of its positions masked in turn"""
+        terms = get_codes(sequence) * self.powers[len(sequence) - 1::-1]
+        return terms.sum(dtype=np.uint64) - terms
+
+    def find(self, sequence):
+        """The indexed sequences one substitution away from sequence, in index
+        order"""
+        if len(sequence) not in self.buckets:
+            return []
+        keys, entries = self.buckets[len(sequence)]
+        masked_hashes = self.get_masked_hashes(sequence)
+        # sorted needles make the binary search much faster
+        positions = np.argsort(masked_hashes)
+        masked_hashes = masked_hashes[positions]
+        starts = np.searchsorted(keys, masked_hashes)
+        hits = starts < len(keys)
+        hits[hits] = keys[starts[hits]] == masked_hashes[hits]
+        found = set()
+        for position, start, masked_hash in zip(positions[hits], starts[hits], masked_hashes[hits]):
+            prefix, residue, suffix = sequence[:position], sequence[position], sequence[position + 1:]
+            for entry in entries[start:np.searchsorted(keys, masked_hash, side='right')]:
+                candidate = self.sequences[entry]
+                if candidate[position] != residue and candidate.startswith(prefix) and candidate.endswith(suffix):
+                    found.add(int(entry))
+        return [self.sequences[entry] for entry in sorted(found)]
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Run a pipeline step, or restore its outputs from a content addressed cache.
+
+Make only compares modification times, so on a fresh checkout or container
+build every step runs again, even when no input changed. Wrapping a recipe
+
+    python ../scripts/step_cache.py -o $@ -- python ../scripts/<script>.py $^ $@
+
+keys the step on the command line, which holds the parameters (VERSION,
+QSIZE, GENOME_BUILD, ...) in its arguments and file names, on the content of
+every argument that is an existing file or directory, and on the content of
+the pipeline scripts. Files the step reads without getting them as an
+argument are declared with -i, and files it rewrites with -o, so a restored
+step also restores the rewrite. Options in UNKEYED_OPTIONS, such as
+--workers and --concurrency, do not change the outputs and are left out of the key. If a step with the same key ran before, its outputs are
+copied from the cache instead of running the command, and this is reported in
+the build log. Otherwise the command runs and its outputs are stored.
+
+The cache is in ~/.cache/genome-nexus-importer/steps, or
+$GENOME_NEXUS_IMPORTER_CACHE_DIR/steps. Pass an empty --cache-dir to always
+run the command."""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from hgnc_symbols import DEFAULT_CACHE_DIR
+
+# bump when the key or the layout of the cache changes
+CACHE_VERSION = 1
+DEFAULT_STEP_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'steps')
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_SUFFIXES = ('.py', '.R', '.sh')
+HASH_BLOCK_SIZE = 1 << 20
+# options with a value that change how a step runs, but not its outputs
+UNKEYED_OPTIONS = ('--workers', '-c', '--concurrency')
+
+
+def update_with_path(digest, path):
+    """Add the content of a file, or of all files in a directory with their
+    relative names, to digest"""
+    if os.path.isdir(path):
+        for root, dir_names, file_names in os.walk(path):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                file_path = os.path.join(root, file_name)
+                digest.update(os.path.relpath(file_path, path).encode() + b'\0')
+                update_with_path(digest, file_path)
+        return
+    with open(path, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    digest.update(b'\0')
+
+
+def get_keyed_command(command):
+    """command without the options in UNKEYED_OPTIONS and their values"""
+    keyed_command = []
+    arguments = iter(command)
+    for argument in arguments:
+        if argument in UNKEYED_OPTIONS:
+            next(arguments, None)
+        elif not argument.startswith(tuple(option + '=' for option in UNKEYED_OPTIONS)):
+            keyed_command.append(argument)
+    return keyed_command
+
+
+def get_step_key(command, outputs, scripts_dir=SCRIPTS_DIR, inputs=()):
+    """The hash of the command, the content of its input arguments, of the
+    declared inputs and of the pipeline scripts. A change to any script
+    invalidates all steps, as scripts share helper modules"""
+    command = get_keyed_command(command)
+    digest = hashlib.sha256(json.dumps({'version': CACHE_VERSION, 'command': command, 'outputs': outputs,
+                                        'inputs': list(inputs)}).encode())
+    for argument in command:
+        if argument not in outputs and os.path.exists(argument):
+            update_with_path(digest, argument)
+    for input_path in inputs:
+        update_with_path(digest, input_path)
+    for file_name in sorted(os.listdir(scripts_dir)):
+        if file_name.endswith(SCRIPT_SUFFIXES):
+            digest.update(file_name.encode() + b'\0')
+            update_with_path(digest, os.path.join(scripts_dir, file_name))
+    return digest.hexdigest()
+
+
+def get_entry_dir(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def copy_file(source, destination):
+    """Copy through a temporary file, so a crash never leaves a partial file"""
+    temporary_file_name = destination + '~'
+    shutil.copyfile(source, temporary_file_name)
+    os.replace(temporary_file_name, destination)
+
+
+def restore_outputs(entry_dir, outputs):
+    if not os.path.isdir(entry_dir):
+        return False
+    for index, output in enumerate(outputs):
+        copy_file(os.path.join(entry_dir, str(index)), output)
+    return True
+
+
+def store_outputs(entry_dir, outputs):
+    # fill a temporary entry and rename it, so an entry is always complete
+    os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+    temporary_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir))
+    try:
+        for index, output in enumerate(outputs):
+            shutil.copyfile(output, os.path.join(temporary_dir, str(index)))
+        os.rename(temporary_dir, entry_dir)
+    except OSError:
+        # another build stored the same step meanwhile
+        shutil.rmtree(temporary_dir, ignore_errors=True)
+
+
+def run_step(command, outputs, cache_dir=DEFAULT_STEP_CACHE_DIR, inputs=()):
+    """Restore the outputs of command from the cache, or run it and store
+    them. Returns True if the outputs were restored"""
+    if not cache_dir:
+        subprocess.run(command, check=True)
+        return False
+    key = get_step_key(command, outputs, inputs=inputs)
+    entry_dir = get_entry_dir(cache_dir, key)
+    if restore_outputs(entry_dir, outputs):
+        print('step cache: restored {} ({})'.format(' '.join(outputs), key[:12]), file=sys.stderr)
+        return True
+    subprocess.run(command, check=True)
+    try:
+        store_outputs(entry_dir, outputs)
+    except OSError as error:
+        print('step cache: could not store {}: {}'.format(' '.join(outputs), error), file=sys.stderr)
+    return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output",
+                        help="output file of the step, can be repeated",
+                        action='append',
+                        required=True)
+    parser.add_argument("-i", "--input",
+                        help="file the step reads that is not in its command, can be repeated",
+                        action='append',
+                        default=[])
+    parser.add_argument("--cache-dir",
+                        help="where step outputs are stored, empty to disable the cache",
+                        default=DEFAULT_STEP_CACHE_DIR)
+    parser.add_argument("command",
+                        help="the command of the step, after --",
+                        nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        parser.error('no command given')
+
+    try:
+        run_step(command, args.output, args.cache_dir, args.input)
+    except subprocess.CalledProcessError as error:
+        sys.exit(error.returncode)
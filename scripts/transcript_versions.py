@@ -0,0 +1,55 @@
+"""Shared helpers for Ensembl transcript versions. The version index maps a
+bare ENST id to its latest version, so scripts can look versions up in O(1)
+instead of scanning the transcript table per id."""
+
+import pandas as pd
+
+
+def normalize_version_string(x):
+    if pd.isna(x):
+        return None
+    s = str(x).strip()
+    if not s or s.lower() in {"nan", "none"}:
+        return None
+    if s.endswith(".0"):
+        s = s[:-2]
+    return s if s.isdigit() else None
+
+def split_enst_id(enst):
+    # split enst id, e.g. ENST00000123456.7 -> 'ENST00000123456','7'
+    if enst is None or pd.isna(enst):
+        return None, None
+    s = str(enst).strip()
+    if "." in s:
+        b, v = s.split(".", 1)
+        return b, normalize_version_string(v)
+    return s, None
+
+def build_transcript_version_index(transcripts):
+    """Map bare ENST id -> highest version (as string) from a transcript
+    table with transcript_stable_id and versioned_transcript_id columns.
+    Prefer transcript_id_version, else parse it from versioned_transcript_id"""
+    base_ensts = transcripts['transcript_stable_id']
+    if 'transcript_id_version' in transcripts:
+        versions = transcripts['transcript_id_version'].map(normalize_version_string)
+    else:
+        versions = pd.Series(None, index=transcripts.index, dtype=object)
+    parsed_versions = transcripts['versioned_transcript_id'].astype(str).str.extract(r'\.(\d+)$')[0]
+
+    def latest(versions):
+        versions = pd.DataFrame({'base_enst': base_ensts.values, 'version': versions.values}).dropna()
+        versions['number'] = versions['version'].astype(int)
+        versions = versions.sort_values('number', kind='stable').drop_duplicates('base_enst', keep='last')
+        return dict(zip(versions['base_enst'], versions['version']))
+
+    # only transcripts without any transcript_id_version fall back to the versioned id
+    version_index = latest(parsed_versions)
+    version_index.update(latest(versions))
+    return version_index
+
+def load_transcript_version_index(file_name):
+    """Build the version index from a BioMart (ensembl_biomart_geneids.txt)
+    or ensembl_canonical_data.txt style table"""
+    transcripts = pd.read_csv(file_name, sep='\t', dtype=str)
+    transcripts.columns = [c.lower().replace(' ', '_') for c in transcripts.columns]
+    return build_transcript_version_index(transcripts)
@@ -5,58 +5,54 @@ This code is licensed under the GNU Affero General Public License (AGPL),
 version 3, or (at your option) any later version.
 """
 
-import pandas as pd
-import gzip
 import argparse
+import pipeline_profile
+from pipeline_profile import phase
+from gff3_reader import open_gff3, iter_features, compile_attribute_pattern
 
+COLUMNS = ['transcript_id', 'type', 'id', 'start', 'end', 'rank', 'strand', 'version']
+FEATURE_TYPES = {'exon', 'five_prime_UTR', 'three_prime_UTR'}
+# Convert plus strand into 1 and minus strand into -1
+STRANDS = {'+': '1', '-': '-1'}
+WRITE_BATCH_SIZE = 10000
+EXON_ATTRIBUTES = compile_attribute_pattern('Parent', 'exon_id', 'rank', 'version')
+UTR_ATTRIBUTES = compile_attribute_pattern('Parent')
 
-def main(gff_file, ensembl_transcript_info):
-    """Transform GFF3 file to TSV for exons and UTRs. Output is written to
-    stdout, as the Makefile wrapper expects. Input file is GFF3 file, see Makefile"""
-
-    # Dataframe to append the transcript information
-    transcript_info = pd.DataFrame(columns=['transcript_id', 'type', 'id', 'start', 'end', 'rank', 'strand', 'version'])
-    # list to append transcript information per row
-    rows = []
 
-    # Open gff file and read lines, when line contains transcript information, extract this information
-    with gzip.open(gff_file, 'rt') as gff:
-        for line in gff:
-            if line[0] != '#':
-                list_line = line.strip('\n').split('\t')
-                entry_dict = {}
+def get_transcript_info_row(columns):
+    """The output fields of an exon or UTR feature. Exons have an id, rank and
+    version, UTRs leave them empty"""
+    if columns[2] == 'exon':
+        parent, exon_id, rank, version = EXON_ATTRIBUTES.match(columns[8]).groups('')
+    else:
+        parent, = UTR_ATTRIBUTES.match(columns[8]).groups('')
+        exon_id = rank = version = ''
+    return [parent.split(':', 1)[1], columns[2], exon_id, columns[3], columns[4], rank, STRANDS.get(columns[6], ''),
+            version]
 
-                # Extract UTRs and exons
-                if len(list_line) > 1 and list_line[2] in ['exon', 'five_prime_UTR', 'three_prime_UTR']:
 
-                    meta_info = list_line[8].split(';')
-                    entry_dict['transcript_id'] = meta_info[0].split(':')[1]
-                    entry_dict['type'] = list_line[2]
-                    entry_dict['start'] = list_line[3]
-                    entry_dict['end'] = list_line[4]
-                    strand = list_line[6]
-                    # Convert plus strand into 1 and minus strand into -1
-                    if strand == '+':
-                        entry_dict['strand'] = '1'
-                    elif strand == '-':
-                        entry_dict['strand'] = '-1'
-                    else:
-                        entry_dict['strand'] = ''
+def transform_gff_to_tsv(gff_file, ensembl_transcript_info):
+    """Stream the exons and UTRs of a GFF3 file to a tab separated file, a
+    batch of rows at a time. Returns the number of rows"""
+    rows = 0
+    with open_gff3(gff_file) as gff, open(ensembl_transcript_info, 'w') as output:
+        output.write('\t'.join(COLUMNS) + '\n')
+        batch = []
+        for columns in iter_features(gff, FEATURE_TYPES):
+            batch.append('\t'.join(get_transcript_info_row(columns)) + '\n')
+            if len(batch) == WRITE_BATCH_SIZE:
+                output.writelines(batch)
+                rows += len(batch)
+                batch = []
+        output.writelines(batch)
+        rows += len(batch)
+    return rows
 
-                    if list_line[2] == 'exon':
-                        entry_dict['id'] = meta_info[5].split('=')[1]
-                        entry_dict['rank'] = meta_info[6].split('=')[1]
-                        entry_dict['version'] = meta_info[7].split('=')[1]
-                    else:
-                        entry_dict['id'] = ''
-                        entry_dict['rank'] = ''
-                        entry_dict['version'] = ''
-                    rows.append(entry_dict)
 
-    # By first appending it to a list and only adding it to a DF once, performance is greatly improved
-    transcript_info = pd.concat([transcript_info, pd.DataFrame(rows)], ignore_index=True, sort=False)
-    transcript_info.to_csv(ensembl_transcript_info, sep='\t', index=False)
-    return
+def main(gff_file, ensembl_transcript_info):
+    """Transform GFF3 file to TSV for exons and UTRs. Input file is GFF3 file, see Makefile"""
+    with phase('load') as profiled:
+        profiled.rows = transform_gff_to_tsv(gff_file, ensembl_transcript_info)
 
 
 if __name__ == "__main__":
@@ -65,6 +61,8 @@ if __name__ == "__main__":
                         help="tmp/annotations.gff3.gz")
     parser.add_argument("ensembl_transcript_info",
                         help="tmp/ensembl_transcript_info.txt")
+    pipeline_profile.add_profile_argument(parser)
     args = parser.parse_args()
+    pipeline_profile.configure(args.ensembl_transcript_info, args.profile)
 
     main(args.gff_file, args.ensembl_transcript_info)
@@ -1,6 +1,9 @@
 import pandas as pd
 import argparse
 import sys
+import pipeline_profile
+from pipeline_profile import phase
+from json_lines import write_json_lines
 
 VARIANT_COUNT_POSTFIX = "_variant_count"
 TUMOR_TYPE_COUNT_POSTFIX = "_tumortype_count"
@@ -302,33 +305,39 @@ def main(input_somatic,
          input_all_variants_freq,
          input_msk_expert_review,
          input_variants_by_cancertype_summary):
-    # parse mutation files
-    somatic_mutations_df = parse_file(input_somatic, sep='\t')
-    germline_mutations_df = parse_file(input_germline, sep='\t')
-    biallelic_mutations_df = parse_file(input_biallelic, sep='\t')
-    qc_pass_mutations_df = parse_file(input_qc_pass, sep='\t')
-    all_variants_freq_df = parse_file(input_all_variants_freq, sep='\t')
-    msk_expert_review_df = parse_file(input_msk_expert_review, sep='\t')
-    variants_by_cancertype_summary_df = parse_file(input_variants_by_cancertype_summary, sep='\t')
-    # process original input
-    somatic_mutations_df = process_data_frame(somatic_mutations_df, "somatic")
-    germline_mutations_df = process_data_frame(germline_mutations_df, "germline")
-    biallelic_mutations_df = process_data_frame(biallelic_mutations_df, "germline")
-    qc_pass_mutations_df = process_data_frame(qc_pass_mutations_df, "germline")
-    all_variants_freq_df = process_all_variant_freq_df(all_variants_freq_df, "germline")
-    msk_expert_review_df = process_msk_expert_review_df(msk_expert_review_df, "germline")
-    variants_by_cancertype_summary_df = process_variants_by_cancertype_summary_df(variants_by_cancertype_summary_df,
-                                                                                  "germline")
-    # merge everything into the main germline mutations data frame
-    merge_mutations(germline_mutations_df,
-                    biallelic_mutations_df,
-                    qc_pass_mutations_df,
-                    all_variants_freq_df,
-                    msk_expert_review_df,
-                    variants_by_cancertype_summary_df)
-    # convert processed data frames to JSON format
-    somatic_mutations_df.to_json(sys.stdout, orient='records', lines=True)
-    germline_mutations_df.to_json(sys.stdout, orient='records', lines=True)
+    with phase('load') as profiled:
+        # parse mutation files
+        somatic_mutations_df = parse_file(input_somatic, sep='\t')
+        germline_mutations_df = parse_file(input_germline, sep='\t')
+        biallelic_mutations_df = parse_file(input_biallelic, sep='\t')
+        qc_pass_mutations_df = parse_file(input_qc_pass, sep='\t')
+        all_variants_freq_df = parse_file(input_all_variants_freq, sep='\t')
+        msk_expert_review_df = parse_file(input_msk_expert_review, sep='\t')
+        variants_by_cancertype_summary_df = parse_file(input_variants_by_cancertype_summary, sep='\t')
+        profiled.rows = len(somatic_mutations_df) + len(germline_mutations_df)
+    with phase('normalize') as profiled:
+        # process original input
+        somatic_mutations_df = process_data_frame(somatic_mutations_df, "somatic")
+        germline_mutations_df = process_data_frame(germline_mutations_df, "germline")
+        biallelic_mutations_df = process_data_frame(biallelic_mutations_df, "germline")
+        qc_pass_mutations_df = process_data_frame(qc_pass_mutations_df, "germline")
+        all_variants_freq_df = process_all_variant_freq_df(all_variants_freq_df, "germline")
+        msk_expert_review_df = process_msk_expert_review_df(msk_expert_review_df, "germline")
+        variants_by_cancertype_summary_df = process_variants_by_cancertype_summary_df(variants_by_cancertype_summary_df,
+                                                                                      "germline")
+        profiled.rows = len(somatic_mutations_df) + len(germline_mutations_df)
+    with phase('join') as profiled:
+        # merge everything into the main germline mutations data frame
+        merge_mutations(germline_mutations_df,
+                        biallelic_mutations_df,
+                        qc_pass_mutations_df,
+                        all_variants_freq_df,
+                        msk_expert_review_df,
+                        variants_by_cancertype_summary_df)
+        profiled.rows = len(germline_mutations_df)
+    with phase('write') as profiled:
+        # convert processed data frames to JSON format
+        profiled.rows = write_json_lines([somatic_mutations_df, germline_mutations_df], sys.stdout)
 
 
 if __name__ == "__main__":
@@ -347,7 +356,9 @@ if __name__ == "__main__":
                         help="signal/signaldb_msk_expert_review_variants.txt")
     parser.add_argument("input_variants_by_cancertype_summary",
                         help="signal/signaldb_variants_by_cancertype_summary_statistics.txt")
+    pipeline_profile.add_profile_argument(parser)
     args = parser.parse_args()
+    pipeline_profile.configure(None, args.profile)
     main(args.input_somatic,
          args.input_germline,
          args.input_biallelic,
@@ -1,4 +1,4 @@
-#!/usr/bin/env python2.7
+#!/usr/bin/env python3
 
 """
 Copyright (c) 2018 The Hyve B.V.
@@ -12,6 +12,31 @@ import os
 import transform_gff_to_tsv_for_exon_info_from_ensembl
 import gzip
 import hotspots.update_hotspots_to_grch38
+import make_one_canonical_transcript_per_gene
+import transcript_versions
+import hgnc_symbols
+import pipeline_profile
+import benchmarks.generate_synthetic_data
+import benchmarks.run_benchmarks
+import ensembl_tables
+import json
+import json_lines
+import step_cache
+import download_transcript_info_from_ensembl
+import ensembl_rest_cache
+import derive_canonical_data_from_gff_and_pep
+import gff3_reader
+import index_gff3
+import export_genomic_intervals
+import sequence_index
+import add_domains_hugo_ccds_refseq_exon_info_uniprot_to_ensembl_transcript as add_transcript_info
+import sys
+import threading
+import time
+import http.server
+import tempfile
+import numpy as np
+import pandas as pd
 import requests
 
 class TransformTestCase(unittest.TestCase):
@@ -21,7 +46,7 @@ class TransformTestCase(unittest.TestCase):
     def assertFileGenerated(self, tmp_file_name, expected_file_name):
         """Assert that a file has been generated with the expected contents."""
         self.assertTrue(os.path.exists(tmp_file_name))
-        with gzip.open(tmp_file_name, 'rU') as out_file, gzip.open(expected_file_name, 'rU') as ref_file:
+        with open(tmp_file_name) as out_file, gzip.open(expected_file_name, 'rt') as ref_file:
             base_filename = os.path.basename(tmp_file_name)
             base_input = os.path.basename(expected_file_name)
             diff_result = difflib.context_diff(
@@ -40,16 +65,94 @@ class TransformTestCase(unittest.TestCase):
 
     def test_pfam_transformation_step(self):
         """Test pfam TSV to internal data structure transformation"""
-        # TODO
+        pfam_domains = pd.DataFrame({'versioned_transcript_id': ['ENST00000288602.6', 'ENST00000288602.6', 'ENST00000256078.4'],
+                                     'pfam_domain_id': ['PF07714', 'PF02196', None],
+                                     'pfam_domain_start': pd.array([457, 155, None], dtype='Int32'),
+                                     'pfam_domain_end': pd.array([712, 227, None], dtype='Int32')})
+        transcripts = pd.DataFrame(index=pd.Index(['ENST00000288602.6', 'ENST00000256078.4', 'ENST00000269305.4']))
+        transcripts = add_transcript_info.add_nested_pfam_domains(transcripts, pfam_domains)
+        self.assertEqual([{'pfam_domain_id': 'PF07714', 'pfam_domain_start': 457, 'pfam_domain_end': 712},
+                          {'pfam_domain_id': 'PF02196', 'pfam_domain_start': 155, 'pfam_domain_end': 227}],
+                         transcripts.loc['ENST00000288602.6', 'domains'])
+        self.assertIsNone(transcripts.loc['ENST00000256078.4', 'domains'][0]['pfam_domain_start'])
+        self.assertTrue(pd.isna(transcripts.loc['ENST00000269305.4', 'domains']))
 
     def test_gff_to_tsv(self):
         """Test transcript info gff to internal data structure transformation"""
         # Build up arguments and run
-        out_file_name = 'test_files/transform_gff_to_tsv/ensembl_transcript_info.txt.gz~'
+        out_file_name = 'test_files/transform_gff_to_tsv/ensembl_transcript_info.txt~'
         gff_input_file_name = 'test_files/transform_gff_to_tsv/sub_Homo_Sapiens.gff3.gz'
         transform_gff_to_tsv_for_exon_info_from_ensembl.transform_gff_to_tsv(gff_input_file_name, out_file_name)
         self.assertFileGenerated(out_file_name, 'test_files/transform_gff_to_tsv/ensembl_transcript_info.txt.gz')
 
+        # attributes are found by key, in any order
+        pattern = gff3_reader.compile_attribute_pattern('Parent', 'exon_id', 'rank', 'id')
+        self.assertEqual(('transcript:ENST00000456328', 'ENSE00002234944', '1', None),
+                         pattern.match('rank=1;exon_id=ENSE00002234944;Parent=transcript:ENST00000456328\n').groups())
+
+    def test_index_gff3(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gff3_index = os.path.join(tmp_dir, 'gff3_index.json')
+            index_gff3.main('test_files/transform_gff_to_tsv/sub_Homo_Sapiens.gff3.gz', gff3_index)
+            # the exons and UTRs are the same as from the single table transform
+            self.assertFileGenerated(os.path.join(tmp_dir, 'ensembl_transcript_info.txt'),
+                                     'test_files/transform_gff_to_tsv/ensembl_transcript_info.txt.gz')
+            with open(gff3_index) as manifest_file:
+                manifest = json.load(manifest_file)
+            self.assertEqual({'exons': 5, 'cds': 0, 'transcripts': 2, 'genes': 1},
+                             {name: table['rows'] for name, table in manifest['tables'].items()})
+
+            gff_file = os.path.join(tmp_dir, 'coding.gff3')
+            with open(gff_file, 'w') as gff:
+                gff.write('##gff-version 3\n'
+                          '7\thavana\tgene\t140719327\t140924929\t.\t-\t.\tID=gene:ENSG00000157764;Name=BRAF;'
+                          'biotype=protein_coding;version=14\n'
+                          '7\thavana\tmRNA\t140719327\t140924929\t.\t-\t.\tID=transcript:ENST00000646891;'
+                          'Parent=gene:ENSG00000157764;Name=BRAF-220;biotype=protein_coding;'
+                          'tag=basic,Ensembl_canonical;version=2\n'
+                          '7\thavana\tCDS\t140924566\t140924764\t.\t-\t0\tID=CDS:ENSP00000493543;'
+                          'Parent=transcript:ENST00000646891;protein_id=ENSP00000493543\n')
+            index_gff3.main(gff_file, gff3_index)
+            cds = index_gff3.read_gff3_table(gff3_index, 'cds')
+            self.assertEqual(['ENST00000646891', 'ENSP00000493543', '7', 140924566, 140924764, -1, 0],
+                             cds.iloc[0].tolist())
+            transcripts = index_gff3.read_gff3_table(gff3_index, 'transcripts')
+            self.assertEqual(['ENSG00000157764', 'mRNA', 'protein_coding', 2, True],
+                             transcripts.loc[0, ['gene_id', 'type', 'biotype', 'version', 'is_canonical']].tolist())
+            genes = index_gff3.read_gff3_table(gff3_index, 'genes')
+            self.assertEqual(['ENSG00000157764', 'BRAF', 140719327], genes.loc[0, ['gene_id', 'name', 'start']].tolist())
+
+    def test_export_genomic_intervals(self):
+        # the smallest UCSC bin holding an interval, for 1-based inclusive coordinates
+        self.assertEqual([585, 586, 73, 0],
+                         export_genomic_intervals.get_bins([1, 131073, 131072, 1], [131072, 131073, 131073, 200000000]).tolist())
+        self.assertEqual([585, 586, 73, 9, 1, 0], export_genomic_intervals.get_overlapping_bins(131000, 131100))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gff3_index = os.path.join(tmp_dir, 'gff3_index.json')
+            index_gff3.main('test_files/transform_gff_to_tsv/sub_Homo_Sapiens.gff3.gz', gff3_index)
+            intervals = export_genomic_intervals.get_intervals(index_gff3.read_gff3_table(gff3_index, 'exons'),
+                                                               index_gff3.read_gff3_table(gff3_index, 'transcripts'))
+        self.assertEqual(7, len(intervals))
+        transcript = intervals[intervals['type'] == 'transcript'].iloc[0]
+        self.assertEqual(['1', 585, 11869, 14409, 'ENST00000456328', 'ENSG00000223972'],
+                         transcript[['chromosome', 'bin', 'start', 'end', 'transcript_id', 'gene_id']].tolist())
+        self.assertTrue((intervals['start'].diff().dropna() >= 0).all())
+        # every interval overlapping a region is in one of the bins of the region
+        overlapping = intervals[(intervals['start'] <= 13000) & (intervals['end'] >= 12000)]
+        self.assertTrue(overlapping['bin'].isin(export_genomic_intervals.get_overlapping_bins(12000, 13000)).all())
+
+    def test_one_substitution_index(self):
+        uniprot_sequences = ['MKTAYIAK', 'MKTAYLAK', 'MKTAYIAKQ', 'MRTAYIAK', 'MKTAYLAK', 'AKTAYIAK', 'MKTAYIAR']
+        index = sequence_index.OneSubstitutionIndex(uniprot_sequences)
+        # as Levenshtein distance 1 among sequences of the same length, in order and with duplicates
+        self.assertEqual(['MKTAYLAK', 'MRTAYIAK', 'MKTAYLAK', 'AKTAYIAK', 'MKTAYIAR'], index.find('MKTAYIAK'))
+        self.assertEqual(['MKTAYIAK'], index.find('MKTAYLAK'))
+        self.assertEqual([], index.find('MKTAYIAKQQ'))
+        self.assertEqual([], index.find(''))
+        # only the sequences of the given lengths are indexed
+        self.assertEqual([], sequence_index.OneSubstitutionIndex(uniprot_sequences, {9}).find('MKTAYIAR'))
+
     def test_get_gene_and_transcript_map(self):
         hugo_and_transcript_map = hotspots.update_hotspots_to_grch38.get_gene_and_transcript_map('data/grch38_ensembl95/export/ensembl_biomart_canonical_transcripts_per_hgnc.txt')
         self.assertEqual('ENST00000646891', hugo_and_transcript_map['BRAF']['mskcc_canonical_transcript'])
@@ -101,3 +204,537 @@ class TransformTestCase(unittest.TestCase):
 
         transcript_id = hotspots.update_hotspots_to_grch38.find_grch38_transcript_id('invalidhugo', hugo_and_transcript_map, 'mskcc')
         self.assertIsNone(transcript_id)
+
+    def test_pick_canonical_longest_transcripts(self):
+        ensembl_table = pd.DataFrame({
+            'hgnc_symbol': ['BRAF', 'BRAF', 'BRAF', 'KRAS', 'KRAS', 'TP53'],
+            'gene_stable_id': ['ENSG00000157764'] * 3 + ['ENSG00000133703'] * 2 + ['ENSG00000141510'],
+            'transcript_stable_id': ['ENST00000496384', 'ENST00000288602', 'ENST00000646891',
+                                     'ENST00000311936', 'ENST00000256078', 'ENST00000269305'],
+            'is_canonical': [False, False, True, False, False, True],
+            'protein_length': [300, 766, 806, 189, 189, 393]}).set_index('hgnc_symbol')
+        canonical = make_one_canonical_transcript_per_gene.pick_canonical_longest_transcripts(ensembl_table)
+        self.assertEqual('ENST00000646891', canonical.loc['BRAF', 'transcript_stable_id'])
+        self.assertEqual('ensembl longest', canonical.loc['BRAF', 'explanation'])
+        # equal protein length: first transcript in table order wins
+        self.assertEqual('ENST00000311936', canonical.loc['KRAS', 'transcript_stable_id'])
+        self.assertEqual('ensembl only one transcript', canonical.loc['TP53', 'explanation'])
+
+    def test_get_transcript_ids_and_explanations_in_shards(self):
+        ensembl_table = pd.DataFrame({
+            'hgnc_symbol': ['BRAF', 'BRAF', 'KRAS', 'TP53'],
+            'gene_stable_id': ['ENSG00000157764'] * 2 + ['ENSG00000133703', 'ENSG00000141510'],
+            'transcript_stable_id': ['ENST00000288602', 'ENST00000646891', 'ENST00000311936', 'ENST00000269305'],
+            'versioned_transcript_id': ['ENST00000288602.11', 'ENST00000646891.2', 'ENST00000311936.8', 'ENST00000269305.9'],
+            'is_canonical': [False, True, True, True],
+            'protein_length': [766, 806, 189, 393]})
+        hgnc = pd.DataFrame({'ensembl_gene_id': ['ENSG00000157764', 'ENSG00000133703', None]},
+                            index=['BRAF', 'KRAS', 'TP53'])
+        overrides = pd.DataFrame({'isoform_override': ['ENST00000288602']}, index=['BRAF'])
+        inputs = dict(canonical_by_symbol=make_one_canonical_transcript_per_gene.pick_canonical_longest_transcripts(ensembl_table.set_index('hgnc_symbol')),
+                      canonical_by_gene_stable_id=make_one_canonical_transcript_per_gene.pick_canonical_longest_transcripts(ensembl_table.set_index('gene_stable_id', drop=False)),
+                      version_index=transcript_versions.build_transcript_version_index(ensembl_table),
+                      hgnc_df=hgnc,
+                      isoform_overrides=make_one_canonical_transcript_per_gene.compile_isoform_overrides(overrides.iloc[:0], overrides.iloc[:0], overrides))
+        hugos = pd.Index(['TP53', 'BRAF', 'KRAS'])
+        expected = make_one_canonical_transcript_per_gene.get_transcript_ids_and_explanations(hugos, **inputs)
+        sharded = make_one_canonical_transcript_per_gene.get_transcript_ids_and_explanations_in_shards(2, hugos, **inputs)
+        pd.testing.assert_frame_equal(expected, sharded)
+        self.assertEqual('ENST00000288602', sharded.loc['BRAF', 'mskcc_canonical_transcript'])
+        self.assertEqual('11', sharded.loc['BRAF', 'mskcc_canonical_transcript_version'])
+        self.assertEqual('ENST00000646891', sharded.loc['BRAF', 'uniprot_canonical_transcript'])
+
+    def test_compile_isoform_overrides(self):
+        mskcc = pd.DataFrame({'gene_name': ['BRAF', 'BRAF', 'KRAS'],
+                              'isoform_override': ['ENST00000288602.6', 'ENST00000646891', 'ENST00000256078'],
+                              'note': [' manual review ', 'ignored', None]}).set_index('gene_name')
+        uniprot = pd.DataFrame({'gene_name': ['TP53'], 'isoform_override': [None]}).set_index('gene_name')
+        custom = pd.DataFrame({'gene_name': [], 'isoform_override': []}).set_index('gene_name')
+        overrides = make_one_canonical_transcript_per_gene.compile_isoform_overrides(custom, uniprot, mskcc)
+        # first override per gene symbol wins, also for its note
+        self.assertEqual('ENST00000288602.6', overrides.loc['BRAF', 'mskcc_transcript'])
+        self.assertEqual('manual review', overrides.loc['BRAF', 'mskcc_note'])
+        self.assertTrue(pd.isna(overrides.loc['KRAS', 'mskcc_note']))
+        # an override row without transcript still counts as override
+        self.assertTrue(overrides.loc['TP53', 'uniprot_override'])
+        self.assertTrue(pd.isna(overrides.loc['BRAF', 'genome_nexus_override']))
+        # notes stay strings when no override has one, so they can be appended to explanations
+        mskcc['note'] = float('nan')
+        overrides = make_one_canonical_transcript_per_gene.compile_isoform_overrides(custom, uniprot, mskcc)
+        self.assertEqual(object, overrides['mskcc_note'].dtype)
+
+    def test_find_affected_symbols(self):
+        previous_output = pd.DataFrame({
+            'ensembl_canonical_transcript': ['ENST00000646891', 'ENST00000311936', 'ENST00000269305'],
+            'mskcc_canonical_transcript': ['ENST00000288602', 'ENST00000311936', 'ENST00000269305']},
+            index=pd.Index(['BRAF', 'KRAS', 'TP53'], name='hgnc_symbol'))
+        hgnc = pd.DataFrame({'ensembl_gene_id': ['ENSG00000157764', 'ENSG00000133703', 'ENSG00000141510', None]},
+                            index=['BRAF', 'KRAS', 'TP53', 'NRAS'])
+        previous_fingerprints = {'hgnc': {'BRAF': '1', 'KRAS': '2', 'TP53': '3'}, 'ensembl_by_symbol': {}, 'uniprot': {},
+                                 'mskcc': {'BRAF': '4'}, 'custom': {}, 'ensembl_by_gene': {'ENSG00000133703': '5'},
+                                 'transcript_versions': {'ENST00000269305': '9'}, 'mskcc_refseq': {}}
+        fingerprints = dict(previous_fingerprints, hgnc=dict(previous_fingerprints['hgnc'], NRAS='6'))
+        affected = make_one_canonical_transcript_per_gene.find_affected_symbols(hgnc.index, hgnc, previous_output, previous_fingerprints, fingerprints)
+        # only the new symbol
+        self.assertEqual(['NRAS'], list(affected))
+        fingerprints.update(mskcc={}, ensembl_by_gene={'ENSG00000133703': '7'}, transcript_versions={'ENST00000269305': '10'})
+        affected = make_one_canonical_transcript_per_gene.find_affected_symbols(hgnc.index, hgnc, previous_output, previous_fingerprints, fingerprints)
+        self.assertEqual(['BRAF', 'KRAS', 'TP53', 'NRAS'], list(affected))
+
+        # empty passthrough columns don't prevent patching, an empty transcript column does
+        previous_output['vega_id'] = ''
+        self.assertIsNone(make_one_canonical_transcript_per_gene.get_unpatchable_column(previous_output))
+        previous_output['uniprot_canonical_transcript'] = ''
+        self.assertEqual('uniprot_canonical_transcript',
+                         make_one_canonical_transcript_per_gene.get_unpatchable_column(previous_output))
+
+    def test_incremental_ensembl_row_change(self):
+        # 50 symbols of 25 genes, 6 transcripts each with tied protein lengths, in shuffled input order
+        symbols = ['S%d' % (i % 50) for i in range(300)]
+        transcript_info = pd.DataFrame({'hgnc_symbol': symbols,
+                                        'gene_stable_id': ['G%d' % (int(symbol[1:]) // 2) for symbol in symbols],
+                                        'transcript_stable_id': ['ENST%011d' % i for i in range(300)],
+                                        'is_canonical': 0,
+                                        'protein_length': [100 + i % 3 for i in range(300)]}).sample(frac=1, random_state=1)
+        hgnc = pd.DataFrame({'ensembl_gene_id': ['G%d' % (i // 2) for i in range(50)]}, index=['S%d' % i for i in range(50)])
+        previous_output = pd.DataFrame({'ensembl_canonical_transcript': '', 'mskcc_canonical_transcript': ''}, index=hgnc.index)
+
+        def get_fingerprints(transcript_info):
+            by_symbol, by_gene = make_one_canonical_transcript_per_gene.index_by_symbol_and_gene(transcript_info)
+            return {'ensembl_by_symbol': make_one_canonical_transcript_per_gene.digest_rows(by_symbol.reset_index(), 'hgnc_symbol'),
+                    'ensembl_by_gene': make_one_canonical_transcript_per_gene.digest_rows(by_gene.reset_index(drop=True), 'gene_stable_id'),
+                    'hgnc': {}, 'uniprot': {}, 'mskcc': {}, 'custom': {}, 'transcript_versions': {}, 'mskcc_refseq': {}}
+
+        previous_fingerprints = get_fingerprints(transcript_info.copy())
+        fingerprints = get_fingerprints(transcript_info[transcript_info['transcript_stable_id'] != 'ENST00000000007'].copy())
+        affected = make_one_canonical_transcript_per_gene.find_affected_symbols(hgnc.index, hgnc, previous_output, previous_fingerprints, fingerprints)
+        # the symbol of the row and the other symbol of its gene
+        self.assertEqual(['S6', 'S7'], list(affected))
+
+    def test_hgnc_symbol_resolver(self):
+        resolver = hgnc_symbols.HgncSymbolResolver.from_symbols(
+            ['H3-3A', 'H3-3B', 'NSD3'], ['"H3F3A|H3F3"', 'H3F3B|H3F3A', None], ['H3.3A', None, 'WHSC1L1|H3-3B'])
+        self.assertEqual('NSD3', resolver.resolve('nsd3'))
+        # first gene wins for shared previous symbols
+        self.assertEqual('H3-3A', resolver.resolve('H3F3A'))
+        # approved symbols before previous symbols before aliases
+        self.assertEqual('H3-3B', resolver.resolve('H3-3B'))
+        self.assertEqual('NSD3', resolver.resolve('WHSC1L1'))
+        self.assertIsNone(resolver.resolve('WHSC1L1', use_aliases=False))
+        self.assertIsNone(resolver.resolve('invalidhugo'))
+        hugo_and_transcript_map = {'H3-3A': {'previous_symbols': 'H3F3A, H3F3', 'synonyms': 'H3.3A', 'mskcc_canonical_transcript': 'ENST00000366815'}}
+        transcript_id = hotspots.update_hotspots_to_grch38.find_grch38_transcript_id('H3F3', hugo_and_transcript_map, 'mskcc')
+        self.assertEqual('ENST00000366815', transcript_id)
+
+    def test_get_new_hugo_symbol(self):
+        hugo_and_transcript_map = {'GENE1': {'previous_symbols': 'OLD1, SHARED', 'synonyms': 'ALIAS1'},
+                                   'GENE2': {'previous_symbols': 'ALIAS1', 'synonyms': 'SHARED, GENE1'},
+                                   'GENE3': {'previous_symbols': float('nan'), 'synonyms': float('nan')}}
+        # the first gene in the map wins, whether the symbol is a previous symbol or a synonym
+        self.assertEqual('GENE1', hotspots.update_hotspots_to_grch38.get_new_hugo_symbol('ALIAS1', hugo_and_transcript_map))
+        self.assertEqual('GENE1', hotspots.update_hotspots_to_grch38.get_new_hugo_symbol('SHARED', hugo_and_transcript_map))
+        # only previous symbols and synonyms, case-sensitive
+        self.assertEqual('GENE2', hotspots.update_hotspots_to_grch38.get_new_hugo_symbol('GENE1', hugo_and_transcript_map))
+        self.assertIsNone(hotspots.update_hotspots_to_grch38.get_new_hugo_symbol('old1', hugo_and_transcript_map))
+        self.assertIsNone(hotspots.update_hotspots_to_grch38.get_new_hugo_symbol('GENE3', hugo_and_transcript_map))
+
+    def test_add_nested_hgnc(self):
+        transcripts = pd.DataFrame({'transcript_stable_id': ['ENST00000000001', 'ENST00000000002', 'ENST00000000002', 'ENST00000000003'],
+                                    'hgnc_symbol': ['gene718', 'braf1', 'KRAS', None]},
+                                   index=pd.Index(['ENST00000000001.1', 'ENST00000000002.1', 'ENST00000000002.1', 'ENST00000000003.1'], name='versioned_transcript_id'))
+        symbol_resolver = hgnc_symbols.HgncSymbolResolver.from_symbols(['GENE718', 'BRAF', 'KRAS'], [None, 'BRAF1|KRAS', None], ['GENE7', None, None])
+        hgnc = add_transcript_info.add_nested_hgnc(transcripts, symbol_resolver)
+        # approved symbols are spelled as in HGNC, previous symbols map case-insensitively, approved symbols win
+        self.assertEqual(['GENE718'], hgnc.loc['ENST00000000001', 'hgnc_symbols'])
+        self.assertEqual(['BRAF', 'KRAS'], hgnc.loc['ENST00000000002', 'hgnc_symbols'])
+        self.assertTrue(pd.isna(hgnc.loc['ENST00000000003', 'hgnc_symbols']))
+
+        # a previous symbol of several genes resolves to the first of them in the HGNC file
+        transcripts = pd.DataFrame({'transcript_stable_id': ['ENST00000000004'], 'hgnc_symbol': ['OLD1']},
+                                   index=pd.Index(['ENST00000000004.1'], name='versioned_transcript_id'))
+        symbol_resolver = hgnc_symbols.HgncSymbolResolver.from_symbols(['GENEA', 'GENEB'], ['OLD1', 'OLD1|OLD2'], [None, None])
+        hgnc = add_transcript_info.add_nested_hgnc(transcripts, symbol_resolver)
+        self.assertEqual(['GENEA'], hgnc.loc['ENST00000000004', 'hgnc_symbols'])
+
+    def test_phase_profiler(self):
+        profiler = pipeline_profile.PhaseProfiler('unused.profile.json')
+        with profiler.phase('load') as profiled:
+            with profiler.phase('read hgnc'):
+                pass
+            profiled.rows = 3
+        report = profiler.report()
+        # phases are reported when they end, nested phases first
+        self.assertEqual(['read hgnc', 'load'], [phase['name'] for phase in report['phases']])
+        self.assertEqual([1, 0], [phase['depth'] for phase in report['phases']])
+        self.assertEqual(3, report['phases'][1]['rows'])
+        self.assertGreater(report['phases'][1]['peak_rss_mb'], 0)
+
+    def test_build_transcript_version_index(self):
+        transcripts = pd.DataFrame({
+            'transcript_stable_id': ['ENST00000288602', 'ENST00000288602', 'ENST00000646891', 'ENST00000256078'],
+            'versioned_transcript_id': ['ENST00000288602.6', 'ENST00000288602.11', 'ENST00000646891.2', 'ENST00000256078'],
+            'transcript_id_version': ['6', '11', None, None]})
+        version_index = transcript_versions.build_transcript_version_index(transcripts)
+        # highest version wins, compared numerically
+        self.assertEqual('11', version_index['ENST00000288602'])
+        # without transcript_id_version fall back to the versioned id
+        self.assertEqual('2', version_index['ENST00000646891'])
+        self.assertNotIn('ENST00000256078', version_index)
+
+    def test_generate_synthetic_data(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            benchmarks.generate_synthetic_data.main(data_dir, 0.002)
+            self.assertTrue(benchmarks.generate_synthetic_data.is_generated(data_dir, 0.002, 1))
+            self.assertFalse(benchmarks.generate_synthetic_data.is_generated(data_dir, 1.0, 1))
+            transcripts = pd.read_csv(os.path.join(data_dir, 'tmp/ensembl_canonical_data.txt'), sep='\t', dtype=str)
+            hgnc = pd.read_csv(os.path.join(data_dir, 'common_input/hgnc_complete_set.txt'), sep='\t', dtype=str)
+            self.assertEqual(int(benchmarks.generate_synthetic_data.HUMAN_HGNC_GENES * 0.002), len(hgnc))
+            # every transcript belongs to one gene
+            self.assertEqual(1, transcripts.groupby('transcript_stable_id').gene_stable_id.nunique().max())
+            # GFF3 and exon info describe the same transcripts
+            with gzip.open(os.path.join(data_dir, 'tmp/annotations.gff3.gz'), 'rt') as gff:
+                gff_transcripts = {line.split('\t')[8].split(';')[0].split(':')[1] for line in gff
+                                   if '\texon\t' in line}
+            transcript_info = pd.read_csv(os.path.join(data_dir, 'tmp/ensembl_transcript_info.txt'), sep='\t', dtype=str)
+            self.assertEqual(gff_transcripts, set(transcript_info.transcript_id))
+            self.assertEqual(set(transcripts.transcript_stable_id), gff_transcripts)
+
+    def test_compare_to_baseline(self):
+        baseline = {'1': {'gff_transform': {'wall_seconds': 10.0}, 'ptm_mapper': {'wall_seconds': 0.2}}}
+        results = {'1': {'gff_transform': {'wall_seconds': 13.0},
+                         'ptm_mapper': {'wall_seconds': 0.5},
+                         'signal_transform': {'wall_seconds': 99.0}},
+                   '5': {'gff_transform': {'wall_seconds': 99.0}}}
+        regressions = benchmarks.run_benchmarks.compare_to_baseline(results, baseline, tolerance=0.25)
+        # small absolute differences and benchmarks without baseline pass
+        self.assertEqual(1, len(regressions))
+        self.assertTrue(regressions[0].startswith('gff_transform at scale 1'))
+        self.assertEqual([], benchmarks.run_benchmarks.compare_to_baseline(results, baseline, tolerance=0.5))
+
+    def test_read_ensembl_table(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'ensembl_transcript_info.txt')
+            with open(file_name, 'w') as table:
+                table.write('transcript_id\ttype\tid\tstart\tend\trank\tstrand\tversion\tcolor\n'
+                            'ENST00000456328\texon\tENSE00002234944\t11869\t12227\t1\t1\t1\tred\n'
+                            'ENST00000456328\tfive_prime_UTR\t\t11869\t12009\t\t1\t\t\n')
+            transcript_info = ensembl_tables.read_table(file_name, ensembl_tables.TRANSCRIPT_INFO_SCHEMA)
+        self.assertEqual('category', transcript_info['type'].dtype)
+        self.assertEqual('int32', transcript_info['start'].dtype)
+        self.assertEqual('Int16', transcript_info['rank'].dtype)
+        # columns not in the schema are read as strings
+        self.assertEqual(object, transcript_info['color'].dtype)
+        self.assertEqual([11869, 11869], list(transcript_info['start']))
+        self.assertTrue(pd.isna(transcript_info['rank'][1]))
+
+    def test_write_json_lines(self):
+        frame = pd.DataFrame({'hugo_symbol': ['BRAF', 'KRAS', None, 'TP53', 'NRAS'],
+                              'exons': [[{'rank': '1'}], None, [], [{'rank': '2'}], None]})
+        expected = frame.to_json(orient='records', lines=True) + frame.iloc[:2].to_json(orient='records', lines=True)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'records.json.gz')
+            rows = json_lines.write_json_lines([frame, frame.iloc[:2]], file_name, chunk_size=2, threads=2)
+            with gzip.open(file_name, 'rt') as records:
+                self.assertEqual(expected, records.read())
+            # one gzip member per chunk
+            with open(file_name, 'rb') as records:
+                self.assertEqual(4, records.read().count(b'\x1f\x8b\x08'))
+        self.assertEqual(7, rows)
+
+    def test_add_refseq_and_ccds(self):
+        transcripts = pd.DataFrame(index=pd.Index(['ENST00000288602.6', 'ENST00000288602.6', 'ENST00000256078.4', 'ENST00000269305.4'],
+                                                  name='versioned_transcript_id'))
+        refseq = pd.DataFrame({'Versioned transcript ID': ['ENST00000288602.6', 'ENST00000288602.6', 'ENST00000256078.4', 'ENST00000269305.4'],
+                               'RefSeq mRNA ID': ['NM_004333', 'NM_001354609', 'NM_004985', None]})
+        ccds = pd.DataFrame({'Versioned transcript ID': ['ENST00000288602.6', 'ENST00000269305.4'],
+                             'CCDS ID': ['CCDS5863', 'CCDS11118']})
+        uniprot = pd.DataFrame({'enst_id': ['ENST00000256078', 'ENST00000269305', 'ENST00000269305'],
+                                'refseq_id': ['NM_033360.4', 'NM_000546.6', 'NM_001126112.3'],
+                                'ccds_id': ['CCDS8702.1', 'CCDS11118.1', 'CCDS45605.1']}).set_index('enst_id')
+        mskcc = pd.DataFrame({'enst_id': ['ENST00000256078'], 'refseq_id': [None]}).set_index('enst_id')
+        transcripts = add_transcript_info.add_refseq(transcripts, refseq, uniprot, mskcc)
+        transcripts = add_transcript_info.add_ccds(transcripts, ccds, uniprot, mskcc)
+        # highest BioMart id, unless overridden. An empty mskcc override falls back to uniprot
+        self.assertEqual(['NM_004333', 'NM_004333', 'NM_033360'], list(transcripts.refseq_mrna_id[:3]))
+        self.assertEqual(['CCDS5863', 'CCDS5863', 'CCDS8702'], list(transcripts.ccds_id[:3]))
+        # transcripts with several overrides use BioMart
+        self.assertTrue(pd.isna(transcripts.refseq_mrna_id.iloc[3]))
+        self.assertEqual('CCDS11118', transcripts.ccds_id.iloc[3])
+
+    def test_enrich_transcripts_in_shards(self):
+        transcripts = pd.DataFrame({'transcript_stable_id': ['ENST00000288602', 'ENST00000288602', 'ENST00000256078', 'ENST00000269305', 'ENST00000646891'],
+                                    'gene_stable_id': ['ENSG00000157764', 'ENSG00000157764', 'ENSG00000133703', 'ENSG00000141510', 'ENSG00000157764'],
+                                    'hgnc_symbol': ['BRAF', 'BRAF1', 'KRAS', 'TP53', 'BRAF']},
+                                   index=pd.Index(['ENST00000288602.6', 'ENST00000288602.6', 'ENST00000256078.4', 'ENST00000269305.4', 'ENST00000646891.1'],
+                                                  name='versioned_transcript_id'))
+        overrides = pd.DataFrame({'enst_id': [], 'refseq_id': [], 'ccds_id': []}).set_index('enst_id')
+        inputs = dict(pfam_domains=pd.DataFrame({'versioned_transcript_id': ['ENST00000288602.6'], 'pfam_domain_id': ['PF07714'],
+                                                 'pfam_domain_start': pd.array([457], dtype='Int32'),
+                                                 'pfam_domain_end': pd.array([712], dtype='Int32')}),
+                      refseq=pd.DataFrame({'Versioned transcript ID': ['ENST00000256078.4'], 'RefSeq mRNA ID': ['NM_004985']}),
+                      ccds=pd.DataFrame({'Versioned transcript ID': ['ENST00000269305.4'], 'CCDS ID': ['CCDS11118']}),
+                      enst_to_uniprot_map=pd.DataFrame({'versioned_transcript_id': ['ENST00000288602.6'], 'final_uniprot_id': ['P15056']}),
+                      isoform_overrides_uniprot=overrides,
+                      isoform_overrides_mskcc=overrides,
+                      symbol_resolver=hgnc_symbols.HgncSymbolResolver.from_symbols(['BRAF', 'KRAS', 'TP53'], ['BRAF1', None, None], [None, None, None]))
+        expected = add_transcript_info.enrich_transcripts(transcripts.copy(), **inputs)
+        sharded = add_transcript_info.enrich_transcripts_in_shards(2, transcripts.copy(), **inputs)
+        pd.testing.assert_frame_equal(expected, sharded, check_dtype=False)
+        self.assertEqual(['BRAF', 'BRAF'], sharded.loc['ENST00000288602', 'hgnc_symbols'])
+        self.assertEqual(2, len(add_transcript_info.split_in_shards(transcripts, 2)))
+
+    @unittest.skipIf(ensembl_tables.pyarrow is None, 'pyarrow is not installed')
+    def test_read_table_sidecar(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'ensembl_biomart_transcripts.txt')
+            with open(file_name, 'w') as table:
+                table.write('transcript_stable_id\thgnc_symbol\tprotein_length\n'
+                            'ENST00000288602\tBRAF\t766\n'
+                            'ENST00000256078\t\t\n')
+            expected = ensembl_tables.read_table(file_name, ensembl_tables.BIOMART_TRANSCRIPTS_SCHEMA)
+            self.assertTrue(os.path.exists(file_name + '.arrow'))
+            pd.testing.assert_frame_equal(expected, ensembl_tables.read_sidecar(file_name, ensembl_tables.BIOMART_TRANSCRIPTS_SCHEMA))
+            self.assertIsNone(ensembl_tables.read_sidecar(file_name, {'hgnc_symbol': 'category'}))
+            # a changed TSV is read again
+            with open(file_name, 'a') as table:
+                table.write('ENST00000269305\tTP53\t393\n')
+            self.assertIsNone(ensembl_tables.read_sidecar(file_name, ensembl_tables.BIOMART_TRANSCRIPTS_SCHEMA))
+            self.assertEqual(3, len(ensembl_tables.read_table(file_name, ensembl_tables.BIOMART_TRANSCRIPTS_SCHEMA)))
+
+    def test_step_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file_name = os.path.join(tmp_dir, 'input.txt')
+            output_file_name = os.path.join(tmp_dir, 'output.txt')
+            cache_dir = os.path.join(tmp_dir, 'steps')
+            with open(input_file_name, 'w') as input_file:
+                input_file.write('BRAF\n')
+            # appends, so a step that runs again is noticed
+            command = [sys.executable, '-c',
+                       'import sys; open(sys.argv[2], "a").write(open(sys.argv[1]).read())',
+                       input_file_name, output_file_name]
+
+            self.assertFalse(step_cache.run_step(command, [output_file_name], cache_dir))
+            self.assertTrue(step_cache.run_step(command, [output_file_name], cache_dir))
+            with open(output_file_name) as output_file:
+                self.assertEqual('BRAF\n', output_file.read())
+
+            # changed input content is another step
+            with open(input_file_name, 'w') as input_file:
+                input_file.write('TP53\n')
+            os.remove(output_file_name)
+            self.assertFalse(step_cache.run_step(command, [output_file_name], cache_dir))
+            with open(output_file_name) as output_file:
+                self.assertEqual('TP53\n', output_file.read())
+
+            # the number of workers is not part of the key
+            self.assertEqual(step_cache.get_step_key(command + ['--workers', '1'], [output_file_name]),
+                             step_cache.get_step_key(command + ['--workers=8'], [output_file_name]))
+            # nor the number of Ensembl REST queries in flight
+            self.assertEqual(step_cache.get_step_key(command + ['-c', '4'], [output_file_name]),
+                             step_cache.get_step_key(command + ['--concurrency=16'], [output_file_name]))
+
+            # a declared input the step rewrites is keyed on its content before the step, and restored after it
+            genes_file_name = os.path.join(tmp_dir, 'genes.txt')
+            with open(genes_file_name, 'w') as genes_file:
+                genes_file.write('WHSC1L1\n')
+            command = [sys.executable, '-c',
+                       'import sys; open(sys.argv[1], "w").write("NSD3\\n"); open(sys.argv[2], "a").write("NSD3\\n")',
+                       genes_file_name, output_file_name]
+            outputs = [genes_file_name, output_file_name]
+            key = step_cache.get_step_key(command, outputs, inputs=[genes_file_name])
+            os.remove(output_file_name)
+            self.assertFalse(step_cache.run_step(command, outputs, cache_dir, [genes_file_name]))
+            self.assertNotEqual(key, step_cache.get_step_key(command, outputs, inputs=[genes_file_name]))
+            with open(genes_file_name, 'w') as genes_file:
+                genes_file.write('WHSC1L1\n')
+            self.assertTrue(step_cache.run_step(command, outputs, cache_dir, [genes_file_name]))
+            with open(genes_file_name) as genes_file:
+                self.assertEqual('NSD3\n', genes_file.read())
+
+    def test_lookup_transcripts(self):
+        requests_seen = []
+
+        class EnsemblStandIn(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                ids = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['ids']
+                requests_seen.append(len(ids))
+                if len(requests_seen) == 1:
+                    self.send_response(429)
+                    self.send_header('Retry-After', '0.05')
+                    self.end_headers()
+                    return
+                if len(ids) > 2:
+                    self.send_response(504)
+                    self.end_headers()
+                    return
+                body = json.dumps({id: {'is_canonical': int(id.startswith('ENST00000000005')), 'version': 3,
+                                        'Translation': {'id': id.replace('T', 'P'), 'length': 100}}
+                                   for id in ids}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), EnsemblStandIn)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            gene_info = pd.DataFrame({'versioned_transcript_id': ['ENST0000000000%d.3' % i for i in range(7)]})
+            client = download_transcript_info_from_ensembl.EnsemblLookupClient(
+                'http://127.0.0.1:%d' % server.server_address[1], concurrency=2, batch_size=4, min_batch_size=1)
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                journal_file_name = os.path.join(tmp_dir, 'transcript_info.ndjson')
+                journal = download_transcript_info_from_ensembl.TranscriptInfoJournal(
+                    journal_file_name, gene_info['versioned_transcript_id'].tolist())
+                # 0-4 was saved by an earlier run, which crashed while saving 4-7
+                journal.append(0, 4, [[0, 3, 'ENSP0000000000%d.3' % i, 100] for i in range(4)])
+                journal.file.write(b'{"start": 4, "end"')
+                journal.close()
+                journal = download_transcript_info_from_ensembl.TranscriptInfoJournal(
+                    journal_file_name, gene_info['versioned_transcript_id'].tolist())
+                self.assertEqual([[0, 4]], journal.completed_ranges())
+                transcript_info = download_transcript_info_from_ensembl.lookup_transcripts(gene_info, journal, 4,
+                                                                                           client)
+                journal.close()
+                with open(journal_file_name) as journal_file:
+                    self.assertEqual(3, len(journal_file.readlines()))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(list(range(7)), list(transcript_info.index))
+        self.assertEqual(['0'] * 4 + ['0', '1', '0'], list(transcript_info['is_canonical']))
+        # rate limited, then a timeout on 3 ids halves the batches
+        self.assertEqual([3, 3], requests_seen[:2])
+        self.assertEqual(1, client.batch_size)
+        self.assertEqual(3, sum(requests_seen[2:]))
+
+    def test_lookup_backs_off_on_bare_429(self):
+        request_times = []
+
+        class EnsemblStandIn(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                ids = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['ids']
+                request_times.append(time.monotonic())
+                if len(request_times) < 3:
+                    # no Retry-After and no X-RateLimit headers
+                    self.send_response(429)
+                    self.end_headers()
+                    return
+                body = json.dumps({id: {'is_canonical': 1, 'version': 3} for id in ids}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), EnsemblStandIn)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            client = download_transcript_info_from_ensembl.EnsemblLookupClient(
+                'http://127.0.0.1:%d' % server.server_address[1], retries=2, backoff=0.2)
+            self.assertEqual({'ENST00000000001.3': {'is_canonical': 1, 'version': 3}},
+                             client.lookup(['ENST00000000001.3']))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # backoff of at least half of 0.2 and 0.4 seconds
+        self.assertEqual(3, len(request_times))
+        self.assertGreaterEqual(request_times[1] - request_times[0], 0.1)
+        self.assertGreaterEqual(request_times[2] - request_times[1], 0.2)
+
+    def test_ensembl_rest_cache(self):
+        server = 'http://127.0.0.1:9'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = ensembl_rest_cache.EnsemblRestCache(os.path.join(tmp_dir, 'ensembl_rest.sqlite'))
+            cache.put_many(server, '/lookup/id', 112, {'ENST00000288602.11': {'is_canonical': 1, 'version': 11},
+                                                       'ENST00000000000.1': None})
+            cache.put(server, '/lookup/id', 113, 'ENST00000288602.11', {'is_canonical': 0})
+            self.assertEqual({'ENST00000288602.11': {'is_canonical': 1, 'version': 11}, 'ENST00000000000.1': None},
+                             cache.get_many(server, '/lookup/id', 112, ['ENST00000288602.11', 'ENST00000000000.1',
+                                                                        'ENST00000269305.9']))
+            self.assertEqual(113, ensembl_rest_cache.get_release(server, cache, offline=True))
+
+            export_file_name = os.path.join(tmp_dir, 'export.sqlite')
+            self.assertEqual(2, cache.export(export_file_name, server, 112))
+            exported = ensembl_rest_cache.EnsemblRestCache(export_file_name)
+            self.assertEqual(112, exported.latest_release(server))
+
+            # offline, nothing is requested from the (closed) server
+            client = download_transcript_info_from_ensembl.EnsemblLookupClient(server, cache=exported, release=112,
+                                                                               offline=True)
+            self.assertEqual({'ENST00000288602.11': {'is_canonical': 1, 'version': 11}},
+                             client.lookup(['ENST00000288602.11']))
+            with self.assertRaises(ensembl_rest_cache.EnsemblOfflineError):
+                client.lookup(['ENST00000288602.11', 'ENST00000269305.9'])
+            cache.close()
+            exported.close()
+
+    def test_derive_canonical_data_from_gff_and_pep(self):
+        gff_transcripts = derive_canonical_data_from_gff_and_pep.get_gff_transcripts(pd.DataFrame({
+            'transcript_id': ['ENST00000646891', 'ENST00000288602', 'ENST00000479537'],
+            'version': pd.array([2, 11, 6], dtype='Int16'),
+            'is_canonical': [True, False, False]}))
+        self.assertEqual((True, 2), gff_transcripts['ENST00000646891'])
+        pep_proteins = derive_canonical_data_from_gff_and_pep.read_pep_proteins([
+            '>ENSP00000493543.1 pep chromosome:GRCh38:7:140719327:140924929:-1 gene:ENSG00000157764.14 '
+            'transcript:ENST00000646891.2 gene_biotype:protein_coding\n', 'MAALSGGGGG\n', 'GAEPGQ*\n',
+            '>ENSP00000288602.7 pep chromosome:GRCh38:7:140734597:140924929:-1 gene:ENSG00000157764.14 '
+            'transcript:ENST00000288602.11\n', 'MAALS\n'])
+        transcript_info = derive_canonical_data_from_gff_and_pep.get_transcript_info(
+            ['ENST00000646891', 'ENST00000288602', 'ENST00000479537', 'ENST00000000000'], gff_transcripts, pep_proteins)
+
+        self.assertEqual(['1', '0', '0', '0'], list(transcript_info['is_canonical']))
+        self.assertEqual([2, 11, 6, None], list(transcript_info['transcript_id_version'].astype(object).where(
+            transcript_info['transcript_id_version'].notna(), None)))
+        self.assertEqual(['ENSP00000493543', 'ENSP00000288602', None, None], list(transcript_info['protein_stable_id']))
+        self.assertEqual([16, 5], list(transcript_info['protein_length'][:2]))
+        self.assertEqual(2, transcript_info['protein_length'].isna().sum())
+
+    def test_add_nested_transcript_info(self):
+        columns = ['transcript_id', 'type', 'id', 'start', 'end', 'rank', 'strand', 'version']
+        rows = [['ENST00000456328', 'exon', 'ENSE00002234944', '11869', '12227', '1', '1', '1'],
+                ['ENST00000456328', 'exon', 'ENSE00003582793', '12613', '12721', '2', '1', '1'],
+                ['ENST00000456328', 'five_prime_UTR', None, '11869', '12009', None, '1', None],
+                ['ENST00000450305', 'three_prime_UTR', None, '12010', '12057', None, '1', None],
+                ['ENST00000456328', 'exon', 'ENSE00002312635', '13221', '14409', '3', '1', '1'],
+                ['ENST00000000000', 'exon', 'ENSE00000000001', '1', '2', '1', '1', '1']]
+        transcripts = pd.DataFrame({'exons': np.nan, 'utrs': np.nan},
+                                   index=pd.Index(['ENST00000456328', 'ENST00000450305', 'ENST00000488147'],
+                                                  name='transcript_stable_id'))
+        # a transcript split over chunks and rows of a transcript that are not together within a batch
+        chunks = [pd.DataFrame(rows[:1], columns=columns), pd.DataFrame(rows[1:], columns=columns)]
+        batches = list(add_transcript_info.iter_transcript_batches(transcripts, chunks, batch_size=2))
+        # the transcripts with exons or UTRs, then the rest. Unknown transcripts are left out
+        self.assertEqual([['ENST00000456328', 'ENST00000450305'], ['ENST00000488147']], [list(batch.index) for batch in batches])
+        nested = pd.concat(batches)
+        exons = nested.loc['ENST00000456328', 'exons']
+        self.assertEqual(['1', '2', '3'], [exon['rank'] for exon in exons])
+        self.assertEqual({'id': 'ENSE00002234944', 'start': '11869', 'end': '12227', 'rank': '1', 'strand': '1', 'version': '1'}, exons[0])
+        self.assertEqual(['five_prime_UTR'], [utr['type'] for utr in nested.loc['ENST00000456328', 'utrs']])
+        # no exons or UTRs
+        self.assertTrue(pd.isna(nested.loc['ENST00000450305', 'exons']))
+        self.assertTrue(pd.isna(nested.loc['ENST00000488147', 'utrs']))
+
+        # a batch is yielded once the rows of the next transcript begin, before the rest is read
+        chunks_read = []
+
+        def read_chunks():
+            for row in rows[3:] + [rows[-1]] * 3:
+                chunks_read.append(row[0])
+                yield pd.DataFrame([row], columns=columns)
+
+        batches = add_transcript_info.iter_transcript_batches(transcripts, read_chunks(), batch_size=1)
+        self.assertEqual(['ENST00000450305'], list(next(batches).index))
+        self.assertEqual(['ENST00000450305', 'ENST00000456328', 'ENST00000000000'], chunks_read)
+        # rows of a transcript in different batches
+        chunks = [pd.DataFrame(rows, columns=columns)]
+        with self.assertRaises(ValueError):
+            list(add_transcript_info.iter_transcript_batches(transcripts, chunks, batch_size=1))